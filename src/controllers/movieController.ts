@@ -2,7 +2,7 @@
 
 import { Request, Response } from 'express';
 import Movie from '../models/Movie';
-import { runPythonScript } from '../services/pythonService'; // Import hàm từ service
+import { runPythonScript, streamPythonScript } from '../services/pythonService'; // Import hàm từ service
 
 // Hàm xử lý việc lấy danh sách phim (không thay đổi)
 export const getMovies = async (req: Request, res: Response) => {
@@ -39,10 +39,38 @@ export const getMovies = async (req: Request, res: Response) => {
     }
 };
 
+// compact=true: bỏ plot/fullplot khỏi kết quả gợi ý (dùng cho các trang danh sách)
+export const isCompact = (req: Request): boolean => req.query.compact === 'true' || req.query.compact === '1';
+
+// timings=true: thêm khối "timings" (thời gian từng giai đoạn trong Python) vào phản hồi;
+// profile=true: kèm các stack lấy mẫu (chỉ khi Python chạy với RECOMMENDER_PROFILING=1)
+export const timingOptions = (req: Request) => ({
+    timings: req.query.timings === 'true' || req.query.timings === '1',
+    profile: req.query.profile === 'true' || req.query.profile === '1'
+});
+
+// Số gợi ý tối đa của mỗi truy vấn (route đơn lẻ và từng truy vấn trong lô)
+const MAX_RECOMMENDATIONS = 100;
+
+// num_rec / num_recommendations do client gửi: số nguyên trong [1, MAX_RECOMMENDATIONS], mặc định 10
+export const recommendationCount = (value: any): number => {
+    const parsed = parseInt(String(value ?? ''), 10);
+    return Number.isNaN(parsed) ? 10 : Math.min(Math.max(parsed, 1), MAX_RECOMMENDATIONS);
+};
+
+// Tín hiệu hủy yêu cầu Python khi client ngắt kết nối trước khi nhận đủ phản hồi
+export const abortOnClose = (res: Response): AbortSignal => {
+    const controller = new AbortController();
+    res.on('close', () => {
+        if (!res.writableFinished) controller.abort();
+    });
+    return controller.signal;
+};
+
 // Hàm xử lý việc lấy gợi ý phim theo ID
 export const getMovieRecommendations = async (req: Request, res: Response) => {
     const { id } = req.params;
-    const numRecommendations = parseInt(req.query.num_rec as string) || 10;
+    const numRecommendations = recommendationCount(req.query.num_rec);
 
     if (!id) {
         return res.status(400).json({ message: "Vui lòng cung cấp ID phim để nhận gợi ý." });
@@ -52,8 +80,10 @@ export const getMovieRecommendations = async (req: Request, res: Response) => {
         // Gọi hàm từ service
         const result = await runPythonScript('movie_recommender.py', {
             movie_id: id,
-            num_recommendations: numRecommendations
-        });
+            num_recommendations: numRecommendations,
+            compact: isCompact(req),
+            ...timingOptions(req)
+        }, { signal: abortOnClose(res) });
 
         if (result.error) {
             return res.status(400).json({ message: result.error });
@@ -68,7 +98,7 @@ export const getMovieRecommendations = async (req: Request, res: Response) => {
 // Hàm xử lý việc lấy gợi ý phim theo từ khóa tìm kiếm
 export const searchMovieRecommendations = async (req: Request, res: Response) => {
     const { keywords } = req.query;
-    const numRecommendations = parseInt(req.query.num_rec as string) || 10;
+    const numRecommendations = recommendationCount(req.query.num_rec);
 
     if (!keywords || typeof keywords !== 'string' || keywords.trim() === '') {
         return res.status(400).json({ message: "Vui lòng cung cấp từ khóa tìm kiếm." });
@@ -78,8 +108,10 @@ export const searchMovieRecommendations = async (req: Request, res: Response) =>
         // Gọi hàm từ service
         const result = await runPythonScript('movie_recommender.py', {
             search_keywords: keywords,
-            num_recommendations: numRecommendations
-        });
+            num_recommendations: numRecommendations,
+            compact: isCompact(req),
+            ...timingOptions(req)
+        }, { signal: abortOnClose(res) });
 
         if (result.error) {
             return res.status(400).json({ message: result.error });
@@ -90,3 +122,77 @@ export const searchMovieRecommendations = async (req: Request, res: Response) =>
         res.status(500).json(error); // Trả về lỗi đã được định dạng từ hàm runPythonScript
     }
 };
+
+// Số truy vấn tối đa trong một yêu cầu gợi ý theo lô
+const MAX_BATCH_QUERIES = 100;
+
+// Hàm xử lý việc lấy gợi ý cho nhiều truy vấn trong một yêu cầu (ví dụ: các hàng phim của trang chủ)
+// Body: { queries: [...] }, mỗi truy vấn có dạng giống các route đơn lẻ:
+//   { movie_id } | { search_keywords } | { user_preferences }         -> movie_recommender.py
+//   { type: 'preference', genres, cast, ..., min_year, max_year }       -> preference_recommender.py
+// Mỗi script được gọi một lần cho cả nhóm truy vấn của nó; kết quả trả về theo đúng thứ tự.
+export const getBatchRecommendations = async (req: Request, res: Response) => {
+    const queries = req.body?.queries;
+
+    if (!Array.isArray(queries) || queries.length === 0) {
+        return res.status(400).json({ message: "Vui lòng cung cấp danh sách 'queries'." });
+    }
+    if (queries.length > MAX_BATCH_QUERIES) {
+        return res.status(400).json({ message: `Tối đa ${MAX_BATCH_QUERIES} truy vấn trong một yêu cầu.` });
+    }
+
+    const groups: { [script: string]: { positions: number[]; queries: any[] } } = {
+        'movie_recommender.py': { positions: [], queries: [] },
+        'preference_recommender.py': { positions: [], queries: [] }
+    };
+    queries.forEach((query: any, position: number) => {
+        const { type, ...rest } = (query && typeof query === 'object') ? query : { type: undefined };
+        const script = type === 'preference' ? 'preference_recommender.py' : 'movie_recommender.py';
+        groups[script].positions.push(position);
+        groups[script].queries.push({ ...rest, num_recommendations: recommendationCount(rest.num_recommendations) });
+    });
+
+    const signal = abortOnClose(res);
+    const scripts = Object.entries(groups).filter(([, group]) => group.queries.length > 0);
+
+    // stream=true: trả từng kết quả ngay khi Python tính xong, mỗi dòng một JSON
+    // { index, result } (application/x-ndjson) theo thứ tự hoàn thành
+    if (req.query.stream === 'true' || req.query.stream === '1') {
+        res.status(200).type('application/x-ndjson');
+        try {
+            await Promise.all(scripts.map(([script, group]) =>
+                streamPythonScript(script, { queries: group.queries, ...timingOptions(req) }, (partial) => {
+                    partial.results.forEach((result: any, i: number) => {
+                        res.write(JSON.stringify({ index: group.positions[partial.offset + i], result }) + '\n');
+                    });
+                }, { signal })
+            ));
+        } catch (error: any) {
+            console.error("Lỗi trong getBatchRecommendations:", error);
+            res.write(JSON.stringify({ error }) + '\n');
+        }
+        res.end();
+        return;
+    }
+
+    try {
+        const results: any[] = new Array(queries.length);
+        const timings: { [script: string]: any } = {};
+        await Promise.all(scripts.map(async ([script, group]) => {
+            const result = await runPythonScript(script, { queries: group.queries, ...timingOptions(req) }, { signal });
+            if (result.error) {
+                throw { message: result.error };
+            }
+            group.positions.forEach((position, i) => {
+                results[position] = result.results[i];
+            });
+            if (result.timings) {
+                timings[script] = result.timings;
+            }
+        }));
+        res.json(Object.keys(timings).length ? { results, timings } : { results });
+    } catch (error: any) {
+        console.error("Lỗi trong getBatchRecommendations:", error);
+        res.status(500).json(error); // Trả về lỗi đã được định dạng từ hàm runPythonScript
+    }
+};
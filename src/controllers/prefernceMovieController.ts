@@ -2,6 +2,7 @@
 
 import { Request, Response } from 'express';
 import { runPythonScript } from '../services/pythonService';
+import { abortOnClose, isCompact, recommendationCount, timingOptions } from './movieController';
 
 export const getPreferenceRecommendations = async (req: Request, res: Response) => {
     const {
@@ -16,7 +17,7 @@ export const getPreferenceRecommendations = async (req: Request, res: Response)
         max_year
     } = req.query;
 
-    const numRecommendations = parseInt(num_rec as string) || 10;
+    const numRecommendations = recommendationCount(num_rec);
     // Chuyển đổi năm sang số, nếu không có thì là undefined
     const minYear = min_year ? parseInt(min_year as string) : undefined;
     const maxYear = max_year ? parseInt(max_year as string) : undefined;
@@ -46,9 +47,12 @@ export const getPreferenceRecommendations = async (req: Request, res: Response)
         return res.status(400).json({ message: "Vui lòng nhập ít nhất một tiêu chí sở thích để nhận gợi ý." });
     }
 
+    inputData.compact = isCompact(req);
+    Object.assign(inputData, timingOptions(req));
+
     try {
         // Gọi script Python preference_recommender.py thông qua service
-        const result = await runPythonScript('preference_recommender.py', inputData);
+        const result = await runPythonScript('preference_recommender.py', inputData, { signal: abortOnClose(res) });
 
         // Xử lý kết quả từ script Python
         if (result.error) {
@@ -0,0 +1,304 @@
+# src/ml/benchmark.py
+"""
+Benchmark movie_recommender và preference_recommender trên danh mục giả lập.
+
+Với mỗi kích thước danh mục và mỗi mô hình, một tiến trình con riêng (để đo RSS đỉnh
+của đúng lần chạy đó):
+- sinh danh mục bằng synthetic_catalog.py, nạp bằng bộ nạp trong bộ nhớ ("memory",
+  mặc định) hoặc qua một collection mongomock ("mongomock", đi qua catalog.load_table
+  như khi đọc MongoDB thật);
+- đo thời gian build mô hình;
+- đo từng loại truy vấn (movie: by_id, keywords, preferences; preference: preferences):
+  độ trễ p50/p99 của từng truy vấn riêng lẻ (lập kế hoạch, chấm điểm, dựng và tuần tự
+  hóa phản hồi; không qua cache kết quả trừ khi có --cache), thông lượng khi chạy tuần
+  tự và khi chạy theo lô --batch-size truy vấn.
+
+Kết quả là một JSON (stdout hoặc --output) kèm commit git và phiên bản thư viện, để so
+sánh giữa các commit: --compare <kết quả cũ> thêm tỉ lệ mới/cũ của từng chỉ số, và với
+--tolerance trả mã lỗi 1 khi có chỉ số chậm/tốn hơn quá ngưỡng.
+
+    python3 src/ml/benchmark.py                                  # 10k, 100k, 1M phim
+    python3 src/ml/benchmark.py --rows 10000 --output bench.json
+    python3 src/ml/benchmark.py --rows 10000 --compare bench.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import catalog
+import feature_engine
+import movie_recommender
+import payload_store
+import preference_recommender
+import result_cache
+import synthetic_catalog
+
+DEFAULT_ROWS = (10000, 100000, 1000000)
+DEFAULT_QUERIES = 200
+DEFAULT_BATCH_SIZE = 32
+
+# Các chỉ số được so sánh với --compare: càng nhỏ càng tốt
+COMPARED_METRICS = ("load_seconds", "build_seconds", "peak_rss_bytes")
+COMPARED_QUERY_METRICS = ("p50_ms", "p99_ms")
+
+
+# --- NẠP DANH MỤC ---
+
+def _load_from_collection(name, collection):
+    # Hai script dùng chung một kho đặc trưng nên nạp cùng một bảng (xem feature_engine.py)
+    return catalog.load_table(collection, feature_engine.PROJECTION, feature_engine.FIELD_NORMALIZERS,
+                              feature_engine.NUMERIC_FIELDS, vector_fields=feature_engine.VECTOR_FIELDS)
+
+
+def load_catalog(name, rows, loader, seed, embedding_dim):
+    """Trả về (MovieTable, thống kê thời gian nạp)."""
+    prepare = feature_engine.prepare_table
+    if loader == 'memory':
+        started = time.perf_counter()
+        table = prepare(synthetic_catalog.generate_movies(rows, seed, embedding_dim))
+        return table, {"load_seconds": time.perf_counter() - started}
+
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("Bộ nạp 'mongomock' cần gói mongomock (pip install mongomock).")
+    collection = mongomock.MongoClient()['benchmark']['embedded_movies']
+    started = time.perf_counter()
+    synthetic_catalog.load_into(collection, rows, seed, embedding_dim=embedding_dim)
+    seeded = time.perf_counter()
+    table = _load_from_collection(name, collection)
+    return table, {"seed_seconds": seeded - started, "load_seconds": time.perf_counter() - seeded}
+
+
+# --- TRUY VẤN ---
+
+def make_queries(name, table, n_queries, seed):
+    """{loại truy vấn: [truy vấn]} dựng từ các phim ngẫu nhiên của danh mục."""
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.integers(0, len(table), n_queries).tolist()
+    if name == 'preference':
+        return {"preferences": [
+            {"genres": ",".join(table['genres'][row]), "cast": ",".join(table['cast'][row][:2]),
+             "min_year": 1980}
+            for row in rows
+        ]}
+    return {
+        "by_id": [{"movie_id": str(table['id'][row])} for row in rows],
+        "keywords": [
+            {"search_keywords": " ".join(table['genres'][row][:1] + table['cast'][row][:1]
+                                         + table['plot'][row].split()[:3])}
+            for row in rows
+        ],
+        "preferences": [
+            {"user_preferences": {"genres": table['genres'][row], "cast": table['cast'][row][:2],
+                                  "min_year": 1980}}
+            for row in rows
+        ],
+    }
+
+
+def build(name, table, workers):
+    """Build và cài đặt mô hình; trả về mô hình đang phục vụ."""
+    if name == 'movie':
+        model = movie_recommender.build_model(table, workers)
+        movie_recommender.install_model(model)
+        return model
+    return preference_recommender.train_from_table(table, workers)
+
+
+def answer(name, model, queries):
+    """Phản hồi (đã tuần tự hóa JSON) của một lô truy vấn, như đường đi của handle_request."""
+    if name == 'movie':
+        plans = [movie_recommender.plan_query(model, query)[0] for query in queries]
+        responses = movie_recommender.run_plans(model, plans)
+    else:
+        plans = [preference_recommender.plan_preference_query(model, **preference_recommender.query_arguments(query))[0]
+                 for query in queries]
+        responses = preference_recommender.run_plans(model, plans)
+    return [payload_store.dumps(response) for response in responses]
+
+
+def time_queries(name, model, queries, batch_size):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        answer(name, model, [query])
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        answer(name, model, queries[start:start + batch_size])
+    batch_seconds = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "count": len(queries),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "throughput_qps": len(queries) / max(sum(latencies), 1e-9),
+        "batch_throughput_qps": len(queries) / max(batch_seconds, 1e-9),
+    }
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss là KiB trên Linux, byte trên macOS
+    return int(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def run_single(args):
+    """Một mô hình trên một kích thước danh mục (chạy trong tiến trình con)."""
+    name = args.single
+    if not args.cache:
+        # ResultCache không có tầng nào = tắt cache, mọi truy vấn đều được chấm điểm
+        movie_recommender._cache = result_cache.ResultCache()
+        preference_recommender._cache = result_cache.ResultCache()
+
+    table, load_stats = load_catalog(name, args.rows[0], args.loader, args.seed, args.embedding_dim)
+    started = time.perf_counter()
+    model = build(name, table, args.workers)
+    build_seconds = time.perf_counter() - started
+
+    queries = {kind: time_queries(name, model, kind_queries, args.batch_size)
+               for kind, kind_queries in make_queries(name, table, args.queries, args.seed).items()}
+    return {
+        "recommender": name,
+        "rows": len(table),
+        **load_stats,
+        "build_seconds": build_seconds,
+        "feature_matrix": {"shape": list(model["feature_matrix"].shape), "nnz": int(model["feature_matrix"].nnz),
+                           "dtype": str(model["feature_matrix"].dtype)},
+        "queries": queries,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+# --- KẾT QUẢ ---
+
+def _version(module_name):
+    try:
+        return __import__(module_name).__version__
+    except Exception:
+        return None
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "git_commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "libraries": {name: _version(name) for name in ("numpy", "scipy", "sklearn")},
+    }
+
+
+def compare(results, baseline):
+    """Tỉ lệ mới/cũ của từng chỉ số cho các cặp (mô hình, số dòng) có trong cả hai kết quả."""
+    previous = {(result["recommender"], result["rows"]): result for result in baseline["results"]}
+    ratios = []
+    for result in results:
+        old = previous.get((result["recommender"], result["rows"]))
+        if old is None:
+            continue
+        pairs = [(metric, result.get(metric), old.get(metric)) for metric in COMPARED_METRICS]
+        for kind, stats in result["queries"].items():
+            old_stats = old.get("queries", {}).get(kind, {})
+            pairs += [(f"{kind}.{metric}", stats.get(metric), old_stats.get(metric)) for metric in COMPARED_QUERY_METRICS]
+        for metric, new_value, old_value in pairs:
+            if new_value is not None and old_value:
+                ratios.append({"recommender": result["recommender"], "rows": result["rows"], "metric": metric,
+                               "baseline": old_value, "current": new_value, "ratio": new_value / old_value})
+    return ratios
+
+
+def run_suite(args):
+    results = []
+    for rows in args.rows:
+        for name in args.recommenders:
+            command = [sys.executable, os.path.abspath(__file__), "--single", name, "--rows", str(rows),
+                       "--loader", args.loader, "--seed", str(args.seed), "--queries", str(args.queries),
+                       "--batch-size", str(args.batch_size), "--embedding-dim", str(args.embedding_dim)]
+            if args.workers is not None:
+                command += ["--workers", str(args.workers)]
+            if args.cache:
+                command.append("--cache")
+            print(f"[benchmark] {name}: {rows} phim...", file=sys.stderr)
+            completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+            if completed.returncode != 0:
+                sys.exit(f"[benchmark] {name} với {rows} phim thất bại (mã {completed.returncode}).")
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "environment": environment(),
+        "config": {"loader": args.loader, "seed": args.seed, "queries": args.queries, "batch_size": args.batch_size,
+                   "workers": args.workers, "cache": args.cache, "embedding_dim": args.embedding_dim},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(results, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recommenders on synthetic catalogs.")
+    parser.add_argument('--rows', type=lambda value: [int(part) for part in value.split(',')],
+                        default=list(DEFAULT_ROWS), help="Comma-separated catalog sizes (default: 10000,100000,1000000).")
+    parser.add_argument('--recommenders', type=lambda value: value.split(','), default=['movie', 'preference'],
+                        help="Comma-separated subset of: movie, preference.")
+    parser.add_argument('--loader', choices=['memory', 'mongomock'], default='memory')
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES, help="Queries timed per query kind.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Queries per batch for batch throughput.")
+    parser.add_argument('--workers', type=int, default=None, help="Build/scoring workers (see parallel.py).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embedding-dim', type=int, default=0, help="Generate plot_embedding vectors of this size.")
+    parser.add_argument('--cache', action='store_true', help="Keep the result cache enabled while timing queries.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--compare', help="Previous JSON report to compare against.")
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help="With --compare, exit with status 1 when a metric grows by more than this fraction.")
+    parser.add_argument('--single', choices=['movie', 'preference'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.recommenders if name not in ('movie', 'preference')]
+    if unknown:
+        parser.error(f"Unknown recommender(s): {', '.join(unknown)}")
+
+    if args.single:
+        print(json.dumps(run_single(args)))
+        sys.exit(0)
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    regressions = [item for item in report.get("comparison", [])
+                   if args.tolerance is not None and item["ratio"] > 1 + args.tolerance]
+    for item in regressions:
+        print(f"[benchmark] Chậm hơn: {item['recommender']} {item['rows']} {item['metric']} "
+              f"x{item['ratio']:.2f}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
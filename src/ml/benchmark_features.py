@@ -0,0 +1,78 @@
+# src/ml/benchmark_features.py
+"""
+So sánh mã hóa đặc trưng hiện tại với chế độ gọn (features.py) trên danh mục thật.
+
+Với mỗi cấu hình: thời gian build, dung lượng ma trận (features.memory_report), độ trễ
+chấm điểm của các truy vấn theo ID (p50/p99, không qua cache kết quả) và tỉ lệ trùng
+top-K so với cấu hình gốc. In kết quả dạng JSON.
+
+    MONGODB_URI=... python3 src/ml/benchmark_features.py --queries 200 --min-label-count 3
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+
+import features
+import movie_recommender
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def run_config(table, movie_ids, compact_mode, field_weights, workers, k):
+    started = time.perf_counter()
+    model = movie_recommender.build_model(table, workers, compact_mode=compact_mode, field_weights=field_weights)
+    build_seconds = time.perf_counter() - started
+
+    latencies, top_ids = [], []
+    for movie_id in movie_ids:
+        plan, _ = movie_recommender.plan_query(model, {"movie_id": str(movie_id), "num_recommendations": k})
+        plan["k"] = k
+        started = time.perf_counter()
+        top_indices, _ = model["retriever"].rank([plan])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        top_ids.append({table['id'][i] for i in top_indices})
+
+    return {
+        "build_seconds": round(build_seconds, 3),
+        "memory": model["memory"],
+        "latency_ms": {"p50": _percentile(latencies, 50), "p99": _percentile(latencies, 99)},
+    }, top_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compact feature encoding against the current one.")
+    parser.add_argument('--queries', type=int, default=100, help="Number of by-id queries to time.")
+    parser.add_argument('--k', type=int, default=10, help="Recommendations per query.")
+    parser.add_argument('--min-label-count', type=int, default=None,
+                        help="RECOMMENDER_MIN_LABEL_COUNT used by the compact configuration.")
+    parser.add_argument('--field-weights', default=None,
+                        help='Field weights for the compact configuration, e.g. "genres=2,cast=0.5".')
+    parser.add_argument('--workers', type=int, default=None, help="Processes used to fit the encoders.")
+    args = parser.parse_args()
+
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        sys.exit("Biến môi trường MONGODB_URI không được thiết lập.")
+    if args.min_label_count is not None:
+        os.environ["RECOMMENDER_MIN_LABEL_COUNT"] = str(args.min_label_count)
+
+    table = movie_recommender.load_movies_data(mongodb_uri)
+    if not len(table):
+        sys.exit("Không tìm thấy dữ liệu phim trong collection 'embedded_movies'.")
+    movie_ids = random.Random(0).sample(list(table['id']), min(args.queries, len(table)))
+
+    field_weights = features.parse_field_weights(args.field_weights)
+    baseline, baseline_ids = run_config(table, movie_ids, False, {}, args.workers, args.k)
+    compact, compact_ids = run_config(table, movie_ids, True, field_weights, args.workers, args.k)
+    overlap = [len(a & b) / max(len(a), 1) for a, b in zip(baseline_ids, compact_ids)]
+    compact["topk_overlap"] = float(np.mean(overlap)) if overlap else None
+    compact["memory_ratio"] = round(compact["memory"]["total_bytes"] / max(baseline["memory"]["total_bytes"], 1), 4)
+
+    print(json.dumps({"rows": len(table), "baseline": baseline, "compact": compact}, indent=2))
@@ -0,0 +1,82 @@
+# src/ml/build_index.py
+"""
+Build offline cho các mô hình gợi ý.
+
+Tải dữ liệu từ MongoDB, fit các bộ mã hóa, tạo ma trận đặc trưng rồi ghi thành một
+phiên bản artifact mới qua model_store. Các tiến trình truy vấn (script hoặc
+recommender_server.py) sẽ tải phiên bản CURRENT thay vì fit lại mỗi lần.
+
+Hai script gợi ý dùng chung một kho đặc trưng (feature_engine.py, artifact 'features');
+tên 'movie' và 'preference' vẫn được chấp nhận. 'similar' tính bảng phim tương tự cho
+gợi ý theo ID (similar_movies.py) trên kho đặc trưng CURRENT, nên được build sau 'features'.
+
+    python3 src/ml/build_index.py            # build kho đặc trưng rồi bảng phim tương tự
+    python3 src/ml/build_index.py features --workers 8
+    python3 src/ml/build_index.py similar --k 50 --collection movie_similar
+"""
+import sys
+import os
+import json
+import argparse
+
+import feature_engine
+import movie_recommender
+import preference_recommender
+import similar_movies
+
+
+def build_feature_index(workers=None):
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise ValueError("Biến môi trường MONGODB_URI không được thiết lập.")
+
+    table = feature_engine.load_table(mongodb_uri)
+    if not len(table):
+        raise ValueError("Không tìm thấy dữ liệu phim trong collection 'embedded_movies'.")
+
+    store = feature_engine.build_store(table, workers)
+    # Kết quả JSON dựng sẵn của hai script được lưu cùng kho, tiến trình phục vụ chỉ memory-map
+    payloads = {
+        script.ARTIFACT_NAME: script.build_payloads(store) for script in (movie_recommender, preference_recommender)
+    }
+    return feature_engine.save_store(store, payloads)
+
+
+def build_similar_index(workers=None, k=None, collection=None):
+    store = feature_engine.load_saved_store()
+    if store is None:
+        raise ValueError("Chưa có artifact 'features'; hãy build 'features' trước.")
+    return similar_movies.save_table(store, k, collection)
+
+
+BUILDERS = {
+    'features': build_feature_index,
+    'similar': build_similar_index,
+}
+# Tên cũ của các artifact riêng của từng script
+ALIASES = {
+    'movie': 'features',
+    'preference': 'features',
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build recommender model artifacts.")
+    parser.add_argument('models', nargs='*', help=f"Models to build: {', '.join(sorted(BUILDERS))} (default: all).")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processes used to fit the encoders (default: RECOMMENDER_CPU_WORKERS or CPU count).")
+    parser.add_argument('--k', type=int, default=None,
+                        help="Neighbors stored per movie by 'similar' (default: RECOMMENDER_SIMILAR_K or 50).")
+    parser.add_argument('--collection', default=None,
+                        help="Also bulk-write 'similar' results to this collection (default: RECOMMENDER_SIMILAR_COLLECTION).")
+    args = parser.parse_args()
+    options = {'similar': {'k': args.k, 'collection': args.collection}}
+
+    unknown = [name for name in args.models if name not in BUILDERS and name not in ALIASES]
+    if unknown:
+        parser.error(f"Unknown model(s): {', '.join(unknown)}")
+
+    versions = {}
+    for name in dict.fromkeys(ALIASES.get(name, name) for name in args.models or sorted(BUILDERS)):
+        versions[name] = BUILDERS[name](args.workers, **options.get(name, {}))
+    print(json.dumps({"versions": versions}))
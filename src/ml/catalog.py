@@ -0,0 +1,373 @@
+# src/ml/catalog.py
+"""
+Tải danh mục phim từ MongoDB theo luồng, lưu dưới dạng cột.
+
+- Cursor được đọc theo lô lớn (batch_size), hoặc với raw_batches=True thì dùng
+  find_raw_batches và tự giải mã BSON từng lô.
+- Mỗi document được chuẩn hóa ngay khi đọc và đẩy vào các cột của MovieTable: cột
+  danh sách/văn bản là list Python, cột số là mảng NumPy float64 (NaN = thiếu).
+  Không có list document tạm hay DataFrame trung gian.
+- Cột vector (ví dụ plot_embedding) được gom thành một ma trận float32 liền khối N x d,
+  mỗi dòng đã chuẩn hóa L2 (dòng 0 = phim không có vector).
+- encode_labels() mã hóa one-hot một cột danh sách thẳng thành ma trận CSR trong một lượt,
+  không tạo ma trận dày N x số nhãn như MultiLabelBinarizer.fit_transform.
+- Bảng tải từ artifact (model_store.py) dùng các cột trên mảng .npy memory-map thay cho
+  list Python: ObjectIdColumn, ListColumn (nhãn mã hóa số nguyên) và BlobColumn (mỗi dòng
+  một giá trị BSON). Giá trị chỉ được giải mã khi dòng đó được đọc; IdIndex thay cho
+  dict id -> dòng.
+"""
+import math
+
+import numpy as np
+from bson import BSON, ObjectId, decode_all
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import MultiLabelBinarizer
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+# --- CÁC HÀM CHUẨN HÓA GIÁ TRỊ ---
+
+def as_list(value):
+    return value if isinstance(value, list) else []
+
+
+def as_text(value):
+    return value if isinstance(value, str) else ''
+
+
+def as_number(value):
+    """Giống pd.to_numeric(errors='coerce'): số hoặc chuỗi số -> float, còn lại -> NaN."""
+    if isinstance(value, bool):
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return math.nan
+    return math.nan
+
+
+def as_vector(value):
+    """Danh sách số -> mảng float32, còn lại -> None."""
+    if isinstance(value, (list, tuple, np.ndarray)) and len(value):
+        try:
+            return np.asarray(value, dtype=np.float32)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def stack_vectors(vectors, dim=None):
+    """
+    Gom các vector (hoặc None) thành ma trận float32 liền khối, mỗi dòng chuẩn hóa L2.
+    Vector thiếu hoặc sai số chiều thành dòng 0. dim mặc định là số chiều của vector đầu tiên.
+    """
+    if dim is None:
+        dim = next((vector.size for vector in vectors if vector is not None), 0)
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None and vector.size == dim:
+            matrix[i] = vector
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def _python_number(value):
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+class MovieTable:
+    """
+    Bảng dữ liệu phim dạng cột. columns: tên cột -> list (hoặc mảng NumPy với cột số,
+    ma trận N x d với cột vector), tất cả cùng số dòng và cùng thứ tự dòng với ma trận
+    đặc trưng. Cột 'id' chứa ObjectId.
+    """
+    __slots__ = ("columns", "numeric_fields")
+
+    def __init__(self, columns, numeric_fields=()):
+        self.columns = columns
+        self.numeric_fields = tuple(numeric_fields)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def row(self, i):
+        """Một dòng dưới dạng dict với giá trị Python thuần (cột số: NaN -> None)."""
+        row = {name: column[i] for name, column in self.columns.items()}
+        for name in self.numeric_fields:
+            row[name] = _python_number(float(row[name]))
+        return row
+
+    def take(self, rows):
+        """Bảng mới chỉ gồm các dòng rows (theo thứ tự đã cho)."""
+        columns = {}
+        for name, column in self.columns.items():
+            columns[name] = column[rows] if isinstance(column, np.ndarray) else [column[i] for i in rows]
+        return MovieTable(columns, self.numeric_fields)
+
+    def concat(self, other):
+        columns = {}
+        for name, column in self.columns.items():
+            if isinstance(column, np.ndarray):
+                other_column = other.columns[name]
+                if column.ndim == 2 and other_column.shape[1] != column.shape[1]:
+                    # Lô mới không có vector nào: thêm dòng 0 cùng số chiều
+                    other_column = stack_vectors([None] * len(other_column), column.shape[1])
+                columns[name] = np.concatenate([column, other_column])
+            else:
+                columns[name] = list(column) + list(other.columns[name])
+        return MovieTable(columns, self.numeric_fields)
+
+
+# --- CỘT TRÊN MẢNG .npy (TẢI TỪ ARTIFACT) ---
+
+class ObjectIdColumn:
+    """Cột 'id' trên mảng chuỗi hex (U24): ObjectId được tạo khi dòng được đọc."""
+    __slots__ = ("ids",)
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return ObjectId(str(self.ids[i]))
+
+    def __iter__(self):
+        return (ObjectId(str(movie_id)) for movie_id in self.ids)
+
+
+class ListColumn:
+    """
+    Cột danh sách chuỗi lưu phẳng: danh sách của dòng i là
+    vocabulary[codes[offsets[i]:offsets[i + 1]]].
+    """
+    __slots__ = ("vocabulary", "codes", "offsets")
+
+    def __init__(self, vocabulary, codes, offsets):
+        self.vocabulary = vocabulary
+        self.codes = codes
+        self.offsets = offsets
+
+    @staticmethod
+    def pack(lists):
+        """(vocabulary, codes, offsets) của một cột danh sách chuỗi."""
+        ids = {}
+        codes = [ids.setdefault(item, len(ids)) for items in lists for item in items]
+        offsets = np.concatenate([[0], np.cumsum([len(items) for items in lists])]).astype(np.int64)
+        return np.array(list(ids), dtype=str), np.array(codes, dtype=np.int32), offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.vocabulary[self.codes[self.offsets[i]:self.offsets[i + 1]]].tolist()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class BlobColumn:
+    """
+    Cột giá trị bất kỳ: giá trị của dòng i là document BSON {"v": giá trị} nằm ở
+    blob[offsets[i]:offsets[i + 1]] (mảng uint8), giải mã khi dòng được đọc.
+    """
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @staticmethod
+    def pack(values):
+        """(blob, offsets) của một cột."""
+        return pack_bytes(BSON.encode({"v": value}) for value in values)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return BSON(self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()).decode()["v"]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def pack_bytes(chunks):
+    """Nối các chuỗi byte thành (blob uint8, offsets int64): chuỗi i là blob[offsets[i]:offsets[i + 1]]."""
+    chunks = list(chunks)
+    offsets = np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks])]).astype(np.int64)
+    return np.frombuffer(b"".join(chunks), dtype=np.uint8), offsets
+
+
+def id_strings(ids):
+    """Mảng chuỗi hex (U24) của một cột 'id'."""
+    if isinstance(ids, ObjectIdColumn):
+        return ids.ids
+    return np.array([str(movie_id) for movie_id in ids], dtype="U24")
+
+
+class IdIndex:
+    """
+    Chỉ mục id -> dòng bằng tìm kiếm nhị phân trên mảng id (chuỗi hex) theo thứ tự order,
+    dùng như dict (in, [], get). Id trùng nhau: dòng đầu tiên.
+    """
+    __slots__ = ("ids", "order")
+
+    def __init__(self, ids, order=None):
+        self.ids = ids
+        self.order = np.argsort(ids, kind="stable") if order is None else order
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, movie_ids):
+        """Dòng của từng id (chuỗi hex) trong movie_ids, -1 nếu không có."""
+        movie_ids = np.asarray(movie_ids, dtype="U24")
+        if not len(self.ids):
+            return np.full(len(movie_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, movie_ids, sorter=self.order), len(self.ids) - 1)
+        rows = np.asarray(self.order[positions], dtype=np.int64)
+        return np.where(self.ids[rows] == movie_ids, rows, -1)
+
+    def get(self, movie_id, default=None):
+        row = int(self.rows([str(movie_id)])[0])
+        return default if row < 0 else row
+
+    def __contains__(self, movie_id):
+        return self.get(movie_id) is not None
+
+    def __getitem__(self, movie_id):
+        row = self.get(movie_id)
+        if row is None:
+            raise KeyError(movie_id)
+        return row
+
+
+class MovieTableBuilder:
+    """
+    Nhận document theo từng lô và đẩy vào các cột.
+    normalizers: tên trường -> hàm chuẩn hóa; trường không có trong normalizers giữ nguyên giá trị.
+    """
+
+    def __init__(self, fields, normalizers=None, numeric_fields=(), vector_fields=()):
+        self.fields = [field for field in fields if field != '_id']
+        self.normalizers = dict(normalizers or {})
+        self.numeric_fields = tuple(numeric_fields)
+        self.vector_fields = tuple(vector_fields)
+        for field in self.numeric_fields:
+            self.normalizers[field] = as_number
+        for field in self.vector_fields:
+            self.normalizers[field] = as_vector
+        self.columns = {'id': []}
+        for field in self.fields:
+            self.columns[field] = []
+
+    def add(self, documents):
+        ids = self.columns['id']
+        for doc in documents:
+            ids.append(doc.get('_id'))
+            for field in self.fields:
+                value = doc.get(field)
+                normalizer = self.normalizers.get(field)
+                self.columns[field].append(normalizer(value) if normalizer else value)
+
+    def build(self):
+        columns = dict(self.columns)
+        for field in self.numeric_fields:
+            columns[field] = np.array(columns[field], dtype=np.float64)
+        for field in self.vector_fields:
+            columns[field] = stack_vectors(columns[field])
+        return MovieTable(columns, self.numeric_fields)
+
+
+def table_from_documents(documents, fields, normalizers=None, numeric_fields=(), vector_fields=()):
+    builder = MovieTableBuilder(fields, normalizers, numeric_fields, vector_fields)
+    builder.add(documents)
+    return builder.build()
+
+
+def iter_batches(collection, query, projection, batch_size=DEFAULT_BATCH_SIZE, raw_batches=False):
+    """Đọc cursor theo từng lô document."""
+    if raw_batches:
+        for raw_batch in collection.find_raw_batches(query, projection, batch_size=batch_size):
+            yield decode_all(raw_batch)
+        return
+
+    batch = []
+    for doc in collection.find(query, projection).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_table(collection, projection, normalizers=None, numeric_fields=(), query=None,
+               batch_size=DEFAULT_BATCH_SIZE, raw_batches=False, vector_fields=()):
+    """Tải các phim khớp query (mặc định: tất cả) thành MovieTable, đọc theo lô."""
+    builder = MovieTableBuilder(projection, normalizers, numeric_fields, vector_fields)
+    for batch in iter_batches(collection, query or {}, projection, batch_size, raw_batches):
+        builder.add(batch)
+    return builder.build()
+
+
+def encode_labels(label_lists, min_count=1):
+    """
+    Mã hóa one-hot một cột danh sách nhãn. Trả về (MultiLabelBinarizer đã fit, ma trận CSR).
+    Thứ tự cột giống MultiLabelBinarizer().fit_transform (nhãn được sắp xếp), nên bộ mã hóa
+    trả về dùng được như trước cho transform() lúc truy vấn.
+    min_count > 1: bỏ các nhãn xuất hiện ở ít hơn min_count dòng (không thành cột).
+    """
+    label_ids = {}
+    indices = []
+    indptr = [0]
+    for labels in label_lists:
+        row = {label_ids.setdefault(label, len(label_ids)) for label in labels}
+        indices.extend(row)
+        indptr.append(len(indices))
+
+    indices = np.array(indices, dtype=np.int64)
+    indptr = np.array(indptr, dtype=np.int64)
+    n_rows = len(indptr) - 1
+
+    if min_count > 1:
+        counts = np.bincount(indices, minlength=len(label_ids))
+        label_ids = {label: i for label, i in label_ids.items() if counts[i] >= min_count}
+
+    classes = sorted(label_ids)
+    # Đổi id theo thứ tự gặp sang id theo thứ tự sắp xếp (-1 = nhãn bị bỏ)
+    remap = np.full(len(counts) if min_count > 1 else len(classes), -1, dtype=np.int64)
+    for sorted_id, label in enumerate(classes):
+        remap[label_ids[label]] = sorted_id
+
+    indices = remap[indices]
+    if min_count > 1:
+        kept = indices >= 0
+        row_ids = np.repeat(np.arange(n_rows), np.diff(indptr))
+        indices = indices[kept]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(row_ids[kept], minlength=n_rows))])
+
+    matrix = csr_matrix(
+        (np.ones(len(indices)), indices, indptr),
+        shape=(n_rows, len(classes)),
+    )
+    matrix.sort_indices()
+
+    mlb = MultiLabelBinarizer(classes=classes)
+    mlb.fit([])
+    return mlb, matrix
@@ -0,0 +1,73 @@
+# src/ml/entity_index.py
+"""
+Chỉ mục đảo cho việc nhận diện thực thể (thể loại, diễn viên, đạo diễn...) trong từ khóa tìm kiếm.
+
+Chỉ mục được dựng một lần cùng mô hình: mỗi nhãn của các MultiLabelBinarizer được chuẩn
+hóa thành chuỗi token chữ thường, và cụm token đó trỏ tới (trường, cột) tương ứng.
+Khi tìm kiếm, chỉ cần tra các n-gram của câu truy vấn, nên chi phí tỉ lệ với số token
+của truy vấn thay vì số nhãn trong danh mục, và nhận diện được tên nhiều từ như "Tom Hanks".
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Dấu câu bị bỏ ở hai đầu mỗi token ("hanks," -> "hanks")
+_STRIP_CHARS = ",;:!?\"()[]{}"
+
+
+def tokenize(text):
+    tokens = (token.strip(_STRIP_CHARS) for token in str(text).lower().split())
+    return [token for token in tokens if token]
+
+
+class EntityIndex:
+    """
+    phrases: cụm token chữ thường -> danh sách (trường, chỉ số cột trong bộ mã hóa của trường đó).
+    field_offsets: vị trí cột đầu tiên của mỗi trường trong ma trận đặc trưng tổng hợp.
+    """
+    __slots__ = ("phrases", "max_ngram", "field_offsets")
+
+    def __init__(self, encoders, fields):
+        self.phrases = {}
+        self.field_offsets = {}
+        self.max_ngram = 1
+
+        offset = 0
+        for field in fields:
+            self.field_offsets[field] = offset
+            classes = encoders[field].classes_
+            for col, label in enumerate(classes):
+                tokens = tokenize(label)
+                if not tokens:
+                    continue
+                self.phrases.setdefault(" ".join(tokens), []).append((field, col))
+                self.max_ngram = max(self.max_ngram, len(tokens))
+            offset += len(classes)
+
+    def match(self, text):
+        """Các (trường, cột) có nhãn xuất hiện như một cụm token liên tiếp trong text."""
+        tokens = tokenize(text)
+        matches = set()
+        for start in range(len(tokens)):
+            for n in range(1, min(self.max_ngram, len(tokens) - start) + 1):
+                entries = self.phrases.get(" ".join(tokens[start:start + n]))
+                if entries:
+                    matches.update(entries)
+        return matches
+
+    def match_columns(self, text):
+        """Chỉ số cột (trong ma trận đặc trưng tổng hợp) của các thực thể khớp, tăng dần."""
+        return np.array(sorted(self.field_offsets[field] + col for field, col in self.match(text)), dtype=np.int64)
+
+    def query_vector(self, text, text_vector, width):
+        """
+        Dựng trực tiếp vector truy vấn thưa (1 x width): 1.0 ở các cột thực thể khớp, nối với
+        text_vector (ví dụ vector TF-IDF của truy vấn) nằm ở các cột cuối của ma trận đặc trưng.
+        """
+        entity_columns = self.match_columns(text)
+        text_vector = csr_matrix(text_vector)
+        text_offset = width - text_vector.shape[1]
+
+        columns = np.concatenate([entity_columns, text_vector.indices.astype(np.int64) + text_offset])
+        data = np.concatenate([np.ones(entity_columns.size), text_vector.data])
+        indptr = np.array([0, columns.size])
+        return csr_matrix((data, columns, indptr), shape=(1, width))
@@ -0,0 +1,403 @@
+# src/ml/feature_engine.py
+"""
+Kho đặc trưng dùng chung cho movie_recommender.py và preference_recommender.py.
+
+Trước đây mỗi script tự tải danh mục và fit bộ mã hóa riêng (TF-IDF trên plot + fullplot
+với max_features=5000, và TF-IDF trên plot với min_df=5, max_df=0.8), nên một tiến trình
+phục vụ cả hai phải fit hai lần và giữ hai ma trận đặc trưng. Nay chỉ còn một kho có phiên bản:
+
+- Một MovieTable (hợp các trường của hai script), các bộ mã hóa One-Hot của LIST_FIELDS,
+  một TF-IDF trên plot + fullplot và một ma trận đặc trưng (có thể ở dạng gọn, xem
+  features.py), cùng các cấu trúc dùng lúc truy vấn: chỉ mục id -> dòng, cột số đã sắp
+  xếp cho bộ lọc khoảng, chuẩn L2 của dòng và backend truy hồi (retrieval.py).
+- Ba chế độ truy vấn trên cùng không gian cột: "by_id" (dòng của chính phim), "keyword"
+  và "preference". Mỗi chế độ có trọng số theo trường riêng
+  (RECOMMENDER_FIELD_WEIGHTS_<CHẾ ĐỘ>), nhân vào vector truy vấn bởi weigh_query(); trọng
+  số chung RECOMMENDER_FIELD_WEIGHTS vẫn được nhân vào ma trận lúc build.
+- Nhãn được so khớp nguyên văn hoặc sau khi chuẩn hóa (ví dụ bỏ khoảng trắng như
+  preference_recommender: "Tom Hanks" -> "TomHanks"), xem label_vector().
+- Artifact 'features' trong model_store. incremental_indexer.py cập nhật kho một lần cho
+  cả hai script; mỗi script chỉ giữ phần riêng (kết quả JSON dựng sẵn) và dựng lại phần
+  đó khi phiên bản của kho thay đổi.
+
+Cấu hình:
+    RECOMMENDER_FIELD_WEIGHTS_BY_ID        trọng số theo trường của truy vấn theo ID, ví dụ "genres=2"
+    RECOMMENDER_FIELD_WEIGHTS_KEYWORD      trọng số theo trường của truy vấn từ khóa
+    RECOMMENDER_FIELD_WEIGHTS_PREFERENCE   trọng số theo trường của truy vấn sở thích (cả hai script)
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+from scipy.sparse import hstack, csr_matrix
+
+import catalog
+import features
+import instrumentation
+import model_store
+import mongo_client
+import parallel
+import payload_store
+import ranking
+import retrieval
+from entity_index import EntityIndex
+
+# Tên thư mục artifact của kho trong model_store
+ARTIFACT_NAME = 'features'
+
+LIST_FIELDS = ['genres', 'cast', 'directors', 'writers', 'languages', 'countries']
+TEXT_FIELD = 'plot'
+# Các cột số có thể lọc theo khoảng (năm, thời lượng)
+NUMERIC_FIELDS = ['year', 'runtime']
+MODES = ('by_id', 'keyword', 'preference')
+
+# Các trường cần lấy từ collection 'embedded_movies' (hợp các trường của hai script)
+PROJECTION = {
+    '_id': 1, 'title': 1, 'genres': 1, 'plot': 1, 'fullplot': 1,
+    'cast': 1, 'directors': 1, 'writers': 1, 'awards': 1, 'poster': 1,
+    'languages': 1, 'released': 1, 'lastupdated': 1, 'year': 1, 'imdb': 1,
+    'countries': 1, 'type': 1, 'runtime': 1
+}
+
+# Các trường chỉ dùng cho kết quả; không được tải cùng danh mục khi kết quả được lấy từ
+# MongoDB lúc truy vấn (RECOMMENDER_PAYLOAD_SOURCE=mongo, xem payload_store.py)
+PAYLOAD_ONLY_FIELDS = ['title', 'awards', 'poster', 'released', 'imdb', 'type']
+
+# Kênh dày (tùy chọn): embedding có sẵn trong 'embedded_movies' được tải một lần thành ma trận
+# float32 liền khối và trộn với điểm thưa theo RECOMMENDER_DENSE_WEIGHT (0 = tắt, không tải)
+EMBEDDING_FIELD = os.getenv("RECOMMENDER_EMBEDDING_FIELD", "plot_embedding")
+DENSE_WEIGHT = min(max(float(os.getenv("RECOMMENDER_DENSE_WEIGHT", 0) or 0), 0.0), 1.0)
+VECTOR_FIELDS = [EMBEDDING_FIELD] if DENSE_WEIGHT > 0 else []
+PROJECTION.update({field: 1 for field in VECTOR_FIELDS})
+
+# Chuẩn hóa giá trị khi đọc: thiếu văn bản -> chuỗi rỗng, thiếu danh sách -> danh sách rỗng
+FIELD_NORMALIZERS = {'plot': catalog.as_text, 'fullplot': catalog.as_text}
+FIELD_NORMALIZERS.update({col: catalog.as_list for col in LIST_FIELDS})
+
+MODE_FIELD_WEIGHTS = {
+    mode: features.parse_field_weights(os.getenv(f"RECOMMENDER_FIELD_WEIGHTS_{mode.upper()}"))
+    for mode in MODES
+}
+
+# --- KHO ĐƯỢC CACHE TRONG TIẾN TRÌNH ---
+_store = None
+_store_lock = threading.Lock()
+
+
+def load_table(mongodb_uri):
+    """
+    Tải toàn bộ danh mục thành MovieTable qua client MongoDB dùng chung của tiến trình
+    (đọc cursor theo lô, xem catalog.load_table).
+    """
+    projection = PROJECTION
+    if payload_store.payload_source() == "mongo":
+        projection = {field: 1 for field in PROJECTION if field not in PAYLOAD_ONLY_FIELDS}
+    return catalog.load_table(
+        mongo_client.movies_collection(mongodb_uri), projection, FIELD_NORMALIZERS, NUMERIC_FIELDS,
+        batch_size=int(os.getenv("RECOMMENDER_BATCH_SIZE", catalog.DEFAULT_BATCH_SIZE)),
+        raw_batches=os.getenv("RECOMMENDER_RAW_BATCHES") == "1",
+        vector_fields=VECTOR_FIELDS,
+    )
+
+
+def prepare_table(movies_data):
+    """
+    Chuyển danh sách document phim thành MovieTable đã chuẩn hóa.
+    Dùng cho incremental_indexer.py và MongoPayloadStore.
+    """
+    return catalog.table_from_documents(movies_data, PROJECTION, FIELD_NORMALIZERS, NUMERIC_FIELDS, VECTOR_FIELDS)
+
+
+def plot_text(table):
+    """Văn bản đưa vào TF-IDF của mỗi phim."""
+    return (plot + ' ' + fullplot for plot, fullplot in zip(table['plot'], table['fullplot']))
+
+
+def build_store(table, workers=None, compact_mode=None, field_weights=None):
+    """
+    Huấn luyện các bộ mã hóa trên MovieTable và tạo ma trận đặc trưng.
+    Các bộ mã hóa được fit song song trên tối đa workers tiến trình (xem parallel.py).
+    compact_mode / field_weights: mặc định theo RECOMMENDER_COMPACT_FEATURES và
+    RECOMMENDER_FIELD_WEIGHTS (xem features.py).
+    Trả về kho đã sẵn sàng cho truy vấn (chưa được cài đặt, xem install_store).
+    """
+    field_weights = features.FIELD_WEIGHTS if field_weights is None else field_weights
+    # Chế độ gọn: bỏ các nhãn hiếm của cast/directors/writers ngay khi mã hóa
+    min_counts = {col: features.min_label_count(col, compact_mode) for col in LIST_FIELDS}
+
+    tfidf_plot = parallel.text_encoder(stop_words='english', max_features=5000)
+    with instrumentation.stage("encode"), parallel.build_pool(len(table), workers) as pool:
+        # Mã hóa One-Hot cho các trường dạng mảng (thẳng thành ma trận thưa)
+        encoded_fields = parallel.encode_fields(table, LIST_FIELDS, pool, min_counts)
+
+        # Vector hóa TF-IDF cho các trường văn bản
+        plot_tfidf_matrix = parallel.fit_text(tfidf_plot, plot_text(table), pool)
+
+    mlbs = {col: encoded_fields[col][0] for col in LIST_FIELDS}
+    field_matrices = {col: encoded_fields[col][1] for col in LIST_FIELDS}
+
+    # Ghép nối tất cả các ma trận thành một ma trận đặc trưng lớn, nhân trọng số theo trường
+    # một lần tại đây, rồi chuyển sang float32/int32 nếu ở chế độ gọn
+    feature_matrix = hstack([field_matrices[col] for col in LIST_FIELDS] + [plot_tfidf_matrix]).tocsr()
+    weights = features.column_weights(block_widths(mlbs, feature_matrix), field_weights)
+    feature_matrix = features.compact(features.apply_column_weights(feature_matrix, weights), compact_mode)
+
+    return prepare_store({
+        "version": model_store.new_version(),
+        "table": table,
+        "mlbs": mlbs,
+        "tfidf_plot": tfidf_plot,
+        "feature_matrix": feature_matrix,
+        "field_weights": dict(field_weights),
+    })
+
+
+def block_widths(mlbs, feature_matrix):
+    """[(trường, số cột), ...] theo thứ tự các khối cột của ma trận đặc trưng."""
+    widths = [(col, len(mlbs[col].classes_)) for col in LIST_FIELDS]
+    return widths + [(TEXT_FIELD, feature_matrix.shape[1] - sum(width for _, width in widths))]
+
+
+def prepare_store(store, mode_field_weights=None):
+    """
+    Bổ sung các cấu trúc chỉ dùng lúc truy vấn (không được lưu vào artifact).
+    mode_field_weights: {chế độ: {trường: trọng số}}, mặc định theo RECOMMENDER_FIELD_WEIGHTS_<CHẾ ĐỘ>.
+    """
+    with instrumentation.stage("prepare"):
+        return _prepare_store(store, MODE_FIELD_WEIGHTS if mode_field_weights is None else mode_field_weights)
+
+
+def _prepare_store(store, mode_field_weights):
+    table = store["table"]
+    feature_matrix = store["feature_matrix"]
+    # Các mảng dựng sẵn lưu cùng artifact (load_saved_store): dùng lại thay vì tính lại
+    saved = store.pop("arrays", {})
+    store["indices"] = catalog.IdIndex(catalog.id_strings(table['id']), saved.get("id_order"))
+
+    # Cột số dựng sẵn cho các bộ lọc theo khoảng
+    store["columns"] = {
+        col: ranking.SortedColumn(table[col], saved.get(f"order_{col}")) for col in NUMERIC_FIELDS if col in table
+    }
+
+    # Chuẩn L2 của từng dòng, dùng để tính độ tương đồng Cosine của các truy vấn với toàn bộ
+    # danh mục mà không cần ma trận N x N (xem ranking.cosine_score_blocks)
+    store["row_norms"] = saved["row_norms"] if "row_norms" in saved else ranking.row_norms(feature_matrix)
+
+    # Trọng số theo cột: chung (đã nhân vào ma trận, nhân thêm vào vector truy vấn không lấy
+    # từ ma trận) và của từng chế độ truy vấn (None = không có trọng số)
+    widths = block_widths(store["mlbs"], feature_matrix)
+    store.setdefault("field_weights", {})
+    store["column_weights"] = features.column_weights(widths, store["field_weights"])
+    store["mode_field_weights"] = {mode: dict(mode_field_weights.get(mode, {})) for mode in MODES}
+    store["mode_weights"] = {
+        mode: features.column_weights(widths, weights) for mode, weights in store["mode_field_weights"].items()
+    }
+    # Vị trí bắt đầu của khối cột của từng trường, cho label_vector()
+    offsets = np.concatenate([[0], np.cumsum([width for _, width in widths])])
+    store["offsets"] = {field: int(offset) for (field, _), offset in zip(widths, offsets)}
+    store["label_columns"] = {}
+
+    # Chỉ mục đảo nhãn -> (trường, cột) cho chế độ từ khóa
+    store["entity_index"] = EntityIndex(store["mlbs"], LIST_FIELDS)
+
+    store["memory"] = features.memory_report(feature_matrix)
+    print(f"[feature_engine] Ma trận đặc trưng: {store['memory']['shape']}, {store['memory']['dtype']}, "
+          f"{store['memory']['total_bytes'] / 2 ** 20:.1f} MiB", file=sys.stderr)
+
+    # Ma trận embedding của kênh dày (các dòng đã chuẩn hóa), None nếu kênh dày tắt
+    # hoặc danh mục không có embedding
+    embeddings = table[EMBEDDING_FIELD] if DENSE_WEIGHT > 0 and EMBEDDING_FIELD in table else None
+    store["embeddings"] = embeddings if embeddings is not None and embeddings.shape[1] else None
+
+    # Backend truy hồi: chính xác hoặc ANN (RECOMMENDER_RETRIEVAL, xem retrieval.py)
+    ivf_config = store.pop("ivf_config", None)
+    saved_index = (ivf_config, _prefixed(saved, "ivf_")) if ivf_config is not None else None
+    store["retriever"] = retrieval.from_env(feature_matrix, store["row_norms"], store["embeddings"], DENSE_WEIGHT,
+                                            saved_index)
+    return store
+
+
+def _prefixed(arrays, prefix):
+    """Các mảng có tên bắt đầu bằng prefix, bỏ prefix khỏi tên."""
+    return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+
+
+def label_columns(store, field, normalize=None):
+    """
+    {nhãn đã chuẩn hóa: [cột trong ma trận]} của một trường, dựng một lần cho mỗi kho và
+    mỗi hàm chuẩn hóa. Nhiều nhãn gốc có thể trùng một nhãn đã chuẩn hóa.
+    """
+    key = (field, normalize)
+    columns = store["label_columns"].get(key)
+    if columns is None:
+        columns = {}
+        offset = store["offsets"][field]
+        for col, label in enumerate(store["mlbs"][field].classes_):
+            columns.setdefault(normalize(label) if normalize else label, []).append(offset + col)
+        store["label_columns"][key] = columns
+    return columns
+
+
+def label_vector(store, labels_by_field, normalize=None):
+    """
+    Vector truy vấn thưa (1 x số cột) có giá trị 1 ở cột của mọi nhãn đã biết trong
+    labels_by_field ({trường: [nhãn]}); nhãn được so khớp sau khi qua normalize (nếu có).
+    """
+    columns = set()
+    for field, labels in labels_by_field.items():
+        lookup = label_columns(store, field, normalize)
+        for label in labels or ():
+            columns.update(lookup.get(normalize(label) if normalize else label, ()))
+    columns = np.fromiter(sorted(columns), dtype=np.int64, count=len(columns))
+    data = np.ones(len(columns), dtype=np.float64)
+    return csr_matrix((data, columns, [0, len(columns)]), shape=(1, store["feature_matrix"].shape[1]))
+
+
+def weigh_query(store, vector, mode):
+    """
+    Nhân trọng số của chế độ mode vào vector truy vấn. Vector không lấy từ ma trận
+    (từ khóa, sở thích) được nhân thêm trọng số chung để cùng không gian với các dòng.
+    """
+    if mode != "by_id":
+        vector = features.apply_column_weights(vector, store["column_weights"])
+    return features.apply_column_weights(vector, store["mode_weights"][mode])
+
+
+def text_vector(store, text):
+    """Vector TF-IDF của text, đặt vào khối cột văn bản (1 x số cột)."""
+    encoded = csr_matrix(store["tfidf_plot"].transform([text]))
+    offset = store["offsets"][TEXT_FIELD]
+    return csr_matrix((encoded.data, encoded.indices.astype(np.int64) + offset, [0, encoded.nnz]),
+                      shape=(1, store["feature_matrix"].shape[1]))
+
+
+# --- CÁC CHẾ ĐỘ TRUY VẤN ---
+
+def by_id_vector(store, row):
+    """Vector truy vấn theo ID: chính dòng của phim (đã nhân trọng số chung)."""
+    return weigh_query(store, store["feature_matrix"][row], "by_id")
+
+
+def keyword_vector(store, keywords):
+    """
+    Vector truy vấn từ khóa: thể loại/diễn viên/đạo diễn... (kể cả tên nhiều từ) nhận diện
+    qua chỉ mục đảo, cùng với vector TF-IDF của từ khóa.
+    """
+    query_tfidf = store["tfidf_plot"].transform([keywords])
+    vector = store["entity_index"].query_vector(keywords, query_tfidf, store["feature_matrix"].shape[1])
+    return weigh_query(store, vector, "keyword")
+
+
+def preference_vector(store, labels_by_field, normalize=None, text=None):
+    """
+    Vector truy vấn sở thích: các nhãn trong labels_by_field (xem label_vector), cộng thêm
+    vector TF-IDF của text nếu có.
+    """
+    vector = label_vector(store, labels_by_field, normalize)
+    if text is not None:
+        vector = (vector + text_vector(store, text)).tocsr()
+    return weigh_query(store, vector, "preference")
+
+
+def save_store(store, payloads=None):
+    """
+    Lưu kho vào model_store và trả về tên phiên bản mới. Cùng với bảng và ma trận, các
+    cấu trúc dựng sẵn (thứ tự id và cột số, chuẩn của dòng, chỉ mục IVF) được lưu thành
+    mảng để tiến trình tải kho chỉ cần memory-map.
+    payloads: {tên script: PayloadStore} lưu kèm (xem payload_store.saved_store).
+    """
+    encoders = dict(store["mlbs"])
+    encoders[TEXT_FIELD] = store["tfidf_plot"]
+    metadata = {"fields": LIST_FIELDS + [TEXT_FIELD], "field_weights": store["field_weights"],
+                "memory": store["memory"], "payloads": []}
+
+    arrays = {"id_order": store["indices"].order, "row_norms": store["row_norms"]}
+    arrays.update({f"order_{col}": column.order for col, column in store["columns"].items()})
+    retriever = store["retriever"]
+    if isinstance(retriever, retrieval.IVFRetriever):
+        metadata["ivf_config"] = retriever.config
+        arrays.update({f"ivf_{name}": array for name, array in retriever.index_arrays().items()})
+    for name, script_payloads in (payloads or {}).items():
+        if isinstance(script_payloads, payload_store.PayloadStore):
+            metadata["payloads"].append(name)
+            arrays.update({f"payloads_{name}_{part}": array for part, array in script_payloads.arrays().items()})
+
+    version = model_store.save_artifacts(
+        ARTIFACT_NAME,
+        store["feature_matrix"],
+        store["table"]['id'],
+        encoders,
+        store["table"],
+        metadata=metadata,
+        arrays=arrays,
+    )
+    store["version"] = version
+    return version
+
+
+def load_saved_store():
+    """
+    Tải kho từ phiên bản artifact hiện tại. Trả về None nếu chưa có artifact.
+    """
+    artifacts = model_store.load_artifacts(ARTIFACT_NAME)
+    if artifacts is None:
+        return None
+
+    encoders = artifacts["encoders"]
+    arrays, meta = artifacts["arrays"], artifacts["meta"]
+    store = prepare_store({
+        "version": artifacts["version"],
+        "table": artifacts["records"],
+        "mlbs": {col: encoders[col] for col in LIST_FIELDS},
+        "tfidf_plot": encoders[TEXT_FIELD],
+        "feature_matrix": artifacts["feature_matrix"],
+        "field_weights": meta.get("field_weights", {}),
+        "arrays": arrays,
+        "ivf_config": meta.get("ivf_config"),
+    })
+    store["saved_payloads"] = {
+        name: payload_store.PayloadStore.from_arrays(_prefixed(arrays, f"payloads_{name}_"))
+        for name in meta.get("payloads", [])
+    }
+    return store
+
+
+def install_store(store):
+    """
+    Đặt kho mới làm kho đang phục vụ. Phép gán một tham chiếu là nguyên tử nên các truy vấn
+    đang chạy vẫn dùng trọn vẹn kho cũ; các script nhận ra phiên bản mới ở truy vấn sau.
+    """
+    global _store
+    _store = store
+
+
+def current_store():
+    """Kho đang phục vụ, hoặc None nếu chưa được tải."""
+    return _store
+
+
+def get_store(mongodb_uri):
+    """
+    Trả về kho đã được cache. Nếu chưa có, ưu tiên tải artifact đã build sẵn
+    (xem build_index.py); nếu không có artifact thì tải dữ liệu và xây dựng kho.
+    Trả về None nếu collection không có dữ liệu.
+    """
+    global _store
+    if _store is not None:
+        return _store
+
+    with _store_lock:
+        # Kiểm tra lại sau khi lấy khóa: một luồng khác có thể đã xây dựng xong
+        if _store is None:
+            with instrumentation.stage("load_artifacts"):
+                _store = load_saved_store()
+        if _store is None:
+            with instrumentation.stage("fetch"):
+                table = load_table(mongodb_uri)
+            if not len(table):
+                return None
+            print(f"[feature_engine] Đang xây dựng kho đặc trưng ({len(table)} phim)...", file=sys.stderr)
+            with instrumentation.stage("build"):
+                _store = build_store(table)
+        return _store
@@ -0,0 +1,88 @@
+# src/ml/features.py
+"""
+Mã hóa gọn của ma trận đặc trưng và trọng số theo trường.
+
+- Chế độ gọn (RECOMMENDER_COMPACT_FEATURES=1): giá trị float32, chỉ số int32, và các nhãn
+  xuất hiện ít hơn RECOMMENDER_MIN_LABEL_COUNT lần trong các trường nhiều nhãn (cast,
+  directors, writers) bị bỏ. Phần lớn các nhãn này chỉ có ở một phim nên không tạo độ
+  tương đồng giữa hai phim, nhưng chiếm phần lớn số cột của ma trận.
+- Trọng số theo trường (RECOMMENDER_FIELD_WEIGHTS, ví dụ "genres=2,cast=0.5,plot=1"):
+  mỗi khối cột được nhân với trọng số của trường một lần lúc build. Vector truy vấn được
+  nhân cùng trọng số (column_weights), nên độ tương đồng là Cosine trên không gian đã
+  co giãn và truy vấn theo ID (dùng chính dòng của ma trận) nhất quán với các truy vấn khác.
+- memory_report(): dung lượng của ma trận, để ước lượng bộ nhớ cho pod.
+"""
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+COMPACT = os.getenv("RECOMMENDER_COMPACT_FEATURES") == "1"
+PRUNED_FIELDS = ('cast', 'directors', 'writers')
+DEFAULT_MIN_LABEL_COUNT = 2
+
+
+def parse_field_weights(spec):
+    """"genres=2,cast=0.5" -> {'genres': 2.0, 'cast': 0.5}."""
+    weights = {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        field, _, value = part.partition("=")
+        weights[field.strip()] = float(value)
+    return weights
+
+
+FIELD_WEIGHTS = parse_field_weights(os.getenv("RECOMMENDER_FIELD_WEIGHTS"))
+
+
+def min_label_count(field, compact_mode=None):
+    """Số lần xuất hiện tối thiểu để một nhãn của field thành một cột."""
+    compact_mode = COMPACT if compact_mode is None else compact_mode
+    if compact_mode and field in PRUNED_FIELDS:
+        return int(os.getenv("RECOMMENDER_MIN_LABEL_COUNT", DEFAULT_MIN_LABEL_COUNT))
+    return 1
+
+
+def column_weights(block_widths, field_weights):
+    """
+    Trọng số của từng cột từ [(trường, số cột), ...] theo thứ tự khối.
+    Trả về None nếu mọi trọng số bằng 1 (không cần nhân).
+    """
+    if not any(field_weights.get(field, 1.0) != 1.0 for field, _ in block_widths):
+        return None
+    return np.concatenate([
+        np.full(width, field_weights.get(field, 1.0), dtype=np.float64) for field, width in block_widths
+    ])
+
+
+def apply_column_weights(matrix, weights):
+    """Nhân từng cột của ma trận thưa với weights (None = giữ nguyên), trả về CSR."""
+    if weights is None:
+        return matrix.tocsr()
+    return csr_matrix(matrix.multiply(weights[None, :]))
+
+
+def compact(matrix, compact_mode=None):
+    """Trong chế độ gọn: CSR float32 với chỉ số int32 (nếu vừa). Ngoài ra giữ nguyên."""
+    matrix = matrix.tocsr()
+    if not (COMPACT if compact_mode is None else compact_mode):
+        return matrix
+    matrix = matrix.astype(np.float32)
+    if matrix.nnz < np.iinfo(np.int32).max and matrix.shape[1] < np.iinfo(np.int32).max:
+        matrix.indices = matrix.indices.astype(np.int32)
+        matrix.indptr = matrix.indptr.astype(np.int32)
+    return matrix
+
+
+def memory_report(matrix):
+    """Dung lượng (byte) các mảng của ma trận CSR."""
+    parts = {part: int(getattr(matrix, part).nbytes) for part in ("data", "indices", "indptr")}
+    return {
+        "shape": list(matrix.shape),
+        "nnz": int(matrix.nnz),
+        "dtype": str(matrix.dtype),
+        "index_dtype": str(matrix.indices.dtype),
+        **{f"{part}_bytes": size for part, size in parts.items()},
+        "total_bytes": sum(parts.values()),
+    }
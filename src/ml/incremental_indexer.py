@@ -0,0 +1,385 @@
+# src/ml/incremental_indexer.py
+"""
+Cập nhật mô hình gợi ý tăng dần khi collection 'embedded_movies' thay đổi.
+
+Chạy như một luồng nền trong recommender_server.py:
+- Theo dõi thay đổi bằng change stream của MongoDB (RECOMMENDER_REFRESH_MODE=change_stream,
+  cần replica set) hoặc mặc định là hỏi định kỳ các phim có 'lastupdated' mới hơn mốc đã thấy.
+- Các phim mới được thêm vào cuối ma trận đặc trưng, phim đã sửa được thay dòng, phim bị
+  xóa (chỉ phát hiện được qua change stream) bị bỏ dòng.
+- Nhãn mới (diễn viên, đạo diễn...) được thêm thành cột mới ở cuối khối cột của trường đó;
+  TF-IDF dùng lại từ vựng và IDF hiện có. Ở chế độ gọn, nhãn mới chỉ thành cột khi đủ
+  RECOMMENDER_MIN_LABEL_COUNT lần xuất hiện, như khi build lại toàn bộ (xem features.py).
+- Kho đặc trưng dùng chung (feature_engine.py) được cập nhật một lần cho cả hai script;
+  kho mới được dựng trên bản sao rồi hoán đổi nguyên tử, truy vấn không bị chặn, và các
+  script đã được tải dựng lại phần riêng của chúng ngay trong luồng nền.
+- Bảng phim tương tự tính sẵn (similar_movies.py), nếu đang được dùng, được cập nhật cùng
+  kho: chỉ các phim bị ảnh hưởng được tính lại; khi build lại toàn bộ thì tính lại cả bảng.
+- Định kỳ build lại toàn bộ (RECOMMENDER_FULL_REBUILD_SECONDS) để tính lại IDF và
+  dọn các cột không còn dùng.
+- Kho cập nhật (tăng dần hoặc build lại toàn bộ) chỉ nằm trong bộ nhớ của tiến trình,
+  không được ghi thành phiên bản mới trong model_store. Khi khởi động lại, tiến trình tải
+  lại artifact của lần chạy build_index.py gần nhất: ở chế độ hỏi định kỳ, mốc 'lastupdated'
+  được lấy từ chính artifact đó nên các phim sửa/thêm sau đó được áp dụng lại ở lần hỏi
+  đầu tiên, nhưng phim bị xóa và thay đổi nhận qua change stream thì không, cho tới lần
+  build lại toàn bộ kế tiếp. Chạy build_index.py định kỳ để artifact không quá cũ.
+"""
+import sys
+import os
+import time
+import threading
+import traceback
+import warnings
+
+import numpy as np
+from scipy.sparse import hstack, vstack, csr_matrix
+from sklearn.preprocessing import MultiLabelBinarizer
+
+import feature_engine
+import features
+import model_store
+import mongo_client
+import movie_recommender
+import preference_recommender
+import similar_movies
+
+DEFAULT_REFRESH_SECONDS = 60
+DEFAULT_FULL_REBUILD_SECONDS = 24 * 3600
+CHANGE_STREAM_BATCH_SECONDS = 2
+
+
+def extend_encoder(mlb, label_lists, min_count=1, table_lists=None):
+    """
+    Trả về (bộ mã hóa, nhãn mới). Nhãn mới được thêm vào cuối classes_ nên các cột
+    hiện có giữ nguyên vị trí.
+    min_count > 1 (chế độ gọn, features.min_label_count): như khi build lại toàn bộ, nhãn mới
+    chỉ thành cột khi xuất hiện ở ít nhất min_count dòng của table_lists (bảng sau cập nhật);
+    nhãn hiếm hơn chờ tới khi nó đủ số lần xuất hiện.
+    """
+    known = set(mlb.classes_)
+    new_labels = {label for labels in label_lists for label in labels} - known
+    if new_labels and min_count > 1:
+        counts = dict.fromkeys(new_labels, 0)
+        for labels in table_lists:
+            for label in set(labels) & new_labels:
+                counts[label] += 1
+        new_labels = {label for label, count in counts.items() if count >= min_count}
+    if not new_labels:
+        return mlb, []
+
+    new_labels = sorted(new_labels)
+    extended = MultiLabelBinarizer(classes=list(mlb.classes_) + new_labels, sparse_output=mlb.sparse_output)
+    extended.fit([])
+    return extended, new_labels
+
+
+def apply_changes(table, feature_matrix, encoders, fields, changed_table, text_fn, removed_ids=(), field_weights=None):
+    """
+    Áp dụng các phim thay đổi lên một mô hình và trả về (table, feature_matrix, encoders,
+    reencoded_ids) mới. Không sửa các đối tượng đầu vào, để mô hình cũ vẫn phục vụ truy vấn
+    trong lúc cập nhật.
+
+    feature_matrix gồm các khối cột theo thứ tự fields, tiếp theo là khối TF-IDF (encoders['plot']).
+    changed_table không được chứa id trùng nhau.
+    field_weights: trọng số theo trường đã nhân vào feature_matrix (xem features.py); các dòng
+    mới được nhân cùng trọng số. Ma trận float32 (chế độ gọn) được giữ ở dạng gọn, và nhãn
+    mới tuân theo cùng ngưỡng features.min_label_count như khi build lại toàn bộ. Một nhãn
+    trước đây bị bỏ vì hiếm có thể đủ ngưỡng nhờ các phim thay đổi: các phim không thay đổi
+    mang nhãn đó được mã hóa lại, id của chúng là reencoded_ids.
+    """
+    n_rows = feature_matrix.shape[0]
+    compact_mode = feature_matrix.dtype == np.float32
+
+    dropped_ids = set(changed_table['id']) | set(removed_ids)
+    keep_rows = np.array([row for row, movie_id in enumerate(table['id']) if movie_id not in dropped_ids], dtype=np.int64)
+    new_table = table.take(keep_rows).concat(changed_table)
+
+    blocks = []
+    new_encoders = {}
+    admitted = {}
+    offset = 0
+    for field in fields:
+        width = len(encoders[field].classes_)
+        block = feature_matrix[:, offset:offset + width]
+        offset += width
+
+        min_count = features.min_label_count(field, compact_mode)
+        extended, added = extend_encoder(encoders[field], changed_table[field], min_count, new_table[field])
+        if added:
+            block = hstack([block, csr_matrix((n_rows, len(added)))])
+            if min_count > 1:
+                admitted[field] = set(added)
+        blocks.append(block)
+        new_encoders[field] = extended
+    blocks.append(feature_matrix[:, offset:])
+    new_encoders['plot'] = encoders['plot']
+    widened_matrix = hstack(blocks).tocsr()
+
+    widths = [(field, len(new_encoders[field].classes_)) for field in fields]
+    widths.append(('plot', widened_matrix.shape[1] - sum(width for _, width in widths)))
+    weights = features.column_weights(widths, field_weights or {})
+
+    def encode(rows_table):
+        if not len(rows_table):
+            return csr_matrix((0, widened_matrix.shape[1]), dtype=widened_matrix.dtype)
+        with warnings.catch_warnings():
+            # Nhãn bị bỏ vì hiếm (chế độ gọn) không có cột: bỏ qua là đúng, không cần cảnh báo
+            warnings.filterwarnings("ignore", message="unknown class", category=UserWarning)
+            encoded = hstack(
+                [csr_matrix(new_encoders[field].transform(rows_table[field])) for field in fields]
+                + [new_encoders['plot'].transform(list(text_fn(rows_table)))]
+            ).tocsr()
+        return features.apply_column_weights(encoded, weights).astype(widened_matrix.dtype)
+
+    new_matrix = vstack([widened_matrix[keep_rows], encode(changed_table)]).tocsr()
+
+    # Các phim không thay đổi mang nhãn vừa đủ ngưỡng: thay dòng bằng dòng mã hóa lại
+    reencoded = [
+        row for row in range(len(keep_rows))
+        if any(admitted[field].intersection(new_table[field][row]) for field in admitted)
+    ]
+    if reencoded:
+        order = np.arange(new_matrix.shape[0])
+        order[reencoded] = new_matrix.shape[0] + np.arange(len(reencoded))
+        new_matrix = vstack([new_matrix, encode(new_table.take(reencoded))]).tocsr()[order]
+
+    new_matrix = features.compact(new_matrix, compact_mode=compact_mode)
+    return new_table, new_matrix, new_encoders, [new_table['id'][row] for row in reencoded]
+
+
+# --- CÁC MÔ HÌNH ĐƯỢC CẬP NHẬT ---
+# Mỗi mô hình khai báo cách lấy trạng thái hiện tại, cách chuẩn hóa document và cách
+# hoán đổi mô hình mới vào. Hai script gợi ý dùng chung một kho đặc trưng nên chỉ có
+# một mô hình cần cập nhật.
+
+def _features_snapshot():
+    store = feature_engine.current_store()
+    if store is None:
+        return None
+    encoders = dict(store["mlbs"])
+    encoders[feature_engine.TEXT_FIELD] = store["tfidf_plot"]
+    return store["table"], store["feature_matrix"], encoders
+
+
+def _features_field_weights():
+    store = feature_engine.current_store()
+    return store.get("field_weights", {}) if store is not None else {}
+
+
+def _refresh_recommenders():
+    """Dựng lại phần riêng (kết quả JSON...) của các script đã được tải trên kho mới."""
+    if movie_recommender._model is not None:
+        movie_recommender.get_model(os.getenv("MONGODB_URI"))
+    if preference_recommender.current_model is not None:
+        preference_recommender.get_current_model()
+
+
+def _previous_similar(previous):
+    """Bảng phim tương tự đang phục vụ của kho previous (similar_movies.py), hoặc None."""
+    if previous is None or not similar_movies.enabled():
+        return None
+    return similar_movies.for_store(previous)
+
+
+def _features_install(table, feature_matrix, encoders, changed_ids=(), removed_ids=()):
+    previous = feature_engine.current_store()
+    store = feature_engine.prepare_store({
+        "version": model_store.new_version(),
+        "table": table,
+        "mlbs": {col: encoders[col] for col in feature_engine.LIST_FIELDS},
+        "tfidf_plot": encoders[feature_engine.TEXT_FIELD],
+        "feature_matrix": feature_matrix,
+        "field_weights": _features_field_weights(),
+    }, previous["mode_field_weights"] if previous is not None else None)
+    if previous is not None:
+        # Các mô hình dựng trên kho trước chỉ tuần tự hóa lại kết quả của các phim này
+        # (payload_store.build_store)
+        store["parent_version"] = previous["version"]
+        store["changed_ids"] = frozenset(changed_ids)
+
+    # Bảng phim tương tự: chỉ tính lại các phim bị ảnh hưởng, trước khi kho mới được phục vụ
+    similar = _previous_similar(previous)
+    if similar is not None:
+        store["similar"], rows = similar_movies.update(similar, store, changed_ids, removed_ids)
+        if similar_movies.side_collection():
+            similar_movies.write_collection(store["similar"], similar_movies.side_collection(), rows, removed_ids)
+    feature_engine.install_store(store)
+    _refresh_recommenders()
+
+
+def _features_rebuild(mongodb_uri):
+    table = feature_engine.load_table(mongodb_uri)
+    if len(table):
+        previous = feature_engine.current_store()
+        store = feature_engine.build_store(table)
+        similar = _previous_similar(previous)
+        if similar is not None:
+            store["similar"] = similar_movies.build_table(store, similar.k)
+            if similar_movies.side_collection():
+                similar_movies.write_collection(store["similar"], similar_movies.side_collection(), replace_all=True)
+        feature_engine.install_store(store)
+        _refresh_recommenders()
+
+
+TARGETS = {
+    'features': {
+        "fields": feature_engine.LIST_FIELDS,
+        "projection": feature_engine.PROJECTION,
+        "prepare": feature_engine.prepare_table,
+        "text": feature_engine.plot_text,
+        "snapshot": _features_snapshot,
+        "install": _features_install,
+        "field_weights": _features_field_weights,
+        "rebuild": _features_rebuild,
+    },
+}
+
+
+def _max_lastupdated(values):
+    values = [v for v in values if v is not None and not (isinstance(v, float) and np.isnan(v))]
+    try:
+        return max(values) if values else None
+    except TypeError:
+        # Kiểu dữ liệu lẫn lộn (chuỗi và ngày tháng): dùng kiểu chiếm đa số
+        values = [v for v in values if isinstance(v, type(values[0]))]
+        return max(values)
+
+
+class IncrementalIndexer(threading.Thread):
+    """Luồng nền theo dõi thay đổi và cập nhật các mô hình trong TARGETS."""
+
+    def __init__(self, mongodb_uri, targets=None, interval=DEFAULT_REFRESH_SECONDS,
+                 full_rebuild_interval=DEFAULT_FULL_REBUILD_SECONDS, mode="poll"):
+        super().__init__(name="incremental-indexer", daemon=True)
+        self.mongodb_uri = mongodb_uri
+        self.db_name = mongodb_uri.split('/')[-1].split('?')[0]
+        self.targets = {name: TARGETS[name] for name in (targets or TARGETS)}
+        self.interval = interval
+        self.full_rebuild_interval = full_rebuild_interval
+        self.mode = mode
+        self.watermark = None
+        self.last_full_rebuild = time.time()
+        self.stop_event = threading.Event()
+
+        self.projection = {}
+        for target in self.targets.values():
+            self.projection.update(target["projection"])
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _collection(self, client):
+        return client[self.db_name]['embedded_movies']
+
+    def _init_watermark(self):
+        for target in self.targets.values():
+            snapshot = target["snapshot"]()
+            if snapshot is not None and 'lastupdated' in snapshot[0]:
+                self.watermark = _max_lastupdated(snapshot[0]['lastupdated'])
+                if self.watermark is not None:
+                    return
+
+    def apply(self, changed_docs, removed_ids=()):
+        """Áp dụng một lô document thay đổi / id bị xóa lên mọi mô hình đã được tải."""
+        if not changed_docs and not removed_ids:
+            return
+        # Mỗi phim chỉ giữ bản mới nhất trong lô
+        changed_docs = list({doc['_id']: doc for doc in changed_docs}.values())
+        for name, target in self.targets.items():
+            snapshot = target["snapshot"]()
+            if snapshot is None:
+                continue
+            table, feature_matrix, encoders = snapshot
+            changed_table = target["prepare"](changed_docs)
+            new_table, new_matrix, new_encoders, reencoded_ids = apply_changes(
+                table, feature_matrix, encoders, target["fields"], changed_table, target["text"], removed_ids,
+                target["field_weights"]())
+            target["install"](new_table, new_matrix, new_encoders, list(changed_table['id']) + reencoded_ids,
+                              removed_ids)
+            print(f"[incremental_indexer] '{name}': cập nhật {len(changed_docs)} phim, xóa {len(removed_ids)} phim, "
+                  f"ma trận mới {new_matrix.shape}", file=sys.stderr)
+
+    def full_rebuild(self):
+        for name, target in self.targets.items():
+            target["rebuild"](self.mongodb_uri)
+            print(f"[incremental_indexer] '{name}': đã build lại toàn bộ.", file=sys.stderr)
+        self.last_full_rebuild = time.time()
+        self.watermark = None
+        self._init_watermark()
+
+    def _full_rebuild_due(self):
+        return self.full_rebuild_interval and time.time() - self.last_full_rebuild >= self.full_rebuild_interval
+
+    def poll_once(self, collection):
+        if self.watermark is None:
+            self._init_watermark()
+            if self.watermark is None:
+                return
+        changed_docs = list(collection.find({'lastupdated': {'$gt': self.watermark}}, self.projection))
+        if changed_docs:
+            self.apply(changed_docs)
+            self.watermark = _max_lastupdated([self.watermark] + [doc.get('lastupdated') for doc in changed_docs])
+
+    def _run_polling(self, client):
+        collection = self._collection(client)
+        while not self.stop_event.wait(self.interval):
+            if self._full_rebuild_due():
+                self.full_rebuild()
+            else:
+                self.poll_once(collection)
+
+    def _run_change_stream(self, client):
+        collection = self._collection(client)
+        with collection.watch(full_document='updateLookup') as stream:
+            while not self.stop_event.is_set():
+                if self._full_rebuild_due():
+                    self.full_rebuild()
+
+                changed_docs, removed_ids = {}, set()
+                batch_deadline = time.time() + CHANGE_STREAM_BATCH_SECONDS
+                while time.time() < batch_deadline:
+                    event = stream.try_next()
+                    if event is None:
+                        self.stop_event.wait(0.2)
+                        continue
+                    doc_id = event['documentKey']['_id']
+                    if event['operationType'] == 'delete':
+                        removed_ids.add(doc_id)
+                        changed_docs.pop(doc_id, None)
+                    elif event.get('fullDocument') is not None:
+                        changed_docs[doc_id] = {k: v for k, v in event['fullDocument'].items() if k in self.projection}
+                        removed_ids.discard(doc_id)
+                self.apply(list(changed_docs.values()), removed_ids)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # Client dùng chung của tiến trình (mongo_client.py), không đóng ở đây
+                client = mongo_client.get_client(self.mongodb_uri)
+                if self.mode == "change_stream":
+                    self._run_change_stream(client)
+                else:
+                    self._run_polling(client)
+            except Exception as e:
+                traceback.print_exc()
+                print(f"[incremental_indexer] Lỗi, thử lại sau {self.interval}s: {e}", file=sys.stderr)
+                self.stop_event.wait(self.interval)
+
+
+def start_from_env():
+    """
+    Khởi động indexer nếu RECOMMENDER_REFRESH_SECONDS > 0. Trả về luồng đã khởi động hoặc None.
+    """
+    mongodb_uri = os.getenv("MONGODB_URI")
+    interval = float(os.getenv("RECOMMENDER_REFRESH_SECONDS", 0) or 0)
+    if not mongodb_uri or interval <= 0:
+        return None
+
+    indexer = IncrementalIndexer(
+        mongodb_uri,
+        interval=interval,
+        full_rebuild_interval=float(os.getenv("RECOMMENDER_FULL_REBUILD_SECONDS", DEFAULT_FULL_REBUILD_SECONDS)),
+        mode=os.getenv("RECOMMENDER_REFRESH_MODE", "poll"),
+    )
+    indexer.start()
+    return indexer
@@ -0,0 +1,275 @@
+# src/ml/instrumentation.py
+"""
+Đo thời gian theo giai đoạn và bộ đếm trên đường đi của các truy vấn gợi ý.
+
+- request(recommender, timings, profile): bao quanh việc xử lý một yêu cầu trong luồng
+  hiện tại. stage()/count() gọi bên trong được ghi vào RequestTimings của yêu cầu đó;
+  khi yêu cầu có "timings": true, attach() thêm khối "timings" vào phản hồi:
+      {"total_ms": ..., "stages_ms": {"model": ..., "plan": ..., "score": ...}, "counters": {...}}
+  Các giai đoạn có thể lồng nhau (ví dụ "build" nằm trong "model" ở yêu cầu đầu tiên).
+- Mọi stage()/count() cũng được cộng vào các metric của tiến trình (histogram thời gian
+  theo giai đoạn, bộ đếm sự kiện, số yêu cầu và lỗi), xuất theo định dạng văn bản của
+  Prometheus bằng render_prometheus() (HTTP /metrics, xem start_metrics_server()).
+- SamplingProfiler: tùy chọn, lấy mẫu stack của luồng xử lý yêu cầu theo chu kỳ và trả về
+  các stack gộp (dạng "collapsed" của flamegraph) phổ biến nhất. Chỉ chạy khi tiến trình
+  bật RECOMMENDER_PROFILING=1 và yêu cầu có "profile": true.
+
+Cấu hình:
+    RECOMMENDER_METRICS_PORT          cổng HTTP /metrics của recommender_server.py (mặc định tắt)
+    RECOMMENDER_METRICS_HOST          địa chỉ lắng nghe của /metrics, mặc định 127.0.0.1 (chỉ máy cục bộ)
+    RECOMMENDER_PROFILING             "1" = cho phép yêu cầu bật profiler
+    RECOMMENDER_PROFILE_INTERVAL_MS   chu kỳ lấy mẫu, mặc định 5
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+import contextlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Biên trên (giây) của các bucket histogram
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_PROFILE_INTERVAL_MS = 5
+PROFILE_TOP_STACKS = 30
+
+PROFILING_ENABLED = os.getenv("RECOMMENDER_PROFILING") == "1"
+
+_local = threading.local()
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (bucket, tổng, số lần)."""
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Metric của tiến trình, an toàn khi nhiều luồng cùng ghi."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_seconds = {}
+        self.request_seconds = {}
+        self.events = Counter()
+        self.errors = Counter()
+
+    def observe_stage(self, recommender, stage, seconds):
+        with self.lock:
+            self.stage_seconds.setdefault((recommender, stage), Histogram()).observe(seconds)
+
+    def observe_request(self, recommender, seconds, failed):
+        with self.lock:
+            self.request_seconds.setdefault(recommender, Histogram()).observe(seconds)
+            if failed:
+                self.errors[recommender] += 1
+
+    def add(self, recommender, event, n):
+        with self.lock:
+            self.events[(recommender, event)] += n
+
+    def render(self):
+        """Các metric ở định dạng văn bản của Prometheus (text exposition 0.0.4)."""
+        with self.lock:
+            lines = ["# HELP recommender_stage_seconds Time spent in each stage of a recommendation request.",
+                     "# TYPE recommender_stage_seconds histogram"]
+            for (recommender, stage), histogram in sorted(self.stage_seconds.items()):
+                lines += _histogram_lines("recommender_stage_seconds",
+                                          f'recommender="{recommender}",stage="{stage}"', histogram)
+
+            lines += ["# HELP recommender_request_seconds End-to-end time of recommendation requests.",
+                      "# TYPE recommender_request_seconds histogram"]
+            for recommender, histogram in sorted(self.request_seconds.items()):
+                lines += _histogram_lines("recommender_request_seconds", f'recommender="{recommender}"', histogram)
+
+            lines += ["# HELP recommender_request_errors_total Requests that returned an error.",
+                      "# TYPE recommender_request_errors_total counter"]
+            lines += [f'recommender_request_errors_total{{recommender="{recommender}"}} {count}'
+                      for recommender, count in sorted(self.errors.items())]
+
+            lines += ["# HELP recommender_events_total Hot-path counters (queries, cache hits, rows scored, ...).",
+                      "# TYPE recommender_events_total counter"]
+            lines += [f'recommender_events_total{{recommender="{recommender}",event="{event}"}} {count}'
+                      for (recommender, event), count in sorted(self.events.items())]
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name, labels, histogram):
+    lines, cumulative = [], 0
+    for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+REGISTRY = MetricsRegistry()
+
+
+class SamplingProfiler(threading.Thread):
+    """Lấy mẫu stack của một luồng mỗi interval giây cho tới khi stop()."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        return [{"stack": stack, "samples": count} for stack, count in self.samples.most_common(PROFILE_TOP_STACKS)]
+
+
+class RequestTimings:
+    """Thời gian theo giai đoạn và bộ đếm của một yêu cầu."""
+
+    def __init__(self, recommender, enabled):
+        self.recommender = recommender
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.total = None
+        self.stages = {}
+        self.counters = Counter()
+        self.profile = None
+        self.profiler = None
+        self.failed = False
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profile = self.profiler.stop()
+            self.profiler = None
+
+    def as_dict(self):
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        timings = {
+            "total_ms": round(total * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+        if self.profile is not None:
+            timings["profile"] = self.profile
+        return timings
+
+    def attach(self, response):
+        """
+        Thêm khối "timings" vào phản hồi (dict) nếu yêu cầu có "timings": true. Phản hồi có
+        "error" được tính là yêu cầu lỗi trong metric. Gọi bên trong khối request().
+        """
+        if isinstance(response, dict) and "error" in response:
+            self.failed = True
+        self.stop_profiler()
+        if self.enabled and isinstance(response, dict):
+            response["timings"] = self.as_dict()
+        return response
+
+
+def current():
+    """RequestTimings của yêu cầu đang xử lý trong luồng này, hoặc None."""
+    return getattr(_local, "timings", None)
+
+
+@contextlib.contextmanager
+def request(recommender, timings=False, profile=False):
+    """Bao quanh việc xử lý một yêu cầu; trả về RequestTimings của yêu cầu."""
+    outer = current()
+    record = RequestTimings(recommender, bool(timings) or bool(profile))
+    _local.timings = record
+
+    if profile and PROFILING_ENABLED:
+        interval = float(os.getenv("RECOMMENDER_PROFILE_INTERVAL_MS", DEFAULT_PROFILE_INTERVAL_MS)) / 1000
+        record.profiler = SamplingProfiler(threading.get_ident(), interval)
+        record.profiler.start()
+
+    try:
+        yield record
+    except BaseException:
+        record.failed = True
+        raise
+    finally:
+        record.stop_profiler()
+        record.total = time.perf_counter() - record.started
+        _local.timings = outer
+        REGISTRY.observe_request(recommender, record.total, record.failed)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Đo thời gian một giai đoạn của yêu cầu hiện tại (và của metric tiến trình)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        record = current()
+        if record is not None:
+            record.stages[name] = record.stages.get(name, 0.0) + seconds
+        REGISTRY.observe_stage(record.recommender if record is not None else "background", name, seconds)
+
+
+def count(event, n=1):
+    """Cộng n vào bộ đếm event của yêu cầu hiện tại (và của metric tiến trình)."""
+    record = current()
+    if record is not None:
+        record.counters[event] += n
+    REGISTRY.add(record.recommender if record is not None else "background", event, n)
+
+
+def render_prometheus():
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Phục vụ GET /metrics trên host:port (mặc định RECOMMENDER_METRICS_HOST, 127.0.0.1, và
+    RECOMMENDER_METRICS_PORT) trong một luồng nền. Trả về HTTP server, hoặc None nếu không
+    được cấu hình.
+    """
+    port = int(port if port is not None else os.getenv("RECOMMENDER_METRICS_PORT", 0) or 0)
+    if port <= 0:
+        return None
+    host = host or os.getenv("RECOMMENDER_METRICS_HOST") or "127.0.0.1"
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[instrumentation] Metrics Prometheus tại http://{host}:{server.server_address[1]}/metrics", file=sys.stderr)
+    return server
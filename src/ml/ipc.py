@@ -0,0 +1,121 @@
+# src/ml/ipc.py
+"""
+Giao thức khung nhị phân giữa Node (src/services/pythonService.ts) và recommender_server.py.
+
+Mỗi thông điệp là một khung:
+
+    4 byte   độ dài nội dung (uint32 big-endian, không tính 5 byte đầu khung)
+    1 byte   mã hóa của nội dung: 0 = JSON UTF-8, 1 = msgpack
+    N byte   nội dung
+
+Khác với JSON-lines, nội dung có thể chứa mọi byte (kể cả xuống dòng), bên đọc biết trước
+kích thước nên không phải ghép chuỗi rồi tìm dấu phân cách, và khung quá lớn bị từ chối
+trước khi đọc. msgpack là tùy chọn (cần gói msgpack); server trả lời bằng đúng mã hóa của
+yêu cầu và báo các mã hóa hỗ trợ trong sự kiện "ready".
+
+Cấu hình:
+    RECOMMENDER_MAX_FRAME_BYTES   kích thước nội dung tối đa của một khung, mặc định 64 MiB
+"""
+import os
+import json
+import struct
+import threading
+
+import payload_store
+import instrumentation
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+HEADER = struct.Struct(">IB")
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+CODEC_NAMES = {CODEC_JSON: "json", CODEC_MSGPACK: "msgpack"}
+DEFAULT_MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class FrameError(Exception):
+    """Khung không hợp lệ (quá lớn, mã hóa không hỗ trợ, bị cắt giữa chừng)."""
+
+
+def max_frame_bytes():
+    return int(os.getenv("RECOMMENDER_MAX_FRAME_BYTES", DEFAULT_MAX_FRAME_BYTES))
+
+
+def available_codecs():
+    return [CODEC_NAMES[CODEC_JSON]] + ([CODEC_NAMES[CODEC_MSGPACK]] if msgpack is not None else [])
+
+
+def encode(message, codec=CODEC_JSON):
+    """Một khung hoàn chỉnh (header + nội dung) của message."""
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise FrameError("Chưa cài gói msgpack.")
+        # Các đoạn RawJSON dựng sẵn được giải mã để msgpack mã hóa như dữ liệu thường
+        body = msgpack.packb(payload_store.loads(message), use_bin_type=True)
+    else:
+        body = payload_store.dumps(message).encode("utf-8")
+    return HEADER.pack(len(body), codec) + body
+
+
+def decode(body, codec):
+    if codec == CODEC_JSON:
+        return json.loads(body.decode("utf-8"))
+    if codec == CODEC_MSGPACK and msgpack is not None:
+        return msgpack.unpackb(body, raw=False)
+    raise FrameError(f"Mã hóa không được hỗ trợ: {codec}")
+
+
+def _read_exactly(stream, size):
+    """size byte từ stream; ít hơn nếu stream kết thúc trước."""
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(stream):
+    """
+    Đọc một khung từ stream nhị phân. Trả về (mã hóa, nội dung thô), hoặc None khi stream
+    kết thúc đúng ở ranh giới khung. Khung quá lớn được bỏ qua và báo FrameError.
+    """
+    header = _read_exactly(stream, HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise FrameError("Stream kết thúc giữa header của một khung.")
+    size, codec = HEADER.unpack(header)
+    if size > max_frame_bytes():
+        # Bỏ qua nội dung theo từng đoạn để stream vẫn đứng đúng ở đầu khung kế tiếp
+        remaining = size
+        while remaining:
+            skipped = stream.read(min(remaining, 1 << 20))
+            if not skipped:
+                break
+            remaining -= len(skipped)
+        raise FrameError(f"Khung {size} byte vượt quá giới hạn {max_frame_bytes()} byte.")
+    body = _read_exactly(stream, size)
+    if len(body) < size:
+        raise FrameError("Stream kết thúc giữa một khung.")
+    return codec, body
+
+
+class FrameWriter:
+    """Ghi từng khung ra stream nhị phân, có khóa để các luồng không ghi xen vào nhau."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, message, codec=CODEC_JSON):
+        with instrumentation.stage("serialize"):
+            frame = encode(message, codec)
+        with self.lock:
+            self.stream.write(frame)
+            self.stream.flush()
@@ -0,0 +1,214 @@
+# src/ml/model_store.py
+"""
+Lưu và tải các artifact của mô hình gợi ý.
+
+Mỗi lần build tạo một thư mục phiên bản mới:
+
+    <RECOMMENDER_ARTIFACT_DIR>/<name>/<version>/
+        data.npy, indices.npy, indptr.npy   (ma trận đặc trưng CSR)
+        ids.npy                             (dòng -> ObjectId dạng chuỗi hex, cũng là cột 'id')
+        encoders.pkl                        (các MultiLabelBinarizer và TfidfVectorizer đã fit)
+        vocabularies.json                   (từ vựng của từng bộ mã hóa, để kiểm tra/gỡ lỗi)
+        column_<tên>.npy                    (các cột NumPy của MovieTable: cột số, ma trận vector)
+        list_<tên>_{vocabulary,codes,offsets}.npy   (cột danh sách chuỗi, catalog.ListColumn)
+        blob_<tên>_{blob,offsets}.npy       (các cột còn lại, mỗi dòng một BSON, catalog.BlobColumn)
+        array_<tên>.npy                     (các mảng dựng sẵn khác của kho, xem feature_engine.save_store)
+        meta.json
+    <RECOMMENDER_ARTIFACT_DIR>/<name>/CURRENT   (tên phiên bản đang dùng)
+
+Artifact không theo bố cục trên (ví dụ bảng phim tương tự của similar_movies.py) tự ghi
+file vào thư mục của create_version() rồi publish_version() với meta.json của chúng.
+
+Mọi mảng .npy (kể cả ma trận plot_embedding và các cột của MovieTable) được mở bằng
+np.load(mmap_mode='r') nên nhiều tiến trình dùng chung một bản trang nhớ của hệ điều hành
+và khởi động gần như tức thì: không có bước giải tuần tự O(N) nào khi tải (chỉ encoders.pkl,
+kích thước theo từ vựng).
+"""
+import os
+import sys
+import json
+import time
+import pickle
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import catalog
+
+ARTIFACT_ROOT = os.getenv("RECOMMENDER_ARTIFACT_DIR", os.path.join(os.getcwd(), "model_artifacts"))
+
+MATRIX_FILES = ("data", "indices", "indptr")
+
+
+def _model_dir(name):
+    return os.path.join(ARTIFACT_ROOT, name)
+
+
+def new_version():
+    """Tên phiên bản dựa trên thời điểm build, sắp xếp được theo thứ tự thời gian."""
+    return time.strftime("%Y%m%dT%H%M%S") + f"-{int(time.time() * 1e6) % 1000000:06d}"
+
+
+def current_version(name):
+    """Trả về phiên bản đang được trỏ tới bởi CURRENT, hoặc None nếu chưa build lần nào."""
+    pointer = os.path.join(_model_dir(name), "CURRENT")
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def create_version(name):
+    """
+    Tạo thư mục cho một phiên bản mới của name và trả về (phiên bản, thư mục). Phiên bản
+    chỉ được dùng sau publish_version().
+    """
+    version = new_version()
+    version_dir = os.path.join(_model_dir(name), version)
+    os.makedirs(version_dir)
+    return version, version_dir
+
+
+def publish_version(name, version, metadata):
+    """Ghi meta.json của phiên bản rồi chuyển CURRENT sang phiên bản đó."""
+    model_dir = _model_dir(name)
+    with open(os.path.join(model_dir, version, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+    pointer_tmp = os.path.join(model_dir, "CURRENT.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(model_dir, "CURRENT"))
+
+
+def version_path(name, version=None):
+    """Thư mục của một phiên bản (mặc định là CURRENT), hoặc None nếu chưa build lần nào."""
+    version = version or current_version(name)
+    return os.path.join(_model_dir(name), version) if version else None
+
+
+def _encoder_vocabularies(encoders):
+    vocabularies = {}
+    for key, encoder in encoders.items():
+        if hasattr(encoder, "classes_"):
+            vocabularies[key] = [str(c) for c in encoder.classes_]
+        elif hasattr(encoder, "vocabulary_"):
+            vocabularies[key] = {term: int(col) for term, col in encoder.vocabulary_.items()}
+    return vocabularies
+
+
+def _save_table(version_dir, records):
+    """Ghi các cột của MovieTable thành mảng .npy; trả về {cột: loại} theo thứ tự cột."""
+    kinds = {}
+    for col, column in records.columns.items():
+        if col == 'id':
+            kinds[col] = "ids"
+        elif isinstance(column, np.ndarray):
+            kinds[col] = "array"
+            np.save(os.path.join(version_dir, f"column_{col}.npy"), column)
+        elif all(isinstance(items, list) and all(isinstance(item, str) for item in items) for items in column):
+            kinds[col] = "list"
+            for part, array in zip(("vocabulary", "codes", "offsets"), catalog.ListColumn.pack(list(column))):
+                np.save(os.path.join(version_dir, f"list_{col}_{part}.npy"), array)
+        else:
+            kinds[col] = "blob"
+            for part, array in zip(("blob", "offsets"), catalog.BlobColumn.pack(column)):
+                np.save(os.path.join(version_dir, f"blob_{col}_{part}.npy"), array)
+    return kinds
+
+
+def _load_table(version_dir, meta, ids):
+    def load(filename):
+        return np.load(os.path.join(version_dir, filename), mmap_mode="r")
+
+    columns = {}
+    for col, kind in meta["columns"].items():
+        if kind == "ids":
+            columns[col] = catalog.ObjectIdColumn(ids)
+        elif kind == "array":
+            columns[col] = load(f"column_{col}.npy")
+        elif kind == "list":
+            columns[col] = catalog.ListColumn(*(load(f"list_{col}_{part}.npy") for part in ("vocabulary", "codes", "offsets")))
+        else:
+            columns[col] = catalog.BlobColumn(*(load(f"blob_{col}_{part}.npy") for part in ("blob", "offsets")))
+    return catalog.MovieTable(columns, meta["numeric_fields"])
+
+
+def save_artifacts(name, feature_matrix, ids, encoders, records, metadata=None, arrays=None):
+    """
+    Ghi một phiên bản mô hình mới rồi chuyển CURRENT sang phiên bản đó.
+    arrays: {tên: mảng NumPy} dựng sẵn khác, tải lại bằng memory-map trong "arrays".
+    CURRENT được thay thế bằng os.replace nên tiến trình đang đọc không bao giờ thấy
+    một phiên bản ghi dở.
+    """
+    version, version_dir = create_version(name)
+
+    feature_matrix = feature_matrix.tocsr()
+    for part in MATRIX_FILES:
+        np.save(os.path.join(version_dir, f"{part}.npy"), getattr(feature_matrix, part))
+    np.save(os.path.join(version_dir, "ids.npy"), catalog.id_strings(ids))
+
+    with open(os.path.join(version_dir, "encoders.pkl"), "wb") as f:
+        pickle.dump(encoders, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(version_dir, "vocabularies.json"), "w", encoding="utf-8") as f:
+        json.dump(_encoder_vocabularies(encoders), f, ensure_ascii=False)
+    columns = _save_table(version_dir, records)
+    for array_name, array in (arrays or {}).items():
+        np.save(os.path.join(version_dir, f"array_{array_name}.npy"), array)
+
+    meta = dict(metadata or {})
+    meta.update({
+        "columns": columns,
+        "numeric_fields": list(records.numeric_fields),
+        "arrays": list(arrays or {}),
+        "version": version,
+        "shape": list(feature_matrix.shape),
+        "nnz": int(feature_matrix.nnz),
+        "built_at": time.time(),
+    })
+    publish_version(name, version, meta)
+
+    print(f"[model_store] Đã lưu mô hình '{name}' phiên bản {version} tại {version_dir}", file=sys.stderr)
+    return version
+
+
+def load_artifacts(name, version=None):
+    """
+    Tải một phiên bản mô hình (mặc định là CURRENT). Ma trận đặc trưng, các cột của bảng
+    và các mảng dựng sẵn được memory-map ở chế độ chỉ đọc. Trả về None nếu chưa có
+    artifact nào hoặc phiên bản không theo bố cục hiện tại.
+    """
+    version = version or current_version(name)
+    if version is None:
+        return None
+
+    version_dir = os.path.join(_model_dir(name), version)
+    with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if "columns" not in meta:
+        print(f"[model_store] Phiên bản {version} của '{name}' không theo bố cục hiện tại, "
+              f"hãy build lại bằng build_index.py.", file=sys.stderr)
+        return None
+
+    parts = [np.load(os.path.join(version_dir, f"{part}.npy"), mmap_mode="r") for part in MATRIX_FILES]
+    feature_matrix = csr_matrix(tuple(parts), shape=tuple(meta["shape"]), copy=False)
+    ids = np.load(os.path.join(version_dir, "ids.npy"), mmap_mode="r")
+
+    with open(os.path.join(version_dir, "encoders.pkl"), "rb") as f:
+        encoders = pickle.load(f)
+    records = _load_table(version_dir, meta, ids)
+    arrays = {
+        array_name: np.load(os.path.join(version_dir, f"array_{array_name}.npy"), mmap_mode="r")
+        for array_name in meta.get("arrays", [])
+    }
+
+    return {
+        "version": version,
+        "meta": meta,
+        "feature_matrix": feature_matrix,
+        "ids": ids,
+        "encoders": encoders,
+        "records": records,
+        "arrays": arrays,
+    }
@@ -0,0 +1,141 @@
+# src/ml/mongo_client.py
+"""
+Kết nối MongoDB dùng chung trong tiến trình.
+
+- get_client(): một MongoClient cho mỗi URI, tạo ở lần dùng đầu tiên và dùng lại cho mọi
+  lần tải dữ liệu và truy vấn sau đó. MongoClient đã có pool kết nối và an toàn khi nhiều
+  luồng dùng chung, nên không còn phải bắt tay TCP/TLS và dò server ở mỗi lần gọi.
+  Các client được đóng khi tiến trình kết thúc.
+- find_by_ids(): lấy các document của một danh sách _id bằng một truy vấn $in, chỉ với
+  các trường của projection (ví dụ chỉ các trường kết quả của K phim được gợi ý).
+- Biến thể bất đồng bộ (RECOMMENDER_MONGO_ASYNC=1, cần gói motor): các truy vấn lúc phục
+  vụ chạy trên một AsyncIOMotorClient trong một event loop nền dùng chung, nên nhiều luồng
+  xử lý yêu cầu của recommender_server.py cùng chờ I/O trên một loop thay vì mỗi luồng
+  giữ một kết nối. find_by_ids_async() dùng trực tiếp được từ mã asyncio.
+
+Cấu hình:
+    RECOMMENDER_MONGO_POOL_SIZE      maxPoolSize của mỗi client, mặc định 20
+    RECOMMENDER_MONGO_ASYNC          "1" = dùng motor cho find_by_ids
+    RECOMMENDER_MONGO_TIMEOUT_MS     thời gian chờ tối đa của find_by_ids, mặc định 5000
+"""
+import os
+import sys
+import atexit
+import asyncio
+import threading
+
+from pymongo import MongoClient
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_TIMEOUT_MS = 5000
+MOVIES_COLLECTION = 'embedded_movies'
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+_loop = None
+_motor_missing = False
+
+
+def database_name(mongodb_uri):
+    return mongodb_uri.split('/')[-1].split('?')[0]
+
+
+def _pool_size():
+    return int(os.getenv("RECOMMENDER_MONGO_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def get_client(mongodb_uri=None):
+    """MongoClient dùng chung cho mongodb_uri (mặc định MONGODB_URI). Không đóng client này."""
+    mongodb_uri = mongodb_uri or os.getenv("MONGODB_URI")
+    client = _clients.get(mongodb_uri)
+    if client is None:
+        with _lock:
+            client = _clients.get(mongodb_uri)
+            if client is None:
+                client = MongoClient(mongodb_uri, maxPoolSize=_pool_size())
+                _clients[mongodb_uri] = client
+    return client
+
+
+def movies_collection(mongodb_uri=None):
+    mongodb_uri = mongodb_uri or os.getenv("MONGODB_URI")
+    return get_client(mongodb_uri)[database_name(mongodb_uri)][MOVIES_COLLECTION]
+
+
+# --- BIẾN THỂ BẤT ĐỒNG BỘ (motor) ---
+
+def _event_loop():
+    """Event loop nền dùng chung cho mọi truy vấn motor của tiến trình."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="mongo-async", daemon=True).start()
+        return _loop
+
+
+def get_async_client(mongodb_uri=None, loop=None):
+    """
+    AsyncIOMotorClient dùng chung cho mongodb_uri trên event loop loop (mặc định loop đang
+    chạy); None nếu chưa cài motor.
+    """
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        return None
+    mongodb_uri = mongodb_uri or os.getenv("MONGODB_URI")
+    loop = loop or asyncio.get_running_loop()
+    with _lock:
+        # Một client motor chỉ dùng được trên event loop đã tạo ra nó
+        client = _async_clients.get((mongodb_uri, id(loop)))
+        if client is None:
+            client = AsyncIOMotorClient(mongodb_uri, maxPoolSize=_pool_size(), io_loop=loop)
+            _async_clients[(mongodb_uri, id(loop))] = client
+    return client
+
+
+async def find_by_ids_async(ids, projection, mongodb_uri=None):
+    """{_id: document} của các _id trong ids, bằng một truy vấn $in trên motor."""
+    mongodb_uri = mongodb_uri or os.getenv("MONGODB_URI")
+    collection = get_async_client(mongodb_uri)[database_name(mongodb_uri)][MOVIES_COLLECTION]
+    documents = await collection.find({'_id': {'$in': list(ids)}}, projection).to_list(length=None)
+    return {doc['_id']: doc for doc in documents}
+
+
+def _use_async():
+    global _motor_missing
+    if os.getenv("RECOMMENDER_MONGO_ASYNC") != "1" or _motor_missing:
+        return False
+    try:
+        import motor  # noqa: F401
+    except ImportError:
+        _motor_missing = True
+        print("[mongo_client] RECOMMENDER_MONGO_ASYNC=1 nhưng chưa cài gói motor; dùng pymongo.", file=sys.stderr)
+        return False
+    return True
+
+
+def find_by_ids(ids, projection, mongodb_uri=None):
+    """
+    {_id: document} của các _id trong ids, bằng một truy vấn $in. Với RECOMMENDER_MONGO_ASYNC=1
+    truy vấn chạy trên event loop nền (motor) và luồng gọi chờ kết quả.
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+    timeout = float(os.getenv("RECOMMENDER_MONGO_TIMEOUT_MS", DEFAULT_TIMEOUT_MS)) / 1000
+    if _use_async():
+        future = asyncio.run_coroutine_threadsafe(find_by_ids_async(ids, projection, mongodb_uri), _event_loop())
+        return future.result(timeout)
+    cursor = movies_collection(mongodb_uri).find({'_id': {'$in': ids}}, projection).max_time_ms(int(timeout * 1000))
+    return {doc['_id']: doc for doc in cursor}
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        for client in list(_clients.values()) + list(_async_clients.values()):
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
@@ -2,292 +2,442 @@
 import sys
 import json
 import os
-import pandas as pd
-from pymongo import MongoClient
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MultiLabelBinarizer
-from scipy.sparse import hstack
+import threading
 from bson.objectid import ObjectId
-from scipy.sparse import csr_matrix
 
-def get_recommendations(movie_id_to_recommend=None, num_recommendations=10, search_keywords=None, user_preferences=None):
+import catalog
+import feature_engine
+import instrumentation
+import ranking
+import payload_store
+import result_cache
+import similar_movies
+
+# Bảng, bộ mã hóa, ma trận đặc trưng và backend truy hồi nằm trong kho đặc trưng dùng chung
+# với preference_recommender.py (xem feature_engine.py); các tên dưới đây giữ nguyên cho
+# các module khác (benchmark.py, incremental_indexer.py...)
+MOVIE_PROJECTION = feature_engine.PROJECTION
+LIST_FIELDS = feature_engine.LIST_FIELDS
+PAYLOAD_ONLY_FIELDS = feature_engine.PAYLOAD_ONLY_FIELDS
+EMBEDDING_FIELD = feature_engine.EMBEDDING_FIELD
+DENSE_WEIGHT = feature_engine.DENSE_WEIGHT
+VECTOR_FIELDS = feature_engine.VECTOR_FIELDS
+# Các cột số có thể lọc theo khoảng: min_<field> / max_<field> trong user_preferences
+NUMERIC_FILTER_FIELDS = ['year', 'runtime']
+FIELD_NORMALIZERS = feature_engine.FIELD_NORMALIZERS
+
+# Tên của mô hình này trong metric và khóa cache kết quả
+ARTIFACT_NAME = 'movie'
+
+# --- MÔ HÌNH ĐƯỢC CACHE TRONG TIẾN TRÌNH ---
+# Khi chạy ở chế độ thường trú (recommender_server.py), mô hình chỉ được xây dựng một lần
+# và dùng lại cho mọi yêu cầu. Khi chạy dạng script, cache chỉ sống trong một lần gọi.
+_model = None
+_model_lock = threading.Lock()
+
+# Cache kết quả xếp hạng theo truy vấn đã chuẩn hóa + phiên bản mô hình (xem result_cache.py)
+_cache = result_cache.from_env()
+
+
+def load_movies_data(mongodb_uri):
+    """Tải toàn bộ dữ liệu phim cần cho việc gợi ý thành MovieTable (xem feature_engine.load_table)."""
+    return feature_engine.load_table(mongodb_uri)
+
+
+def prepare_table(movies_data):
     """
-    Hàm này kết nối tới MongoDB, lấy dữ liệu phim,
-    tính toán độ tương đồng và trả về gợi ý.
-    Có thể gợi ý theo movie_id, search_keywords, hoặc user_preferences.
+    Chuyển danh sách document phim thành MovieTable đã chuẩn hóa.
+    Dùng cho MongoPayloadStore với các phim được gợi ý.
+    """
+    return feature_engine.prepare_table(movies_data)
+
+
+def build_model(table, workers=None, compact_mode=None, field_weights=None):
+    """
+    Xây dựng một kho đặc trưng mới trên MovieTable (xem feature_engine.build_store) và mô
+    hình của script này trên kho đó. Kho chỉ được dùng chung sau install_model().
+    """
+    return model_from_store(feature_engine.build_store(table, workers, compact_mode, field_weights))
+
+
+def model_from_store(store, previous=None):
+    """
+    Mô hình của script trên một kho đặc trưng: dùng chung mọi thành phần của kho, cộng với
+    kết quả JSON dựng sẵn cho từng phim, hoặc lấy từ MongoDB lúc truy vấn
+    (RECOMMENDER_PAYLOAD_SOURCE=mongo, xem payload_store.py).
+    previous: mô hình đang phục vụ; nếu kho mới là bản cập nhật tăng dần của kho của nó
+    (incremental_indexer.py), kết quả JSON của các phim không đổi được dùng lại.
+    """
+    model = dict(store)
+    model["store"] = store
+    # Bảng phim tương tự tính sẵn cho gợi ý theo ID (similar_movies.py), None nếu chưa có
+    model["similar"] = similar_movies.for_store(store)
+    with instrumentation.stage("prepare"):
+        model["payloads"] = build_payloads(store, previous)
+    return model
+
+
+def build_payloads(store, previous=None):
+    """
+    Kết quả JSON dựng sẵn của script trên kho: bản lưu cùng artifact của kho nếu có,
+    ngược lại tuần tự hóa (chỉ các phim đã đổi so với mô hình previous nếu được).
+    """
+    saved = payload_store.saved_store(store, ARTIFACT_NAME)
+    if saved is not None:
+        return saved
+    return payload_store.build_store(
+        store["table"], movie_payload, prepare_table, MOVIE_PROJECTION, **payload_store.reuse_args(store, previous)
+    )
+
+
+def save_model(model):
+    """
+    Lưu kho đặc trưng của mô hình vào model_store và trả về tên phiên bản mới.
+    """
+    version = feature_engine.save_store(model["store"], {ARTIFACT_NAME: model["payloads"]})
+    model["version"] = version
+    return version
+
+
+def install_model(model):
+    """
+    Đặt mô hình (và kho đặc trưng của nó) làm mô hình đang phục vụ. Phép gán một tham chiếu
+    là nguyên tử nên các truy vấn đang chạy vẫn dùng trọn vẹn mô hình cũ, truy vấn sau dùng
+    mô hình mới; preference_recommender.py chuyển sang kho mới ở truy vấn kế tiếp.
+    """
+    global _model
+    feature_engine.install_store(model["store"])
+    _model = model
+    _cache.invalidate()
+
+
+def get_model(mongodb_uri):
+    """
+    Trả về mô hình trên kho đặc trưng đang phục vụ (feature_engine.get_store: artifact đã
+    build sẵn, hoặc tải dữ liệu và xây dựng). Phần riêng của script được dựng lại khi kho
+    có phiên bản mới. Trả về None nếu collection không có dữ liệu.
+    """
+    global _model
+    store = feature_engine.get_store(mongodb_uri)
+    if store is None:
+        return None
+    model = _model
+    if model is not None and model["store"] is store:
+        return model
+
+    with _model_lock:
+        # Kiểm tra lại sau khi lấy khóa: một luồng khác có thể đã dựng xong
+        if _model is None or _model["store"] is not store:
+            _model = model_from_store(store, _model)
+            _cache.invalidate()
+        return _model
+
+
+def movie_payload(movie):
+    """
+    Dữ liệu trả về cho Node của một phim (không gồm similarity).
+    Được gọi một lần cho mỗi phim khi dựng PayloadStore, không phải mỗi truy vấn.
+    """
+    return {
+        "id": str(movie['id']),
+        "title": movie['title'],
+        "genres": movie['genres'] if isinstance(movie['genres'], list) else [],
+        "plot": movie['plot'] if isinstance(movie['plot'], str) else "",
+        "fullplot": movie['fullplot'] if isinstance(movie['fullplot'], str) else "",
+        "cast": movie['cast'] if isinstance(movie['cast'], list) else [],
+        "directors": movie['directors'] if isinstance(movie['directors'], list) else [],
+        "writers": movie['writers'] if isinstance(movie['writers'], list) else [],
+        "poster": movie['poster'] if isinstance(movie['poster'], str) else "",
+        "languages": movie['languages'] if isinstance(movie['languages'], list) else [],
+        "released": movie['released'] if isinstance(movie['released'], str) else "",
+        "awards": movie['awards'] if isinstance(movie['awards'], dict) else {},
+        "lastupdated": movie['lastupdated'] if isinstance(movie['lastupdated'], str) else "",
+        "year": movie['year'] if isinstance(movie['year'], (int, float)) else None,
+        "imdb": movie['imdb'] if isinstance(movie['imdb'], dict) else {},
+        "countries": movie['countries'] if isinstance(movie['countries'], list) else [],
+        "type": movie['type'] if isinstance(movie['type'], str) else "",
+        "runtime": movie['runtime'] if isinstance(movie['runtime'], (int, float)) else None,
+    }
+
+
+def is_count(value):
+    """Số nguyên JSON (bool không được tính)."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def query_error(query):
+    """
+    Kiểm tra kiểu các trường của một truy vấn trước khi lập kế hoạch. Trả về thông báo lỗi,
+    hoặc None nếu hợp lệ; truy vấn sai kiểu chỉ làm lỗi vị trí của nó trong lô.
+    """
+    num_recommendations = query.get("num_recommendations")
+    if num_recommendations is not None and not (is_count(num_recommendations) and num_recommendations >= 1):
+        return "'num_recommendations' phải là số nguyên dương."
+    if query.get("search_keywords") and not isinstance(query["search_keywords"], str):
+        return "'search_keywords' phải là chuỗi."
+    user_preferences = query.get("user_preferences")
+    if user_preferences and not query.get("search_keywords"):
+        if not isinstance(user_preferences, dict):
+            return "'user_preferences' phải là một object JSON."
+        for col in LIST_FIELDS:
+            values = user_preferences.get(col, [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                return f"'user_preferences.{col}' phải là danh sách chuỗi."
+        for field in NUMERIC_FILTER_FIELDS:
+            for bound in ('min', 'max'):
+                value = user_preferences.get(f'{bound}_{field}')
+                if value is not None and not is_number(value):
+                    return f"'user_preferences.{bound}_{field}' phải là số."
+    return None
+
+
+def plan_query(model, query):
+    """
+    Chuyển một truy vấn (cùng định dạng JSON mà Node gửi sang) thành kế hoạch chấm điểm:
+    vector truy vấn thưa, tập ứng viên (bộ lọc năm/thời lượng), dòng cần loại (gợi ý theo ID).
+    Trả về (kế hoạch, None), hoặc (None, phản hồi) nếu truy vấn không cần chấm điểm
+    (lỗi hoặc thông báo).
+    """
+    error = query_error(query)
+    if error is not None:
+        return None, {"error": error}
+
+    store = model["store"]
+    search_keywords = query.get("search_keywords")
+    user_preferences = query.get("user_preferences")
+    movie_id_to_recommend = query.get("movie_id")
+    num_recommendations = query.get("num_recommendations")
+
+    plan = {
+        "candidates": None,
+        "exclude": None,
+        "num_recommendations": 10 if num_recommendations is None else num_recommendations,
+        "compact": bool(query.get("compact", False)),
+    }
+
+    if search_keywords:
+        # Logic xử lý search_keywords
+        # Nhận diện thể loại/diễn viên/đạo diễn... (kể cả tên nhiều từ) qua chỉ mục đảo,
+        # cùng với vector TF-IDF của từ khóa (chế độ "keyword" của kho đặc trưng)
+        query_feature_vector = feature_engine.keyword_vector(store, search_keywords)
+
+        plan["empty_message"] = "Không tìm thấy gợi ý nào cho từ khóa này."
+        plan["cache_query"] = {"search_keywords": result_cache.normalize_keywords(search_keywords)}
+
+    elif user_preferences:
+        # Logic xử lý user_preferences
+        query_lists = {col: user_preferences.get(col, []) for col in LIST_FIELDS}
+
+        query_text_features = " ".join(sum((query_lists[col] for col in LIST_FIELDS), []))
+        query_feature_vector = feature_engine.preference_vector(store, query_lists, text=query_text_features)
+
+        # Áp dụng các bộ lọc số học trước khi tính điểm: chỉ các phim thỏa điều kiện
+        # mới được so sánh, nên kết quả luôn đủ num_recommendations nếu có đủ phim phù hợp
+        # (phim không có năm/thời lượng bị loại khi có bộ lọc tương ứng)
+        plan["candidates"] = ranking.intersect_rows(*[
+            model["columns"][field].range_rows(user_preferences.get(f'min_{field}'), user_preferences.get(f'max_{field}'))
+            for field in NUMERIC_FILTER_FIELDS
+            if user_preferences.get(f'min_{field}') is not None or user_preferences.get(f'max_{field}') is not None
+        ])
+        plan["empty_message"] = "Không tìm thấy gợi ý nào phù hợp với sở thích của bạn."
+        plan["cache_query"] = {"user_preferences": {
+            **{col: sorted(map(str, query_lists[col])) for col in LIST_FIELDS},
+            **{f'{bound}_{field}': user_preferences.get(f'{bound}_{field}')
+               for field in NUMERIC_FILTER_FIELDS for bound in ('min', 'max')},
+        }}
+
+    elif movie_id_to_recommend:
+        # Logic gợi ý theo ID phim
+        try:
+            obj_movie_id = ObjectId(movie_id_to_recommend)
+        except Exception: # Bắt lỗi cụ thể hơn
+            return None, {"error": "Định dạng ID phim không hợp lệ."}
+
+        if obj_movie_id not in model["indices"]:
+            return None, {"error": f"Không tìm thấy phim với ID: {movie_id_to_recommend} trong dữ liệu."}
+
+        idx = model["indices"][obj_movie_id]
+        # Top-K tính sẵn: tra bảng thay vì chấm điểm (trừ khi client gửi embedding truy vấn riêng)
+        if model["similar"] is not None and query.get(EMBEDDING_FIELD) is None:
+            plan["precomputed"] = model["similar"].lookup(idx, plan["num_recommendations"])
+        # Vector truy vấn là chính dòng của phim đó; loại phim đang xét theo chỉ số dòng
+        if plan.get("precomputed") is None:
+            query_feature_vector = feature_engine.by_id_vector(store, idx)
+        else:
+            query_feature_vector = None
+        plan["exclude"] = idx
+        plan["empty_message"] = None
+        plan["cache_query"] = {"movie_id": str(obj_movie_id)}
+        # Kênh dày: embedding của chính phim đó (nếu có)
+        if model["embeddings"] is not None and model["embeddings"][idx].any():
+            plan["embedding"] = model["embeddings"][idx]
+    else:
+        return None, {"message": "Vui lòng cung cấp 'movie_id', 'search_keywords' hoặc 'user_preferences' để nhận gợi ý."}
+
+    # Embedding truy vấn do client gửi kèm (cùng mô hình embedding với collection)
+    if query.get(EMBEDDING_FIELD) is not None and model["embeddings"] is not None:
+        query_embedding = catalog.as_vector(query[EMBEDDING_FIELD])
+        if query_embedding is None or query_embedding.size != model["embeddings"].shape[1]:
+            return None, {"error": f"'{EMBEDDING_FIELD}' phải là vector {model['embeddings'].shape[1]} chiều."}
+        plan["embedding"] = catalog.stack_vectors([query_embedding])[0]
+        plan["cache_query"][EMBEDDING_FIELD] = result_cache.vector_digest(plan["embedding"])
+
+    if plan.get("embedding") is not None:
+        plan["cache_query"]["dense_weight"] = DENSE_WEIGHT
+
+    plan["vector"] = query_feature_vector
+    return plan, None
+
+
+def run_plans(model, plans):
+    """
+    Trả về danh sách phản hồi theo thứ tự của plans. Top-K được lấy từ bảng phim tương tự
+    tính sẵn (kế hoạch theo ID có "precomputed") hoặc từ cache nếu có; các kế hoạch còn lại
+    được chấm điểm chung một lần bởi backend truy hồi của mô hình (xem retrieval.py) rồi
+    đưa vào cache.
+    K được làm tròn lên theo bucket của result_cache và cắt lại khi dựng phản hồi.
+    """
+    ranked = [plan.get("precomputed") for plan in plans]
+    keys = [None] * len(plans)
+    precomputed = sum(result is not None for result in ranked)
+    instrumentation.count("similar_table_hits", precomputed)
+    with instrumentation.stage("cache"):
+        for i, plan in enumerate(plans):
+            plan["k"] = result_cache.bucket_size(plan["num_recommendations"])
+            if _cache.enabled and ranked[i] is None:
+                keys[i] = result_cache.make_key(ARTIFACT_NAME, model["version"], [plan["cache_query"], plan["k"]])
+                ranked[i] = _cache.get(keys[i])
+
+    misses = [i for i in range(len(plans)) if ranked[i] is None]
+    instrumentation.count("cache_hits", len(plans) - precomputed - len(misses))
+    instrumentation.count("cache_misses", len(misses))
+    with instrumentation.stage("score"):
+        for i, result in zip(misses, model["retriever"].rank([plans[i] for i in misses])):
+            ranked[i] = result
+            if keys[i] is not None:
+                _cache.set(keys[i], result)
+
+    # Dựng JSON phản hồi từ các đoạn có sẵn (phần tuần tự hóa chính của phản hồi), một lần
+    # cho cả lô (với MongoPayloadStore: một truy vấn $in cho mọi phim được gợi ý)
+    items = []
+    for plan, (top_indices, top_scores) in zip(plans, ranked):
+        n = plan["num_recommendations"]
+        items.append((top_indices[:n], top_scores[:n], plan["compact"]))
+        instrumentation.count("results", len(top_indices[:n]))
+    with instrumentation.stage("render"):
+        rendered = model["payloads"].render_all(items)
+
+    responses = []
+    for plan, (top_indices, _, _), recommendations in zip(plans, items, rendered):
+        if not len(top_indices) and plan["empty_message"]:
+            responses.append({"message": plan["empty_message"]})
+        else:
+            responses.append({"recommendations": recommendations})
+    return responses
+
+
+def get_batch_recommendations(queries):
+    """
+    Trả lời nhiều truy vấn (theo ID, từ khóa hoặc sở thích, có thể lẫn lộn) trong một lần
+    chấm điểm. Trả về {"results": [...]}, mỗi phần tử là phản hồi của truy vấn cùng vị trí,
+    giống hệt phản hồi của get_recommendations cho truy vấn đó.
     """
     MONGODB_URI = os.getenv("MONGODB_URI")
     if not MONGODB_URI:
         return {"error": "Biến môi trường MONGODB_URI không được thiết lập."}
-    
-    DB_NAME = MONGODB_URI.split('/')[-1].split('?')[0]
+    if not isinstance(queries, list):
+        return {"error": "'queries' phải là một danh sách truy vấn."}
 
-    client = None
     try:
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
-        movies_collection = db['embedded_movies']
-        
-        movies_data = list(movies_collection.find({}, {
-            '_id': 1, 'title': 1, 'genres': 1, 'plot': 1, 'fullplot': 1,
-            'cast': 1, 'directors': 1, 'writers': 1, 'awards': 1, 'poster': 1,
-            'languages': 1, 'released': 1, 'lastupdated': 1, 'year': 1, 'imdb': 1,
-            'countries': 1, 'type': 1, 'runtime': 1
-        }))
-        
-        if not movies_data:
+        with instrumentation.stage("model"):
+            model = get_model(MONGODB_URI)
+        if model is None:
             return {"error": "Không tìm thấy dữ liệu phim trong collection 'embedded_movies'."}
 
-        df = pd.DataFrame(movies_data)
-        df.rename(columns={'_id': 'id'}, inplace=True)
-        
-        # --- SỬA LỖI: DI CHUYỂN DÒNG ĐỊNH NGHĨA 'indices' LÊN ĐÂY ---
-        indices = pd.Series(df.index, index=df['id']).drop_duplicates()
-        # --- HẾT SỬA LỖI ---
-        
-        # Xử lý dữ liệu thiếu: thay thế NaN bằng chuỗi rỗng cho các cột text, danh sách rỗng cho các cột list
-        df['plot'] = df['plot'].fillna('')
-        df['fullplot'] = df['fullplot'].fillna('')
-        
-        for col in ['genres', 'cast', 'directors', 'writers', 'languages', 'countries']:
-            df[col] = df[col].apply(lambda x: x if isinstance(x, list) else [])
-
-        # Mã hóa One-Hot cho các trường dạng mảng
-        mlb_genres = MultiLabelBinarizer()
-        genres_matrix = mlb_genres.fit_transform(df['genres'])
-        
-        mlb_cast = MultiLabelBinarizer()
-        cast_matrix = mlb_cast.fit_transform(df['cast'])
-
-        mlb_directors = MultiLabelBinarizer()
-        directors_matrix = mlb_directors.fit_transform(df['directors'])
-
-        mlb_writers = MultiLabelBinarizer()
-        writers_matrix = mlb_writers.fit_transform(df['writers'])
-
-        mlb_languages = MultiLabelBinarizer()
-        languages_matrix = mlb_languages.fit_transform(df['languages'])
-
-        mlb_countries = MultiLabelBinarizer()
-        countries_matrix = mlb_countries.fit_transform(df['countries'])
-
-        # Vector hóa TF-IDF cho các trường văn bản
-        tfidf_plot = TfidfVectorizer(stop_words='english', max_features=5000)
-        plot_tfidf_matrix = tfidf_plot.fit_transform(df['plot'] + ' ' + df['fullplot'])
-        
-        # Ghép nối tất cả các ma trận thành một ma trận đặc trưng lớn
-        feature_matrix = hstack([
-            genres_matrix,
-            cast_matrix,
-            directors_matrix,
-            writers_matrix,
-            languages_matrix,
-            countries_matrix,
-            plot_tfidf_matrix
-        ]).tocsr()
-
-        # Tính toán độ tương đồng Cosine trên ma trận đặc trưng tổng hợp (Chỉ tính khi cần cho movie_id, hoặc sau khi query vector được tạo)
-        # Để tránh tính toán lại, chúng ta có thể đặt nó ở đây nếu nó được dùng cho cả hai trường hợp.
-        # Hoặc tính toán cụ thể cho từng trường hợp để tối ưu bộ nhớ nếu dataset rất lớn.
-        # Với kích thước dataset trung bình, tính toán một lần ở đây là chấp nhận được.
-        cosine_sim = cosine_similarity(feature_matrix, feature_matrix)
-
-        # Hàm trợ giúp để lấy gợi ý từ ma trận tương đồng
-        def get_top_n_recommendations(sim_scores, df_movies, num_rec):
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            # Loại bỏ chính nó chỉ khi gợi ý từ một movie_id
-            # Khi gợi ý từ search_keywords/user_preferences thì không loại bỏ
-            # Kiểm tra xem sim_scores có phải từ một movie_id cụ thể không
-            # Bổ sung một tham số is_self_exclusion vào hàm này nếu cần
-            
-            # Đối với movie_id, loại bỏ phần tử đầu tiên (chính nó)
-            if len(sim_scores) > 0 and sim_scores[0][1] == 1.0: # Kiểm tra nếu score đầu tiên là 1.0 (chính nó)
-                sim_scores = sim_scores[1:num_rec+1] 
-            else: # Đối với search_keywords/user_preferences, không loại bỏ
-                sim_scores = sim_scores[:num_rec]
-            
-            movie_indices = [i[0] for i in sim_scores]
-            
-            recommended_movies = []
-            for i, score in zip(movie_indices, [s[1] for s in sim_scores]):
-                movie = df_movies.iloc[i]
-                recommended_movies.append({
-                    "id": str(movie['id']),
-                    "title": movie['title'],
-                    "similarity": round(score, 4),
-                    "genres": movie['genres'] if isinstance(movie['genres'], list) else [],
-                    "plot": movie['plot'] if isinstance(movie['plot'], str) else "",
-                    "fullplot": movie['fullplot'] if isinstance(movie['fullplot'], str) else "",
-                    "cast": movie['cast'] if isinstance(movie['cast'], list) else [],
-                    "directors": movie['directors'] if isinstance(movie['directors'], list) else [],
-                    "writers": movie['writers'] if isinstance(movie['writers'], list) else [],
-                    "poster": movie['poster'] if isinstance(movie['poster'], str) else "",
-                    "languages": movie['languages'] if isinstance(movie['languages'], list) else [],
-                    "released": movie['released'] if isinstance(movie['released'], str) else "",
-                    "awards": movie['awards'] if isinstance(movie['awards'], dict) else {},
-                    "lastupdated": movie['lastupdated'] if isinstance(movie['lastupdated'], str) else "",
-                    "year": movie['year'] if isinstance(movie['year'], (int, float)) else None,
-                    "imdb": movie['imdb'] if isinstance(movie['imdb'], dict) else {},
-                    "countries": movie['countries'] if isinstance(movie['countries'], list) else [],
-                    "type": movie['type'] if isinstance(movie['type'], str) else "",
-                    "runtime": movie['runtime'] if isinstance(movie['runtime'], (int, float)) else None,
-                })
-            return recommended_movies
-
-        if search_keywords:
-            # Logic xử lý search_keywords
-            query_plot_tfidf = tfidf_plot.transform([search_keywords])
-
-            query_genres_matrix = csr_matrix((1, genres_matrix.shape[1]))
-            query_cast_matrix = csr_matrix((1, cast_matrix.shape[1]))
-            query_directors_matrix = csr_matrix((1, directors_matrix.shape[1]))
-            query_writers_matrix = csr_matrix((1, writers_matrix.shape[1]))
-            query_languages_matrix = csr_matrix((1, languages_matrix.shape[1]))
-            query_countries_matrix = csr_matrix((1, countries_matrix.shape[1]))
-
-            keywords_list = search_keywords.lower().split()
-            
-            matched_genres = [g for g in mlb_genres.classes_ if g.lower() in keywords_list]
-            if matched_genres:
-                query_genres_matrix = mlb_genres.transform([matched_genres])
-
-            matched_cast = [c for c in mlb_cast.classes_ if c.lower() in keywords_list]
-            if matched_cast:
-                query_cast_matrix = mlb_cast.transform([matched_cast])
-
-            matched_directors = [d for d in mlb_directors.classes_ if d.lower() in keywords_list]
-            if matched_directors:
-                query_directors_matrix = mlb_directors.transform([matched_directors])
-
-            matched_writers = [w for w in mlb_writers.classes_ if w.lower() in keywords_list]
-            if matched_writers:
-                query_writers_matrix = mlb_writers.transform([matched_writers])
-
-            matched_languages = [l for l in mlb_languages.classes_ if l.lower() in keywords_list]
-            if matched_languages:
-                query_languages_matrix = mlb_languages.transform([matched_languages])
-
-            matched_countries = [c for c in mlb_countries.classes_ if c.lower() in keywords_list]
-            if matched_countries:
-                query_countries_matrix = mlb_countries.transform([matched_countries])
-
-            query_feature_vector = hstack([
-                query_genres_matrix,
-                query_cast_matrix,
-                query_directors_matrix,
-                query_writers_matrix,
-                query_languages_matrix,
-                query_countries_matrix,
-                query_plot_tfidf
-            ]).tocsr()
-
-            if query_feature_vector.shape[1] != feature_matrix.shape[1]:
-                return {"error": "Lỗi: Kích thước vector tìm kiếm không khớp với ma trận đặc trưng của phim."}
-
-            sim_scores = cosine_similarity(query_feature_vector, feature_matrix).flatten()
-            sim_scores_with_indices = list(enumerate(sim_scores))
-            
-            top_recommendations = get_top_n_recommendations(sim_scores_with_indices, df, num_recommendations)
-            
-            top_recommendations = [rec for rec in top_recommendations if rec['similarity'] > 0]
-            
-            if not top_recommendations:
-                return {"message": "Không tìm thấy gợi ý nào cho từ khóa này."}
-            return {"recommendations": top_recommendations}
-
-        elif user_preferences:
-            # Logic xử lý user_preferences
-            query_genres = user_preferences.get("genres", [])
-            query_cast = user_preferences.get("cast", [])
-            query_directors = user_preferences.get("directors", [])
-            query_writers = user_preferences.get("writers", [])
-            query_languages = user_preferences.get("languages", [])
-            query_countries = user_preferences.get("countries", [])
-            
-            query_text_features = " ".join(query_genres + query_cast + query_directors + query_writers + query_languages + query_countries)
-            query_plot_tfidf = tfidf_plot.transform([query_text_features])
-
-            query_genres_matrix = mlb_genres.transform([query_genres])
-            query_cast_matrix = mlb_cast.transform([query_cast])
-            query_directors_matrix = mlb_directors.transform([query_directors])
-            query_writers_matrix = mlb_writers.transform([query_writers])
-            query_languages_matrix = mlb_languages.transform([query_languages])
-            query_countries_matrix = mlb_countries.transform([query_countries])
-            
-            query_feature_vector = hstack([
-                query_genres_matrix,
-                query_cast_matrix,
-                query_directors_matrix,
-                query_writers_matrix,
-                query_languages_matrix,
-                query_countries_matrix,
-                query_plot_tfidf
-            ]).tocsr()
-
-            if query_feature_vector.shape[1] != feature_matrix.shape[1]:
-                return {"error": "Lỗi: Kích thước vector sở thích người dùng không khớp."}
-
-            sim_scores = cosine_similarity(query_feature_vector, feature_matrix).flatten()
-            sim_scores_with_indices = list(enumerate(sim_scores))
-            
-            top_recommendations = get_top_n_recommendations(sim_scores_with_indices, df, num_recommendations)
-            top_recommendations = [rec for rec in top_recommendations if rec['similarity'] > 0]
-
-            # Áp dụng các bộ lọc số học
-            if 'min_year' in user_preferences and user_preferences['min_year'] is not None:
-                top_recommendations = [rec for rec in top_recommendations if rec.get('year') is not None and rec.get('year', 0) >= user_preferences['min_year']]
-            if 'max_year' in user_preferences and user_preferences['max_year'] is not None:
-                top_recommendations = [rec for rec in top_recommendations if rec.get('year') is not None and rec.get('year', 9999) <= user_preferences['max_year']]
-            if 'min_runtime' in user_preferences and user_preferences['min_runtime'] is not None:
-                top_recommendations = [rec for rec in top_recommendations if rec.get('runtime') is not None and rec.get('runtime', 0) >= user_preferences['min_runtime']]
-            if 'max_runtime' in user_preferences and user_preferences['max_runtime'] is not None:
-                top_recommendations = [rec for rec in top_recommendations if rec.get('runtime') is not None and rec.get('runtime', 99999) <= user_preferences['max_runtime']]
-
-            if not top_recommendations:
-                return {"message": "Không tìm thấy gợi ý nào phù hợp với sở thích của bạn."}
-            return {"recommendations": top_recommendations}
-
-        elif movie_id_to_recommend:
-            # Logic gợi ý theo ID phim
-            try:
-                obj_movie_id = ObjectId(movie_id_to_recommend)
-            except Exception: # Bắt lỗi cụ thể hơn
-                return {"error": "Định dạng ID phim không hợp lệ."}
-
-            if obj_movie_id not in indices:
-                return {"error": f"Không tìm thấy phim với ID: {movie_id_to_recommend} trong dữ liệu."}
-            
-            idx = indices[obj_movie_id]
-            sim_scores = list(enumerate(cosine_sim[idx]))
-            
-            recommendations = get_top_n_recommendations(sim_scores, df, num_recommendations)
-            return {"recommendations": recommendations}
-        else:
-            return {"message": "Vui lòng cung cấp 'movie_id', 'search_keywords' hoặc 'user_preferences' để nhận gợi ý."}
+        instrumentation.count("queries", len(queries))
+        results = [None] * len(queries)
+        plans, positions = [], []
+        with instrumentation.stage("plan"):
+            for position, query in enumerate(queries):
+                if not isinstance(query, dict):
+                    results[position] = {"error": "Mỗi truy vấn phải là một object JSON."}
+                    continue
+                plan, response = plan_query(model, query)
+                if plan is None:
+                    results[position] = response
+                else:
+                    plans.append(plan)
+                    positions.append(position)
+
+        for position, response in zip(positions, run_plans(model, plans)):
+            results[position] = response
+        return {"results": results}
 
     except Exception as e:
-        # Ghi log lỗi chi tiết hơn
         import traceback
         traceback.print_exc()
         return {"error": str(e)}
-    finally:
-        if client:
-            client.close()
+
+
+def get_recommendations(movie_id_to_recommend=None, num_recommendations=10, search_keywords=None, user_preferences=None,
+                        compact=False, query_embedding=None):
+    """
+    Hàm này lấy mô hình (tải dữ liệu phim từ MongoDB nếu chưa có trong cache),
+    tính toán độ tương đồng và trả về gợi ý.
+    Có thể gợi ý theo movie_id, search_keywords, hoặc user_preferences.
+    compact=True bỏ plot/fullplot khỏi kết quả (cho các trang danh sách).
+    query_embedding: embedding truy vấn cho kênh dày (khi RECOMMENDER_DENSE_WEIGHT > 0).
+    Danh sách "recommendations" là payload_store.RawJSON, ghi ra bằng payload_store.dumps.
+    """
+    batch = get_batch_recommendations([{
+        "movie_id": movie_id_to_recommend,
+        "num_recommendations": num_recommendations,
+        "search_keywords": search_keywords,
+        "user_preferences": user_preferences,
+        "compact": compact,
+        EMBEDDING_FIELD: query_embedding,
+    }])
+    return batch["results"][0] if "results" in batch else batch
+
+def handle_request(input_data):
+    """
+    Chuyển dict đầu vào (cùng định dạng JSON mà Node gửi sang) thành lời gọi get_recommendations.
+    Có "queries" (danh sách truy vấn) thì trả lời cả lô bằng get_batch_recommendations.
+    "timings": true thêm khối thời gian theo giai đoạn vào phản hồi, "profile": true kèm
+    mẫu của profiler (xem instrumentation.py).
+    Dùng chung cho chế độ script và chế độ thường trú.
+    """
+    with instrumentation.request(ARTIFACT_NAME, input_data.get("timings"), input_data.get("profile")) as timings:
+        return timings.attach(route_request(input_data))
+
+
+def route_request(input_data):
+    if "queries" in input_data:
+        return get_batch_recommendations(input_data["queries"])
+
+    movie_id = input_data.get("movie_id")
+    num_rec = input_data.get("num_recommendations", 10)
+    search_keywords = input_data.get("search_keywords")
+    user_preferences = input_data.get("user_preferences") # Lấy sở thích người dùng
+    compact = bool(input_data.get("compact", False))
+    query_embedding = input_data.get(EMBEDDING_FIELD)
+
+    return get_recommendations(movie_id, num_rec, search_keywords, user_preferences, compact, query_embedding)
+
 
 if __name__ == "__main__":
     input_data = {}
     if len(sys.argv) > 1:
         try:
-            input_data = json.loads(sys.argv[1])
+            # "-": đọc JSON từ stdin (Node dùng cách này để không bị giới hạn ARG_MAX)
+            input_data = json.loads(sys.stdin.read() if sys.argv[1] == '-' else sys.argv[1])
         except json.JSONDecodeError:
             print(json.dumps({"error": "Đầu vào JSON không hợp lệ."}))
             sys.exit(1)
 
-    movie_id = input_data.get("movie_id")
-    num_rec = input_data.get("num_recommendations", 10)
-    search_keywords = input_data.get("search_keywords")
-    user_preferences = input_data.get("user_preferences") # Lấy sở thích người dùng
-
-    recommendations_result = get_recommendations(movie_id, num_rec, search_keywords, user_preferences)
-    print(json.dumps(recommendations_result))
\ No newline at end of file
+    recommendations_result = handle_request(input_data)
+    print(payload_store.dumps(recommendations_result))
@@ -0,0 +1,153 @@
+# src/ml/parallel.py
+"""
+Dựng mô hình và chấm điểm song song trên nhiều lõi.
+
+- build_pool(): một ProcessPoolExecutor dùng chung cho cả lần build (khởi động tiến trình
+  chỉ một lần); None khi chỉ có 1 worker hoặc danh mục nhỏ (chạy tuần tự).
+- encode_fields(): mã hóa one-hot các trường danh sách (catalog.encode_labels), mỗi trường
+  một tác vụ trên pool.
+- HashingTfidf: thay thế TfidfVectorizer có thể fit song song. HashingVectorizer không
+  có trạng thái nên các khối văn bản được đếm từ ở nhiều tiến trình, ghép lại theo đúng
+  thứ tự, rồi IDF (và lọc min_df/max_df) được tính một lần trên toàn bộ ma trận đếm.
+  Chỉ dùng khi RECOMMENDER_TEXT_ENCODER=hashing; TF-IDF mặc định vẫn fit tuần tự
+  (xem text_encoder()).
+- Chấm điểm: ranking.cosine_score_blocks chia các dòng của ma trận đặc trưng thành các
+  khối và nhân song song trên một pool luồng (phép nhân ma trận thưa của SciPy nhả GIL),
+  xem scoring_pool().
+
+Kết quả không phụ thuộc số worker: các khối luôn được ghép theo thứ tự dòng, và mỗi phần
+tử của kết quả được tính bởi cùng một phép toán như khi chạy tuần tự.
+
+Cấu hình:
+    RECOMMENDER_CPU_WORKERS   số tiến trình/luồng tối đa, mặc định os.cpu_count(); 1 = tuần tự
+    RECOMMENDER_TEXT_ENCODER  "tfidf" (mặc định, fit tuần tự) hoặc "hashing" (fit song song)
+"""
+import os
+import contextlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import vstack, diags
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+
+import catalog
+
+# Dưới ngưỡng này chi phí khởi động tiến trình lớn hơn phần tiết kiệm được
+PARALLEL_MIN_ROWS = 20000
+DEFAULT_HASH_FEATURES = 2 ** 18
+# Số văn bản trong một tác vụ đếm từ của HashingTfidf
+TEXT_CHUNK_ROWS = 10000
+
+_scoring_pool = None
+_scoring_pool_lock = threading.Lock()
+
+
+def resolve_workers(workers=None):
+    """Số worker thực tế: tham số, nếu không có thì RECOMMENDER_CPU_WORKERS, mặc định số lõi."""
+    if workers is None:
+        workers = int(os.getenv("RECOMMENDER_CPU_WORKERS", 0) or 0) or os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def build_pool(n_rows, workers=None):
+    """
+    Pool tiến trình cho một lần build, dùng với with. Trả về nullcontext(None) nếu chỉ có
+    1 worker hoặc n_rows < PARALLEL_MIN_ROWS.
+    """
+    workers = resolve_workers(workers)
+    if workers <= 1 or n_rows < PARALLEL_MIN_ROWS:
+        return contextlib.nullcontext(None)
+    # "spawn" thay vì fork: an toàn khi tiến trình cha đang chạy nhiều luồng (chế độ thường trú)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def encode_fields(table, fields, pool=None, min_counts=None):
+    """
+    Trả về {trường: (MultiLabelBinarizer, ma trận CSR)} cho từng trường danh sách.
+    min_counts: {trường: số dòng tối thiểu của một nhãn} (xem catalog.encode_labels).
+    """
+    min_counts = [(min_counts or {}).get(field, 1) for field in fields]
+    if pool is None:
+        return {field: catalog.encode_labels(table[field], min_count) for field, min_count in zip(fields, min_counts)}
+    return dict(zip(fields, pool.map(catalog.encode_labels, [table[field] for field in fields], min_counts)))
+
+
+def _hash_counts(hasher, texts):
+    return hasher.transform(texts)
+
+
+class HashingTfidf:
+    """
+    TF-IDF trên HashingVectorizer, dùng như TfidfVectorizer (fit_transform / transform).
+    Không có từ vựng: số cột cố định là n_features. min_df / max_df có cùng nghĩa như
+    trong TfidfVectorizer (số nguyên = số văn bản, số thực = tỉ lệ).
+    """
+
+    def __init__(self, n_features=DEFAULT_HASH_FEATURES, stop_words=None, min_df=1, max_df=1.0):
+        self.n_features = n_features
+        self.min_df = min_df
+        self.max_df = max_df
+        self.hasher = HashingVectorizer(n_features=n_features, stop_words=stop_words,
+                                        alternate_sign=False, norm=None)
+        self.transformer = TfidfTransformer()
+        self.column_mask = None
+
+    def _counts(self, texts, pool=None):
+        texts = list(texts)
+        if pool is None:
+            return self.hasher.transform(texts)
+        chunks = [texts[start:start + TEXT_CHUNK_ROWS] for start in range(0, len(texts), TEXT_CHUNK_ROWS)]
+        return vstack(list(pool.map(_hash_counts, [self.hasher] * len(chunks), chunks))).tocsr()
+
+    def _masked(self, counts):
+        return counts @ self.column_mask if self.column_mask is not None else counts
+
+    def fit_transform(self, texts, pool=None):
+        counts = self._counts(texts, pool)
+        n_docs = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=self.n_features)
+        min_count = self.min_df if isinstance(self.min_df, int) else self.min_df * n_docs
+        max_count = self.max_df if isinstance(self.max_df, int) else self.max_df * n_docs
+        keep = (document_frequency >= min_count) & (document_frequency <= max_count)
+        if not keep.all():
+            self.column_mask = diags(keep.astype(counts.dtype))
+        return self.transformer.fit_transform(self._masked(counts))
+
+    def transform(self, texts):
+        return self.transformer.transform(self._masked(self.hasher.transform(list(texts))))
+
+
+def text_encoder(**tfidf_params):
+    """
+    Bộ mã hóa văn bản theo RECOMMENDER_TEXT_ENCODER: "tfidf" (mặc định, TfidfVectorizer
+    fit tuần tự) hoặc "hashing" (HashingTfidf, fit song song). tfidf_params giống
+    TfidfVectorizer; max_features chỉ áp dụng cho "tfidf".
+    Mặc định không tự chuyển sang "hashing" khi có pool: hai bộ mã hóa cho không gian cột và
+    điểm khác nhau, mà kết quả không được phụ thuộc số worker hay kích thước danh mục. Vì vậy
+    với "tfidf", bước fit văn bản (thường là phần tốn nhất của lần build) vẫn chạy tuần tự.
+    """
+    if os.getenv("RECOMMENDER_TEXT_ENCODER", "tfidf") == "hashing":
+        tfidf_params.pop("max_features", None)
+        return HashingTfidf(**tfidf_params)
+    return TfidfVectorizer(**tfidf_params)
+
+
+def fit_text(encoder, texts, pool=None):
+    """fit_transform, song song trên pool nếu bộ mã hóa hỗ trợ."""
+    if isinstance(encoder, HashingTfidf):
+        return encoder.fit_transform(texts, pool)
+    return encoder.fit_transform(texts)
+
+
+def scoring_pool(workers=None):
+    """Pool luồng dùng chung cho việc chấm điểm theo khối dòng; None nếu chỉ có 1 worker."""
+    global _scoring_pool
+    workers = resolve_workers(workers)
+    if workers <= 1:
+        return None
+    with _scoring_pool_lock:
+        if _scoring_pool is None:
+            _scoring_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scoring")
+        return _scoring_pool
@@ -0,0 +1,243 @@
+# src/ml/payload_store.py
+"""
+Kho kết quả dựng sẵn: mỗi phim được chuẩn hóa và tuần tự hóa JSON một lần khi dựng mô hình.
+
+Trả lời một truy vấn chỉ còn là ghép K đoạn JSON có sẵn với điểm similarity, thay vì tạo
+một dòng (Series/dict) và kiểm tra kiểu từng trường cho mỗi kết quả. Chế độ compact bỏ
+các trường nặng (plot, fullplot) cho các trang danh sách.
+
+Kết quả được bọc trong RawJSON; dùng dumps() của module này để ghi ra JSON.
+
+Kho của mỗi script được lưu cùng artifact của kho đặc trưng (build_index.py) dưới dạng mảng
+byte cộng mảng offsets, và được memory-map khi tải thay vì tuần tự hóa lại cả danh mục.
+
+Khi incremental_indexer.py cài một kho cập nhật tăng dần, kho mới chép đoạn JSON của các phim
+không đổi (theo id) từ kho của mô hình trước và chỉ tuần tự hóa lại các phim mới hoặc đã sửa.
+
+Với RECOMMENDER_PAYLOAD_SOURCE=mongo, MongoPayloadStore thay cho PayloadStore: không giữ
+JSON của cả danh mục trong bộ nhớ, mà lấy các phim được gợi ý của cả lô truy vấn bằng một
+truy vấn $in (chỉ các trường kết quả), đổi lại một lượt đi về MongoDB mỗi lô.
+"""
+import os
+import json
+
+import catalog
+import instrumentation
+import mongo_client
+
+HEAVY_FIELDS = ('plot', 'fullplot')
+
+
+class RawJSON(str):
+    """Chuỗi đã là JSON hợp lệ, được dumps() chèn nguyên văn."""
+    __slots__ = ()
+
+
+def dumps(obj):
+    """json.dumps có hỗ trợ RawJSON lồng trong dict/list."""
+    if isinstance(obj, RawJSON):
+        return str(obj)
+    if isinstance(obj, dict):
+        return "{" + ", ".join(json.dumps(str(key)) + ": " + dumps(value) for key, value in obj.items()) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ", ".join(dumps(item) for item in obj) + "]"
+    return json.dumps(obj)
+
+
+def loads(obj):
+    """Chuyển RawJSON (kể cả lồng trong dict/list) về đối tượng Python."""
+    if isinstance(obj, RawJSON):
+        return json.loads(obj)
+    if isinstance(obj, dict):
+        return {key: loads(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [loads(item) for item in obj]
+    return obj
+
+
+class FragmentColumn:
+    """Các đoạn JSON (UTF-8) nối liền trong một mảng byte: đoạn i là blob[offsets[i]:offsets[i + 1]]."""
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class PayloadStore:
+    """
+    Với mỗi dòng lưu:
+      heads[i]          '{"id": ..., "title": ...'
+      tails[i]          phần còn lại của object JSON (đầy đủ trường)
+      compact_tails[i]  phần còn lại, không có HEAVY_FIELDS
+    similarity được chèn giữa head và tail để giữ nguyên thứ tự trường của kết quả.
+    """
+    __slots__ = ("heads", "tails", "compact_tails")
+
+    def __init__(self, table, payload_fn, previous=None, previous_rows=None):
+        """
+        previous, previous_rows: kho của mô hình trước và dòng cũ của từng dòng của table
+        (-1 = phim mới hoặc đã sửa). Đoạn JSON của các dòng còn lại được chép sang, chỉ các
+        dòng -1 được tuần tự hóa lại (cập nhật tăng dần, xem incremental_indexer.py).
+        """
+        self.heads = []
+        self.tails = []
+        self.compact_tails = []
+        encoded = 0
+        for i in range(len(table)):
+            old = previous_rows[i] if previous_rows is not None else -1
+            if old >= 0:
+                self.heads.append(previous.heads[old])
+                self.tails.append(previous.tails[old])
+                self.compact_tails.append(previous.compact_tails[old])
+                continue
+            payload = payload_fn(table.row(i))
+            head = {"id": payload.pop("id"), "title": payload.pop("title")}
+            compact = {key: value for key, value in payload.items() if key not in HEAVY_FIELDS}
+            self.heads.append(json.dumps(head)[:-1])
+            self.tails.append(self._tail(payload))
+            self.compact_tails.append(self._tail(compact))
+            encoded += 1
+        instrumentation.count("payloads_encoded", encoded)
+
+    def arrays(self):
+        """{tên: mảng} của các đoạn JSON, để lưu cùng artifact của kho (feature_engine.save_store)."""
+        arrays = {}
+        for part in self.__slots__:
+            fragments = getattr(self, part)
+            arrays[f"{part}_blob"], arrays[f"{part}_offsets"] = catalog.pack_bytes(
+                fragments[i].encode("utf-8") for i in range(len(fragments)))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Kho trên các mảng của arrays() (ví dụ memory-map từ artifact), không tuần tự hóa lại."""
+        store = cls.__new__(cls)
+        for part in cls.__slots__:
+            setattr(store, part, FragmentColumn(arrays[f"{part}_blob"], arrays[f"{part}_offsets"]))
+        return store
+
+    @staticmethod
+    def _tail(payload):
+        return (", " + json.dumps(payload)[1:]) if payload else "}"
+
+    def render(self, rows, scores, compact=False):
+        """Mảng JSON các kết quả cho các dòng rows với điểm scores, dạng RawJSON."""
+        tails = self.compact_tails if compact else self.tails
+        fragments = [
+            f'{self.heads[i]}, "similarity": {json.dumps(round(float(score), 4))}{tails[i]}'
+            for i, score in zip(rows, scores)
+        ]
+        return RawJSON("[" + ", ".join(fragments) + "]")
+
+    def render_all(self, items):
+        """render() cho từng (rows, scores, compact) của một lô."""
+        return [self.render(rows, scores, compact) for rows, scores, compact in items]
+
+
+class MongoPayloadStore:
+    """
+    Cùng giao diện với PayloadStore, nhưng document của các phim được gợi ý được lấy từ
+    MongoDB lúc truy vấn: một truy vấn $in cho cả lô, chuẩn hóa bằng prepare_table như lúc
+    build rồi đưa qua payload_fn, nên phản hồi giống hệt PayloadStore. Phim đã bị xóa khỏi
+    collection sau khi build bị bỏ khỏi kết quả.
+    """
+    __slots__ = ("ids", "payload_fn", "prepare_table", "projection", "compact_projection")
+
+    def __init__(self, ids, payload_fn, prepare_table, projection):
+        self.ids = ids
+        self.payload_fn = payload_fn
+        self.prepare_table = prepare_table
+        self.projection = dict(projection)
+        self.compact_projection = {field: 1 for field in projection if field not in HEAVY_FIELDS}
+
+    def _payloads(self, rows, compact):
+        with instrumentation.stage("fetch_payloads"):
+            documents = mongo_client.find_by_ids(
+                dict.fromkeys(self.ids[i] for i in rows), self.compact_projection if compact else self.projection)
+        instrumentation.count("payload_documents", len(documents))
+        table = self.prepare_table(list(documents.values()))
+        payloads = {}
+        for j in range(len(table)):
+            payloads[table['id'][j]] = self.payload_fn(table.row(j))
+        return payloads
+
+    def render_all(self, items):
+        """render() cho từng (rows, scores, compact) của một lô, với một truy vấn $in."""
+        compact = all(item_compact for _, _, item_compact in items)
+        payloads = self._payloads([i for rows, _, _ in items for i in rows], compact)
+        rendered = []
+        for rows, scores, item_compact in items:
+            fragments = []
+            for i, score in zip(rows, scores):
+                payload = payloads.get(self.ids[i])
+                if payload is None:
+                    continue
+                head = {"id": payload["id"], "title": payload["title"], "similarity": round(float(score), 4)}
+                fields = {key: value for key, value in payload.items()
+                          if key not in head and not (item_compact and key in HEAVY_FIELDS)}
+                fragments.append(json.dumps({**head, **fields}))
+            rendered.append(RawJSON("[" + ", ".join(fragments) + "]"))
+        return rendered
+
+    def render(self, rows, scores, compact=False):
+        return self.render_all([(rows, scores, compact)])[0]
+
+
+def payload_source():
+    """"memory" (mặc định, PayloadStore) hoặc "mongo" (MongoPayloadStore), theo RECOMMENDER_PAYLOAD_SOURCE."""
+    return os.getenv("RECOMMENDER_PAYLOAD_SOURCE", "memory")
+
+
+def previous_rows(ids, previous_ids, changed_ids):
+    """Dòng trong previous_ids của từng id trong ids; -1 nếu id mới hoặc thuộc changed_ids."""
+    old_rows = {movie_id: row for row, movie_id in enumerate(previous_ids)}
+    changed = set(changed_ids)
+    return [-1 if movie_id in changed else old_rows.get(movie_id, -1) for movie_id in ids]
+
+
+def saved_store(store, name):
+    """
+    PayloadStore của script name được lưu cùng artifact của store (feature_engine.save_store),
+    hoặc None (chưa lưu, kho dựng trong tiến trình, hoặc RECOMMENDER_PAYLOAD_SOURCE=mongo).
+    """
+    if payload_source() != "memory":
+        return None
+    return store.get("saved_payloads", {}).get(name)
+
+
+def reuse_args(store, previous_model):
+    """
+    Tham số previous/previous_ids/changed_ids của build_store khi store là bản cập nhật tăng
+    dần (incremental_indexer.py) của kho của previous_model; {} nếu phải dựng lại toàn bộ.
+    """
+    if previous_model is None or store.get("parent_version") is None:
+        return {}
+    if previous_model["store"]["version"] != store["parent_version"]:
+        return {}
+    return {
+        "previous": previous_model["payloads"],
+        "previous_ids": previous_model["store"]["table"]['id'],
+        "changed_ids": store["changed_ids"],
+    }
+
+
+def build_store(table, payload_fn, prepare_table, projection, previous=None, previous_ids=None, changed_ids=()):
+    """
+    Kho kết quả của một mô hình theo payload_source(). Bảng được tải không có các trường chỉ
+    dùng cho kết quả (chế độ "mongo") cũng dùng MongoPayloadStore.
+    previous, previous_ids, changed_ids: kho và id theo dòng của mô hình trước, và các id đã
+    thay đổi từ đó; đoạn JSON của các phim không đổi được dùng lại thay vì tuần tự hóa lại.
+    """
+    fields = [field for field in projection if field != '_id']
+    if payload_source() == "mongo" or not all(field in table for field in fields):
+        return MongoPayloadStore(table['id'], payload_fn, prepare_table, projection)
+    if isinstance(previous, PayloadStore) and previous_ids is not None:
+        return PayloadStore(table, payload_fn, previous, previous_rows(table['id'], previous_ids, changed_ids))
+    return PayloadStore(table, payload_fn)
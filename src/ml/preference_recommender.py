@@ -1,235 +1,380 @@
 # preference_recommender.py
 
-import pandas as pd
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import MultiLabelBinarizer
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import hstack, csr_matrix
-from pymongo import MongoClient
 import os
 import json
 import argparse
 import sys
+import threading
+
+import feature_engine
+import instrumentation
+import payload_store
+import result_cache
 
 # --- MongoDB connection settings ---
 MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = MONGODB_URI.split('/')[-1].split('?')[0] 
 
+# Name of this model in metrics and result cache keys. The catalog, encoders, feature
+# matrix and retrieval backend live in the feature store shared with movie_recommender.py
+# (see feature_engine.py).
+ARTIFACT_NAME = 'preference'
+LIST_FIELDS = feature_engine.LIST_FIELDS
+
+# Fields of a preference response (fetched per batch with RECOMMENDER_PAYLOAD_SOURCE=mongo)
+MOVIE_PROJECTION = {
+    '_id': 1, 'title': 1, 'plot': 1, 'genres': 1, 'cast': 1, 
+    'directors': 1, 'writers': 1, 'languages': 1, 'countries': 1, 'year': 1, 'poster': 1,
+    'lastupdated': 1
+}
+
+def normalize_name(label):
+    """Labels are compared without spaces ("Tom Hanks" -> "TomHanks")."""
+    return str(label).strip().replace(" ", "")
+
+def normalize_names(value):
+    return [normalize_name(item) for item in value] if isinstance(value, list) else []
+
 # --- GLOBAL MODEL OBJECTS ---
-tfidf_plot = None
-mlbs = {}
-feature_matrix_shape = None
-cached_feature_matrix_pref = None
+model_version = None
+# Snapshot of everything a query needs, replaced in a single assignment (see get_current_model)
+current_model = None
+_model_lock = threading.Lock()
+# Ranking cache keyed on the canonical query + model version (see result_cache.py)
+_cache = result_cache.from_env()
+
+def prepare_table(movies_data):
+    """
+    Normalizes raw movie documents into the shared MovieTable layout (see feature_engine.py).
+    Used by MongoPayloadStore for the recommended movies.
+    """
+    return feature_engine.prepare_table(movies_data)
 
 def load_and_prepare_data():
     """
-    Loads movie data from MongoDB and performs initial preprocessing.
-    Returns: df (DataFrame)
+    Streams movie data from MongoDB in batches, over the process-wide pooled client.
+    Returns: MovieTable
     """
-    client = None
     try:
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
-        movies_collection = db['embedded_movies']
-
-        movies_data = list(movies_collection.find({}, {
-            '_id': 1, 'title': 1, 'plot': 1, 'genres': 1, 'cast': 1, 
-            'directors': 1, 'writers': 1, 'languages': 1, 'countries': 1, 'year': 1, 'poster': 1
-        }))
+        table = feature_engine.load_table(MONGODB_URI)
         
-        if not movies_data:
+        if not len(table):
             print("Không có dữ liệu phim trong MongoDB để tạo gợi ý.", file=sys.stderr)
             raise ValueError("Không có dữ liệu phim trong MongoDB để tạo gợi ý.")
 
-        df = pd.DataFrame(movies_data)
-        df['id'] = df['_id']
-        
-        for col in ['genres', 'cast', 'directors', 'writers', 'languages', 'countries']:
-            df[col] = df[col].apply(lambda x: [str(item).strip().replace(" ", "") for item in x] if isinstance(x, list) else [])
-        df['plot'] = df['plot'].fillna('')
-        df['year'] = pd.to_numeric(df['year'], errors='coerce')
-        
-        # --- THAY ĐỔI MỚI: Xử lý giá trị NaN trong DataFrame thành None ---
-        # Điều này rất quan trọng để tránh lỗi JSON.parse ở phía Node.js
-        df = df.replace({np.nan: None}) # Thay thế np.nan bằng None
-        
-        return df
+        return table
 
     except Exception as e:
         print(f"Lỗi khi tải hoặc tiền xử lý dữ liệu: {e}", file=sys.stderr)
         raise
-    finally:
-        if client:
-            client.close()
 
-def load_or_train_models_and_matrix(df):
+def model_from_store(store, previous=None):
     """
-    Loads or trains TF-IDF and MLB models and computes the full feature matrix.
-    This runs once per script execution (or on first call if cached).
+    This script's view of a feature store: every shared component of the store plus the
+    pre-serialized response fragments of preference_payload, so a query only joins K strings
+    (or fetched from MongoDB per batch with RECOMMENDER_PAYLOAD_SOURCE=mongo).
+    When the store is an incremental update of previous's store (incremental_indexer.py),
+    only the fragments of changed movies are serialized again.
     """
-    global tfidf_plot, mlbs, feature_matrix_shape, cached_feature_matrix_pref
-    
-    if tfidf_plot is not None and mlbs and feature_matrix_shape is not None and cached_feature_matrix_pref is not None:
-        print("Models and feature matrix already loaded/cached for preference_recommender.", file=sys.stderr)
-        return cached_feature_matrix_pref
+    model = dict(store)
+    model['store'] = store
+    # Pre-built year column used to filter candidates before scoring
+    model['year_column'] = store['columns']['year']
+    with instrumentation.stage("prepare"):
+        model['payloads'] = build_payloads(store, previous)
+    return model
 
-    print("Training/Loading models and feature matrix for preference_recommender...", file=sys.stderr)
-    
-    tfidf_plot = TfidfVectorizer(stop_words='english', min_df=5, max_df=0.8)
-    plot_tfidf_matrix = tfidf_plot.fit_transform(df['plot'])
+def build_payloads(store, previous=None):
+    """
+    This script's response fragments for a store: the ones saved with the store's
+    artifact when present, otherwise serialized (only the changed movies when previous
+    is the model of the store it was updated from).
+    """
+    saved = payload_store.saved_store(store, ARTIFACT_NAME)
+    if saved is not None:
+        return saved
+    return payload_store.build_store(
+        store['table'], preference_payload, prepare_table, MOVIE_PROJECTION,
+        **payload_store.reuse_args(store, previous)
+    )
 
-    current_sparse_matrices = []
-    
-    for col in ['genres', 'cast', 'directors', 'writers', 'languages', 'countries']:
-        mlb = MultiLabelBinarizer()
-        encoded_col = mlb.fit_transform(df[col])
-        mlbs[col] = mlb
-        current_sparse_matrices.append(encoded_col)
-    
-    current_sparse_matrices.append(plot_tfidf_matrix)
-    
-    combined_matrix = hstack(current_sparse_matrices).tocsr()
-    feature_matrix_shape = combined_matrix.shape[1]
-    
-    cached_feature_matrix_pref = combined_matrix
-    print(f"Models and feature matrix trained. Shape: {feature_matrix_shape}", file=sys.stderr)
-    
-    return combined_matrix
+def save_model():
+    """
+    Writes the active feature store to model_store. Returns the new artifact version.
+    """
+    global model_version
+
+    model_version = feature_engine.save_store(current_model['store'], {ARTIFACT_NAME: current_model['payloads']})
+    current_model['version'] = model_version
+    return model_version
+
+def train_model(workers=None):
+    """
+    Full rebuild from MongoDB: reloads the catalog, refits every encoder (including the
+    TF-IDF IDF weights) and installs the result as the active feature store.
+    """
+    with instrumentation.stage("fetch"):
+        table = load_and_prepare_data()
+    return train_from_table(table, workers)
+
+def train_from_table(table, workers=None):
+    """
+    Builds a feature store from an already loaded MovieTable and installs it as the active
+    one (used by train_model and by benchmark.py's in-memory catalogs).
+    """
+    print("Training models and feature matrix for preference_recommender...", file=sys.stderr)
+    feature_engine.install_store(feature_engine.build_store(table, workers))
+    return get_current_model()
+
+def get_current_model():
+    """
+    Returns this script's model on the active feature store, loading artifacts or training
+    on first use (see feature_engine.get_store). In resident mode (recommender_server.py)
+    this happens once per process instead of once per request; the response fragments are
+    rebuilt when the store is replaced.
+    """
+    global current_model, model_version
+    store = feature_engine.get_store(MONGODB_URI)
+    if store is None:
+        raise ValueError("Không có dữ liệu phim trong MongoDB để tạo gợi ý.")
+    model = current_model
+    if model is not None and model['store'] is store:
+        return model
+
+    with _model_lock:
+        if current_model is None or current_model['store'] is not store:
+            current_model = model_from_store(store, current_model)
+            model_version = current_model['version']
+            # Cached rankings are keyed on the model version; drop the old ones from memory
+            _cache.invalidate()
+        return current_model
 
 # Helper function to get recommendations from similarity scores
-def get_top_n_recommendations(sim_scores_array, df_movies, num_rec, min_year_filter=None, max_year_filter=None):
-    sim_scores_with_indices = list(enumerate(sim_scores_array))
-    sim_scores_with_indices = sorted(sim_scores_with_indices, key=lambda x: x[1], reverse=True)
-    
-    recommended_movies = []
-    for i, score in sim_scores_with_indices:
-        if score <= 0:
-            continue
+def preference_payload(movie):
+    """Response fields of one movie (without similarity), serialized once per model build."""
+    return {
+        "id": str(movie['id']),
+        "title": movie['title'],
+        "genres": normalize_names(movie.get('genres')),
+        "plot": movie.get('plot', ''),
+        "cast": normalize_names(movie.get('cast')),
+        "directors": normalize_names(movie.get('directors')),
+        "writers": normalize_names(movie.get('writers')),
+        "poster": movie['poster'] if isinstance(movie.get('poster'), str) else None,
+        "languages": normalize_names(movie.get('languages')),
+        "year": movie.get('year'),
+        "countries": normalize_names(movie.get('countries'))
+    }
 
-        movie = df_movies.iloc[i]
-        
-        movie_year = movie.get('year')
-        if min_year_filter is not None and movie_year is not None and movie_year < min_year_filter:
-            continue
-        if max_year_filter is not None and movie_year is not None and movie_year > max_year_filter:
-            continue
-
-        # --- THAY ĐỔI CŨNG QUAN TRỌNG: Đảm bảo giá trị "poster" được xử lý thành None nếu là NaN ---
-        # Mặc dù đã xử lý np.nan ở load_and_prepare_data, nhưng đây là một lớp bảo vệ nữa
-        poster_value = movie.get('poster')
-        if isinstance(poster_value, float) and np.isnan(poster_value):
-            poster_value = None
-
-        recommended_movies.append({
-            "id": str(movie['id']),
-            "title": movie['title'],
-            "similarity": round(score, 4),
-            "genres": movie.get('genres', []),
-            "plot": movie.get('plot', ''),
-            "cast": movie.get('cast', []),
-            "directors": movie.get('directors', []),
-            "writers": movie.get('writers', []),
-            "poster": poster_value, # Sử dụng giá trị đã được xử lý
-            "languages": movie.get('languages', []),
-            "year": movie.get('year'),
-            "countries": movie.get('countries', [])
-        })
-        if len(recommended_movies) >= num_rec:
-            break
-
-    return recommended_movies
+def preference_list(value):
+    """Labels of one preference field: a comma-separated string or a list of strings (None if invalid)."""
+    if isinstance(value, str):
+        return value.split(',')
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return None
 
-def get_preference_recommendations(num_recommendations=10, genres=None, cast=None, directors=None, writers=None, 
-                                   languages=None, countries=None, min_year=None, max_year=None):
+def argument_error(num_recommendations, preferences, min_year, max_year):
+    """Type check of one query's arguments; returns an error message or None."""
+    if isinstance(num_recommendations, bool) or not isinstance(num_recommendations, int) or num_recommendations < 1:
+        return "'num_recommendations' phải là số nguyên dương."
+    for col, value in preferences.items():
+        if value and preference_list(value) is None:
+            return f"'{col}' phải là chuỗi phân tách bằng dấu phẩy hoặc danh sách chuỗi."
+    for name, value in (('min_year', min_year), ('max_year', max_year)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return f"'{name}' phải là số."
+    return None
+
+def plan_preference_query(model, num_recommendations=10, genres=None, cast=None, directors=None, writers=None,
+                          languages=None, countries=None, min_year=None, max_year=None, compact=False):
+    """
+    Builds the scoring plan of one preference query: its sparse query vector and the
+    year-filtered candidate rows. Returns (plan, None), or (None, response) when the
+    query needs no scoring (error or message). Arguments of the wrong type are an error
+    response for this query only, not for the rest of its batch.
+    """
+    preferences = {
+        'genres': genres, 'cast': cast, 'directors': directors,
+        'writers': writers, 'languages': languages, 'countries': countries,
+    }
+    if num_recommendations is None:
+        num_recommendations = 10
+    error = argument_error(num_recommendations, preferences, min_year, max_year)
+    if error is not None:
+        return None, {"error": error}
+    selected = {col: preference_list(preferences[col]) for col in LIST_FIELDS if preferences[col]}
+
+    # Labels are matched without spaces against the shared encoders ("preference" mode)
+    query_feature_vector = feature_engine.preference_vector(model['store'], selected, normalize=normalize_name)
+
+    if query_feature_vector.nnz == 0:
+        return None, {"message": "Vui lòng nhập ít nhất một tiêu chí sở thích để nhận gợi ý."}
+
+    # Year filters select the candidate rows before scoring, so a filtered query still fills
+    # the page; movies without a year are kept
+    candidates = None
+    if min_year is not None or max_year is not None:
+        candidates = model['year_column'].range_rows(min_year, max_year, keep_missing=True)
+
+    return {
+        "vector": query_feature_vector,
+        "candidates": candidates,
+        "num_recommendations": num_recommendations,
+        "compact": compact,
+        # Canonical form of the query for the result cache
+        "cache_query": {
+            **{col: sorted({normalize_name(item) for item in selected.get(col, [])}) for col in LIST_FIELDS},
+            "min_year": min_year,
+            "max_year": max_year,
+        },
+    }, None
+
+def run_plans(model, plans):
+    """
+    Returns one response per plan, in order. Rankings come from the result cache when
+    present; the remaining plans are scored together by the model's retrieval backend
+    (see retrieval.py) and cached. K is rounded up to a result_cache bucket and cut back
+    when rendering.
+    """
+    ranked = [None] * len(plans)
+    keys = [None] * len(plans)
+    with instrumentation.stage("cache"):
+        for i, plan in enumerate(plans):
+            plan['k'] = result_cache.bucket_size(plan['num_recommendations'])
+            if _cache.enabled:
+                keys[i] = result_cache.make_key(ARTIFACT_NAME, model['version'], [plan['cache_query'], plan['k']])
+                ranked[i] = _cache.get(keys[i])
+
+    misses = [i for i in range(len(plans)) if ranked[i] is None]
+    instrumentation.count("cache_hits", len(plans) - len(misses))
+    instrumentation.count("cache_misses", len(misses))
+    with instrumentation.stage("score"):
+        for i, result in zip(misses, model['retriever'].rank([plans[i] for i in misses])):
+            ranked[i] = result
+            if keys[i] is not None:
+                _cache.set(keys[i], result)
+
+    # Rendered once for the whole batch (one $in query with MongoPayloadStore)
+    items = []
+    for plan, (top_indices, top_scores) in zip(plans, ranked):
+        n = plan['num_recommendations']
+        items.append((top_indices[:n], top_scores[:n], plan['compact']))
+        instrumentation.count("results", len(top_indices[:n]))
+    with instrumentation.stage("render"):
+        rendered = model['payloads'].render_all(items)
+
+    responses = []
+    for (top_indices, _, _), recommendations in zip(items, rendered):
+        if not len(top_indices):
+            responses.append({"message": "Không tìm thấy gợi ý nào phù hợp với sở thích của bạn."})
+        else:
+            responses.append({"recommendations": recommendations})
+    return responses
+
+def get_batch_preference_recommendations(queries):
+    """
+    Answers several preference queries (each a dict in the handle_request format) with one
+    scoring pass. Returns {"results": [...]}, one response per query in order.
+    """
+    if not isinstance(queries, list):
+        return {"error": "'queries' phải là một danh sách truy vấn."}
     try:
-        df = load_and_prepare_data()
-        feature_matrix = load_or_train_models_and_matrix(df)
+        with instrumentation.stage("model"):
+            model = get_current_model()
 
-        query_parts = []
-        
-        for col in ['genres', 'cast', 'directors', 'writers', 'languages', 'countries']:
-            pref_list_str = None
-            if col == 'genres': pref_list_str = genres
-            elif col == 'cast': pref_list_str = cast
-            elif col == 'directors': pref_list_str = directors
-            elif col == 'writers': pref_list_str = writers
-            elif col == 'languages': pref_list_str = languages
-            elif col == 'countries': pref_list_str = countries
-            
-            if pref_list_str:
-                pref_list = [str(item).strip().replace(" ", "") for item in pref_list_str.split(',')]
-                query_parts.append(mlbs[col].transform([pref_list]))
-            else:
-                query_parts.append(csr_matrix((1, len(mlbs[col].classes_))))
-
-        plot_vocab_size = len(tfidf_plot.vocabulary_) if hasattr(tfidf_plot, 'vocabulary_') else 0
-        query_parts.append(csr_matrix((1, plot_vocab_size)))
-
-        query_feature_vector = hstack(query_parts).tocsr()
-
-        if query_feature_vector.shape[1] != feature_matrix_shape:
-            missing_cols = feature_matrix_shape - query_feature_vector.shape[1]
-            if missing_cols > 0:
-                query_feature_vector = hstack([query_feature_vector, csr_matrix((1, missing_cols))]).tocsr()
-            elif missing_cols < 0:
-                error_msg = f"Lỗi nội bộ: Kích thước vector sở thích ({query_feature_vector.shape[1]}) lớn hơn ma trận đặc trưng dự kiến ({feature_matrix_shape})."
-                print(error_msg, file=sys.stderr)
-                return {"error": error_msg}
-
-        if query_feature_vector.nnz == 0:
-            return {"message": "Vui lòng nhập ít nhất một tiêu chí sở thích để nhận gợi ý."}
-
-        sim_scores = cosine_similarity(query_feature_vector, feature_matrix).flatten()
-        
-        top_recommendations = get_top_n_recommendations(
-            sim_scores, df, num_recommendations, min_year_filter=min_year, max_year_filter=max_year
-        )
-        
-        if not top_recommendations:
-            return {"message": "Không tìm thấy gợi ý nào phù hợp với sở thích của bạn."}
-        return {"recommendations": top_recommendations}
+        instrumentation.count("queries", len(queries))
+        results = [None] * len(queries)
+        plans, positions = [], []
+        with instrumentation.stage("plan"):
+            for position, query in enumerate(queries):
+                if not isinstance(query, dict):
+                    results[position] = {"error": "Mỗi truy vấn phải là một object JSON."}
+                    continue
+                plan, response = plan_preference_query(model, **query_arguments(query))
+                if plan is None:
+                    results[position] = response
+                else:
+                    plans.append(plan)
+                    positions.append(position)
+
+        for position, response in zip(positions, run_plans(model, plans)):
+            results[position] = response
+        return {"results": results}
+
+    except Exception as e:
+        print(f"Lỗi trong get_batch_preference_recommendations: {e}", file=sys.stderr)
+        return {"error": f"Lỗi nội bộ của hệ thống gợi ý theo sở thích: {e}"}
+
+def get_preference_recommendations(num_recommendations=10, genres=None, cast=None, directors=None, writers=None, 
+                                   languages=None, countries=None, min_year=None, max_year=None, compact=False):
+    try:
+        with instrumentation.stage("model"):
+            model = get_current_model()
+        instrumentation.count("queries")
+        with instrumentation.stage("plan"):
+            plan, response = plan_preference_query(
+                model, num_recommendations, genres, cast, directors, writers,
+                languages, countries, min_year, max_year, compact
+            )
+        if plan is None:
+            return response
+        return run_plans(model, [plan])[0]
 
     except Exception as e:
         print(f"Lỗi trong get_preference_recommendations: {e}", file=sys.stderr)
         return {"error": f"Lỗi nội bộ của hệ thống gợi ý theo sở thích: {e}"}
 
 
+def query_arguments(input_params):
+    """Keyword arguments of get_preference_recommendations from one JSON query."""
+    return dict(
+        num_recommendations=input_params.get('num_recommendations', 10),
+        genres=input_params.get('genres'),
+        cast=input_params.get('cast'),
+        directors=input_params.get('directors'),
+        writers=input_params.get('writers'),
+        languages=input_params.get('languages'),
+        countries=input_params.get('countries'),
+        min_year=input_params.get('min_year'),
+        max_year=input_params.get('max_year'),
+        compact=bool(input_params.get('compact', False))
+    )
+
+
+def handle_request(input_params):
+    """
+    Maps the JSON input sent by the Node service onto get_preference_recommendations,
+    or onto get_batch_preference_recommendations when it carries a "queries" list.
+    "timings": true adds a per-stage timing block to the response, and "profile": true
+    adds sampled stacks (see instrumentation.py).
+    Shared by the script entry point and the resident server.
+    """
+    with instrumentation.request(ARTIFACT_NAME, input_params.get('timings'), input_params.get('profile')) as timings:
+        return timings.attach(route_request(input_params))
+
+def route_request(input_params):
+    if 'queries' in input_params:
+        return get_batch_preference_recommendations(input_params['queries'])
+    return get_preference_recommendations(**query_arguments(input_params))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Get movie recommendations based on preferences.")
     parser.add_argument('json_input', type=str, 
-                        help='A JSON string containing all input parameters for recommendation.')
+                        help='A JSON string containing all input parameters for recommendation, '
+                             'or "-" to read it from stdin.')
     
     args = parser.parse_args()
 
     try:
-        input_params = json.loads(args.json_input)
-
-        num_rec = input_params.get('num_recommendations', 10)
-        genres = input_params.get('genres')
-        cast = input_params.get('cast')
-        directors = input_params.get('directors')
-        writers = input_params.get('writers')
-        languages = input_params.get('languages')
-        countries = input_params.get('countries')
-        min_year = input_params.get('min_year')
-        max_year = input_params.get('max_year')
-
-        result = get_preference_recommendations(
-            num_recommendations=num_rec,
-            genres=genres,
-            cast=cast,
-            directors=directors,
-            writers=writers,
-            languages=languages,
-            countries=countries,
-            min_year=min_year,
-            max_year=max_year
-        )
-        print(json.dumps(result))
+        # Reading from stdin avoids the ARG_MAX limit on large batch inputs
+        input_params = json.loads(sys.stdin.read() if args.json_input == '-' else args.json_input)
+        result = handle_request(input_params)
+        print(payload_store.dumps(result))
     except json.JSONDecodeError as e:
         print(json.dumps({"error": f"Lỗi phân tích cú pháp JSON đầu vào: {e}"}), file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         print(json.dumps({"error": f"Lỗi không xác định khi xử lý yêu cầu: {e}"}), file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
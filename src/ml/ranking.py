@@ -0,0 +1,140 @@
+# src/ml/ranking.py
+"""
+Chọn top-K dùng chung cho các script gợi ý.
+
+Thay vì tạo N tuple (idx, score) rồi sắp xếp toàn bộ danh mục bằng Python, các bộ lọc
+được áp dụng dưới dạng mask NumPy, np.partition chọn K ứng viên trong O(N) và chỉ
+K ứng viên đó được sắp xếp. Các bộ lọc theo khoảng (năm, thời lượng) dùng SortedColumn
+để chọn tập ứng viên trước khi tính điểm.
+
+cosine_score_blocks() chấm điểm nhiều truy vấn cùng lúc: các vector truy vấn được xếp
+thành một ma trận thưa Q và mỗi khối truy vấn chỉ cần một phép nhân với ma trận đặc trưng.
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Số truy vấn được chấm điểm trong một phép nhân; giới hạn bộ nhớ của khối điểm dày (khối x N)
+QUERY_BLOCK_SIZE = 32
+# Số dòng của ma trận đặc trưng trong một phần việc khi chấm điểm song song
+ROW_SHARD_SIZE = 50000
+
+
+def top_k(scores, k, exclude=None, mask=None, min_score=0.0):
+    """
+    Trả về (indices, scores) của tối đa k phần tử có điểm cao nhất, giảm dần.
+
+    - Chỉ giữ các phần tử có điểm > min_score.
+    - mask: mảng bool cùng độ dài với scores, False = loại khỏi kết quả.
+    - exclude: chỉ số (hoặc danh sách chỉ số) cần loại, ví dụ chính phim đang được gợi ý.
+    Các phần tử cùng điểm được xếp theo chỉ số tăng dần để kết quả ổn định.
+    """
+    scores = np.asarray(scores).ravel()
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=scores.dtype)
+
+    eligible = scores > min_score
+    if mask is not None:
+        eligible &= mask
+    if exclude is not None:
+        eligible[exclude] = False
+
+    candidates = np.flatnonzero(eligible)
+    if candidates.size > k:
+        candidate_scores = scores[candidates]
+        # Điểm của phần tử thứ k; các phần tử bằng điểm này lấy theo chỉ số nhỏ nhất
+        kth_score = -np.partition(-candidate_scores, k - 1)[k - 1]
+        above = candidates[candidate_scores > kth_score]
+        ties = candidates[candidate_scores == kth_score][:k - above.size]
+        candidates = np.concatenate([above, ties])
+
+    candidate_scores = scores[candidates]
+    order = np.lexsort((candidates, -candidate_scores))
+    return candidates[order], candidate_scores[order]
+
+
+class SortedColumn:
+    """
+    Cột số được dựng sẵn cùng với thứ tự sắp xếp của nó, để lọc theo khoảng
+    (năm, thời lượng...) bằng hai lần tìm kiếm nhị phân thay vì quét toàn bộ cột.
+    """
+    __slots__ = ("values", "order", "sorted_values", "present")
+
+    def __init__(self, values, order=None):
+        """order: thứ tự sắp xếp đã tính sẵn (ví dụ tải từ artifact), mặc định được tính."""
+        self.values = np.asarray(values, dtype=float)
+        # NaN được np.argsort đặt ở cuối, nên các giá trị hợp lệ là phần đầu của order
+        self.order = np.argsort(self.values, kind="stable") if order is None else order
+        self.sorted_values = self.values[self.order]
+        self.present = int(np.count_nonzero(~np.isnan(self.values)))
+
+    def range_rows(self, min_value=None, max_value=None, keep_missing=False):
+        """Các chỉ số dòng (tăng dần) có min_value <= giá trị <= max_value."""
+        valid = self.sorted_values[:self.present]
+        lo = 0 if min_value is None else np.searchsorted(valid, min_value, side="left")
+        hi = self.present if max_value is None else np.searchsorted(valid, max_value, side="right")
+        rows = self.order[lo:hi]
+        if keep_missing:
+            rows = np.concatenate([rows, self.order[self.present:]])
+        return np.sort(rows)
+
+
+def intersect_rows(*row_sets):
+    """Giao của các tập chỉ số dòng đã sắp xếp; bỏ qua các phần tử None (không lọc)."""
+    result = None
+    for rows in row_sets:
+        if rows is None:
+            continue
+        result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+    return result
+
+
+def row_norms(matrix):
+    """Chuẩn L2 của từng dòng một ma trận thưa."""
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+
+def row_block(matrix, start, stop):
+    """Các dòng [start, stop) của ma trận CSR, dùng chung data/indices (không sao chép)."""
+    lo, hi = matrix.indptr[start], matrix.indptr[stop]
+    return csr_matrix(
+        (matrix.data[lo:hi], matrix.indices[lo:hi], matrix.indptr[start:stop + 1] - lo),
+        shape=(stop - start, matrix.shape[1]), copy=False)
+
+
+def _dense_dots(feature_matrix, query_block):
+    # float32 với ma trận gọn (nửa bộ nhớ cho khối điểm), float64 trong các trường hợp khác
+    return np.asarray((feature_matrix @ query_block.T).todense(), dtype=np.result_type(feature_matrix.dtype, np.float32))
+
+
+def sparse_dots(feature_matrix, query_block, pool=None):
+    """
+    Tích vô hướng (N x số truy vấn) giữa mọi dòng của feature_matrix (CSR) và query_block.
+    Với pool (ThreadPoolExecutor), các khối ROW_SHARD_SIZE dòng được nhân song song;
+    kết quả giống hệt khi chạy tuần tự.
+    query_block được đưa về dtype của feature_matrix để ma trận float32 (features.compact)
+    không bị nâng lên float64 trong phép nhân.
+    """
+    if query_block.dtype != feature_matrix.dtype:
+        query_block = query_block.astype(feature_matrix.dtype)
+    n_rows = feature_matrix.shape[0]
+    if pool is None or n_rows <= ROW_SHARD_SIZE:
+        return _dense_dots(feature_matrix, query_block)
+    shards = [row_block(feature_matrix, start, min(start + ROW_SHARD_SIZE, n_rows))
+              for start in range(0, n_rows, ROW_SHARD_SIZE)]
+    return np.vstack(list(pool.map(_dense_dots, shards, [query_block] * len(shards))))
+
+
+def cosine_score_blocks(query_matrix, feature_matrix, feature_norms, block_size=QUERY_BLOCK_SIZE, pool=None):
+    """
+    Độ tương đồng Cosine giữa từng dòng của query_matrix và mọi dòng của feature_matrix.
+    feature_norms là row_norms(feature_matrix), được tính sẵn khi dựng mô hình.
+    Trả về lần lượt (chỉ số truy vấn đầu khối, mảng điểm dày kích thước khối x N);
+    mỗi khối là một phép nhân thưa F @ Qᵀ (chia theo khối dòng trên pool nếu có).
+    """
+    query_matrix = query_matrix.tocsr()
+    query_norms = row_norms(query_matrix)
+    for start in range(0, query_matrix.shape[0], block_size):
+        block = query_matrix[start:start + block_size]
+        dots = sparse_dots(feature_matrix, block, pool).T
+        denominators = np.outer(query_norms[start:start + block_size], feature_norms)
+        yield start, np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
@@ -0,0 +1,372 @@
+# src/ml/recommender_server.py
+"""
+Chế độ thường trú cho các script gợi ý.
+
+Tiến trình này được Node (src/services/pythonService.ts) khởi động một lần, xây dựng mô hình
+của movie_recommender.py và preference_recommender.py lúc khởi động, sau đó trả lời nhiều
+yêu cầu trên stdin/stdout:
+
+    yêu cầu:  {"id": 1, "script": "movie_recommender.py", "input": {...}}
+    phản hồi: {"id": 1, "result": {...}}   hoặc   {"id": 1, "error": "..."}
+
+Hai cách đóng gói thông điệp (RECOMMENDER_IPC):
+    lines    mỗi thông điệp là một dòng JSON (mặc định, tiện gõ tay khi thử nghiệm)
+    framed   khung nhị phân có độ dài đứng trước, nội dung JSON hoặc msgpack (xem ipc.py);
+             Node dùng chế độ này. Phản hồi dùng cùng mã hóa với yêu cầu.
+
+Các yêu cầu điều khiển: {"op": "ping"}, {"op": "cache_stats"}, {"op": "metrics"} (metric
+Prometheus dạng văn bản, xem instrumentation.py) và {"op": "cancel", "target": <id>} (hủy
+một yêu cầu đã gửi; không có phản hồi riêng).
+
+Các yêu cầu được xử lý song song bởi một pool luồng, phản hồi được ghi ngay khi xong
+(có thể không theo thứ tự gửi) nên Node ghép phản hồi với yêu cầu bằng "id".
+
+- Luồng đọc stdin không bao giờ dừng: lệnh hủy được xử lý ngay khi đọc, các yêu cầu khác
+  vào một hàng đợi. Một luồng điều phối chuyển yêu cầu từ hàng đợi sang pool khi pool có
+  chỗ (RECOMMENDER_MAX_INFLIGHT yêu cầu đang xử lý), bỏ qua (trả lỗi) các yêu cầu đã bị
+  hủy hoặc quá hạn khi lấy ra. Hàng đợi đầy (RECOMMENDER_MAX_QUEUED) thì yêu cầu mới bị
+  từ chối ngay với {"error": ..., "busy": true} thay vì dồn vào bộ nhớ của Python.
+- "timeout_ms" trong yêu cầu: quá hạn mà chưa bắt đầu xử lý (hoặc chưa trả hết các phần)
+  thì trả lỗi thay vì tiếp tục tính. Yêu cầu bị hủy cũng vậy. Một lần chấm điểm đang chạy
+  không bị ngắt giữa chừng.
+- "id" và "target" phải là chuỗi hoặc số nguyên, "timeout_ms" phải là số dương; yêu cầu
+  sai kiểu được trả lỗi ngay và luồng đọc tiếp tục với khung kế tiếp.
+- "stream": true với input.queries: lô truy vấn được xử lý theo từng phần
+  (RECOMMENDER_STREAM_CHUNK truy vấn), phần nào xong được gửi ngay:
+      {"id": 1, "partial": {"offset": 0, "results": [...]}}  ...  {"id": 1, "result": {"streamed": n}}
+
+Cấu hình:
+    RECOMMENDER_IPC             "lines" (mặc định) hoặc "framed"
+    RECOMMENDER_WORKERS         số luồng xử lý, mặc định 4
+    RECOMMENDER_MAX_INFLIGHT    số yêu cầu được giao cho pool cùng lúc, mặc định 2 x số luồng
+    RECOMMENDER_MAX_QUEUED      số yêu cầu chờ trong hàng đợi tối đa, mặc định 1000
+    RECOMMENDER_STREAM_CHUNK    số truy vấn mỗi phần khi trả dần, mặc định 16
+"""
+import sys
+import os
+import json
+import math
+import time
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import movie_recommender
+import preference_recommender
+import incremental_indexer
+import instrumentation
+import payload_store
+import ipc
+
+# Ánh xạ tên script (như Node vẫn dùng với runPythonScript) sang hàm xử lý tương ứng
+HANDLERS = {
+    'movie_recommender.py': movie_recommender.handle_request,
+    'preference_recommender.py': preference_recommender.handle_request,
+}
+
+DEFAULT_WORKERS = 4
+INFLIGHT_PER_WORKER = 2
+DEFAULT_MAX_QUEUED = 1000
+DEFAULT_STREAM_CHUNK = 16
+
+
+def warm_up():
+    """
+    Xây dựng trước mô hình của cả hai script để yêu cầu đầu tiên không phải chờ.
+    Lỗi ở đây (ví dụ MongoDB chưa sẵn sàng) không làm dừng server: mô hình sẽ được
+    xây dựng lại ở yêu cầu đầu tiên.
+    """
+    mongodb_uri = os.getenv("MONGODB_URI")
+    try:
+        if mongodb_uri:
+            movie_recommender.get_model(mongodb_uri)
+        preference_recommender.get_current_model()
+    except Exception as e:
+        print(f"[recommender_server] Khởi tạo mô hình thất bại, sẽ thử lại khi có yêu cầu: {e}", file=sys.stderr)
+
+
+class ResponseWriter:
+    """Ghi từng dòng JSON ra stdout, có khóa để các luồng không ghi đè lên nhau."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, message, codec=None):
+        with instrumentation.stage("serialize"):
+            line = payload_store.dumps(message)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class RequestControl:
+    """Hạn chót và trạng thái hủy của các yêu cầu đã nhận mà chưa trả lời xong."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deadlines = {}
+        self.cancelled = set()
+
+    def begin(self, request):
+        request_id = request.get("id")
+        if request_id is None:
+            return
+        timeout_ms = request.get("timeout_ms")
+        with self.lock:
+            self.deadlines[request_id] = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+
+    def cancel(self, request_id):
+        with self.lock:
+            # Yêu cầu đã trả lời xong thì không cần ghi nhớ
+            if request_id in self.deadlines:
+                self.cancelled.add(request_id)
+
+    def stop_reason(self, request_id):
+        """Lý do phải dừng xử lý yêu cầu (bị hủy, quá hạn), hoặc None."""
+        with self.lock:
+            if request_id in self.cancelled:
+                return "Yêu cầu đã bị hủy."
+            deadline = self.deadlines.get(request_id)
+        if deadline is not None and time.monotonic() > deadline:
+            return "Hết thời gian xử lý (timeout_ms)."
+        return None
+
+    def end(self, request_id):
+        with self.lock:
+            self.deadlines.pop(request_id, None)
+            self.cancelled.discard(request_id)
+
+
+_control = RequestControl()
+
+
+def stream_chunk_size():
+    return max(1, int(os.getenv("RECOMMENDER_STREAM_CHUNK", DEFAULT_STREAM_CHUNK)))
+
+
+def stream_request(handler, request, reply):
+    """Xử lý input.queries theo từng phần và gửi kết quả của mỗi phần ngay khi xong."""
+    request_id = request.get("id")
+    input_data = request.get("input") or {}
+    queries = input_data.get("queries")
+    if not isinstance(queries, list):
+        reply({"id": request_id, "result": handler(input_data)})
+        return
+
+    size = stream_chunk_size()
+    for offset in range(0, len(queries), size):
+        reason = _control.stop_reason(request_id)
+        if reason:
+            reply({"id": request_id, "error": reason, "cancelled": True})
+            return
+        result = handler({**input_data, "queries": queries[offset:offset + size]})
+        if "error" in result:
+            reply({"id": request_id, "error": result["error"]})
+            return
+        reply({"id": request_id, "partial": {"offset": offset, **result}})
+    reply({"id": request_id, "result": {"streamed": len(queries)}})
+
+
+def process_request(request, writer, codec=None):
+    request_id = request.get("id")
+
+    def reply(message):
+        writer.send(message, codec)
+
+    try:
+        if request.get("op") == "ping":
+            reply({"id": request_id, "result": {"status": "ok"}})
+            return
+        if request.get("op") == "metrics":
+            reply({"id": request_id, "result": {"metrics": instrumentation.render_prometheus()}})
+            return
+        if request.get("op") == "cache_stats":
+            reply({"id": request_id, "result": {
+                'movie_recommender.py': movie_recommender._cache.stats(),
+                'preference_recommender.py': preference_recommender._cache.stats(),
+            }})
+            return
+
+        handler = HANDLERS.get(request.get("script"))
+        if handler is None:
+            reply({"id": request_id, "error": f"Script không được hỗ trợ: {request.get('script')}"})
+            return
+
+        # Bị hủy hoặc quá hạn trong lúc chờ luồng xử lý
+        reason = _control.stop_reason(request_id)
+        if reason:
+            reply({"id": request_id, "error": reason, "cancelled": True})
+            return
+
+        if request.get("stream"):
+            stream_request(handler, request, reply)
+            return
+
+        result = handler(request.get("input") or {})
+        reply({"id": request_id, "result": result})
+    except Exception as e:
+        traceback.print_exc()
+        reply({"id": request_id, "error": str(e)})
+    finally:
+        _control.end(request_id)
+
+
+def read_lines(stream):
+    """(yêu cầu, None) cho mỗi dòng JSON; yêu cầu là None nếu dòng không hợp lệ."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except json.JSONDecodeError:
+            yield None, None
+
+
+def read_frames(stream):
+    """(yêu cầu, mã hóa) cho mỗi khung; yêu cầu là None nếu khung không hợp lệ."""
+    while True:
+        try:
+            frame = ipc.read_frame(stream)
+        except ipc.FrameError as e:
+            print(f"[recommender_server] {e}", file=sys.stderr)
+            yield None, ipc.CODEC_JSON
+            continue
+        if frame is None:
+            return
+        codec, body = frame
+        try:
+            yield ipc.decode(body, codec), codec
+        except (ValueError, ipc.FrameError):
+            yield None, ipc.CODEC_JSON
+
+
+class Dispatcher:
+    """
+    Hàng đợi giữa luồng đọc và pool xử lý. submit() không bao giờ chặn luồng đọc; một luồng
+    riêng chờ chỗ trống trong pool rồi giao yêu cầu kế tiếp còn hiệu lực.
+    """
+
+    def __init__(self, pool, writer, max_inflight, max_queued=DEFAULT_MAX_QUEUED):
+        self.pool = pool
+        self.writer = writer
+        self.max_queued = max_queued
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="dispatcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, request, codec):
+        with self.condition:
+            if len(self.queue) < self.max_queued:
+                self.queue.append((request, codec))
+                self.condition.notify()
+                return
+        _control.end(request.get("id"))
+        self.writer.send({"id": request.get("id"), "error": "Server đang quá tải, hãy thử lại sau.", "busy": True},
+                         codec)
+
+    def close(self):
+        """Chờ giao hết các yêu cầu còn trong hàng đợi."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _next(self):
+        with self.condition:
+            while not self.queue and not self.closed:
+                self.condition.wait()
+            return self.queue.popleft() if self.queue else None
+
+    def _run(self):
+        while True:
+            self.slots.acquire()
+            item = self._next()
+            if item is None:
+                self.slots.release()
+                return
+            request, codec = item
+            # Bị hủy hoặc quá hạn trong lúc chờ: trả lời ngay, không chiếm luồng xử lý
+            reason = _control.stop_reason(request.get("id"))
+            if reason:
+                _control.end(request.get("id"))
+                self.slots.release()
+                self.writer.send({"id": request.get("id"), "error": reason, "cancelled": True}, codec)
+                continue
+            future = self.pool.submit(process_request, request, self.writer, codec)
+            future.add_done_callback(lambda _: self.slots.release())
+
+
+def is_request_id(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def request_error(request):
+    """
+    Lỗi của các trường mà luồng đọc dùng trước khi giao yêu cầu (id, target, timeout_ms),
+    hoặc None. Kiểm tra trước để một khung sai kiểu không làm dừng luồng đọc.
+    """
+    if request.get("id") is not None and not is_request_id(request["id"]):
+        return "'id' phải là chuỗi hoặc số nguyên."
+    if request.get("op") == "cancel" and not is_request_id(request.get("target")):
+        return "'target' phải là chuỗi hoặc số nguyên."
+    timeout_ms = request.get("timeout_ms")
+    if timeout_ms is not None and (isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float))
+                                   or not math.isfinite(timeout_ms) or timeout_ms <= 0):
+        return "'timeout_ms' phải là số dương."
+    return None
+
+
+def serve(requests, writer, workers=DEFAULT_WORKERS, max_inflight=None, max_queued=DEFAULT_MAX_QUEUED):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        dispatcher = Dispatcher(pool, writer, max_inflight or workers * INFLIGHT_PER_WORKER, max_queued)
+        for request, codec in requests:
+            if not isinstance(request, dict):
+                writer.send({"id": None, "error": "Đầu vào JSON không hợp lệ."}, codec)
+                continue
+            error = request_error(request)
+            if error:
+                request_id = request.get("id")
+                writer.send({"id": request_id if is_request_id(request_id) else None, "error": error}, codec)
+                continue
+            # Lệnh hủy được xử lý ngay trong luồng đọc, không xếp hàng sau các yêu cầu khác
+            if request.get("op") == "cancel":
+                _control.cancel(request.get("target"))
+                continue
+
+            _control.begin(request)
+            dispatcher.submit(request, codec)
+        dispatcher.close()
+
+
+def main():
+    framed = os.getenv("RECOMMENDER_IPC", "lines") == "framed"
+    # Mọi print() lạc ra stdout sẽ làm hỏng giao thức, nên chuyển stdout sang stderr
+    # và chỉ giữ stdout gốc cho các phản hồi.
+    writer = ipc.FrameWriter(sys.stdout.buffer) if framed else ResponseWriter(sys.stdout)
+    sys.stdout = sys.stderr
+
+    workers = int(os.getenv("RECOMMENDER_WORKERS", DEFAULT_WORKERS))
+    max_inflight = int(os.getenv("RECOMMENDER_MAX_INFLIGHT", 0)) or None
+    max_queued = int(os.getenv("RECOMMENDER_MAX_QUEUED", DEFAULT_MAX_QUEUED))
+
+    warm_up()
+    # Cập nhật mô hình tăng dần khi dữ liệu thay đổi (bật bằng RECOMMENDER_REFRESH_SECONDS)
+    incremental_indexer.start_from_env()
+    # Metrics Prometheus qua HTTP (bật bằng RECOMMENDER_METRICS_PORT)
+    instrumentation.start_metrics_server()
+    if framed:
+        writer.send({"event": "ready", "codecs": ipc.available_codecs()})
+        serve(read_frames(sys.stdin.buffer), writer, workers=workers, max_inflight=max_inflight, max_queued=max_queued)
+    else:
+        writer.send({"event": "ready"})
+        serve(read_lines(sys.stdin), writer, workers=workers, max_inflight=max_inflight, max_queued=max_queued)
+
+
+if __name__ == "__main__":
+    main()
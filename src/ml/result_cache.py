@@ -0,0 +1,228 @@
+# src/ml/result_cache.py
+"""
+Cache kết quả xếp hạng của các truy vấn gợi ý.
+
+- Khóa là truy vấn đã được chuẩn hóa (danh sách sở thích sắp xếp, từ khóa viết thường,
+  num_recommendations làm tròn lên theo NUM_REC_BUCKETS) cộng với phiên bản mô hình,
+  nên khi mô hình mới được cài đặt các khóa cũ không bao giờ được dùng lại.
+- Giá trị là (chỉ số dòng, điểm) của top-K theo bucket; phản hồi được dựng lại từ
+  PayloadStore và cắt còn num_recommendations, nên cùng một mục phục vụ được mọi K
+  trong bucket và cả chế độ compact.
+- LocalCache: trong tiến trình, LRU với số mục tối đa và TTL.
+- SharedCache: tùy chọn, dùng chung giữa các tiến trình qua một client kiểu Redis
+  (get / set(ex=)); khi kiểm thử có thể thay client bằng một đối tượng giả lập tại chỗ.
+  Giá trị được ghi dạng .npz (chỉ hai mảng số) và đọc với allow_pickle=False, nên dữ liệu
+  trong Redis không thể khiến tiến trình chạy mã tùy ý.
+
+Cấu hình:
+    RECOMMENDER_CACHE_SIZE         số mục tối đa của cache trong tiến trình (0 = tắt), mặc định 1024
+    RECOMMENDER_CACHE_TTL_SECONDS  mặc định 300
+    RECOMMENDER_CACHE_REDIS_URL    bật cache dùng chung (cần gói redis)
+"""
+import os
+import sys
+import json
+import io
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_TTL_SECONDS = 300
+
+# Các mức K được tính và cache; K lớn hơn mức cuối được làm tròn lên bội số của mức cuối
+NUM_REC_BUCKETS = (10, 20, 50, 100)
+
+
+def bucket_size(num_recommendations):
+    """Mức K được tính và cache cho một num_recommendations."""
+    for bucket in NUM_REC_BUCKETS:
+        if num_recommendations <= bucket:
+            return bucket
+    step = NUM_REC_BUCKETS[-1]
+    return -(-num_recommendations // step) * step
+
+
+def normalize_keywords(text):
+    return " ".join(str(text).lower().split())
+
+
+def vector_digest(vector):
+    """Dấu vân tay của một vector truy vấn (ví dụ embedding) để đưa vào khóa."""
+    return hashlib.sha1(vector.tobytes()).hexdigest()
+
+
+def make_key(name, version, query):
+    """Khóa cache của một truy vấn đã chuẩn hóa (dict/list JSON được) với một phiên bản mô hình."""
+    canonical = json.dumps([name, version, query], sort_keys=True, default=str, ensure_ascii=False)
+    return f"{name}:{hashlib.sha1(canonical.encode('utf-8')).hexdigest()}"
+
+
+class LocalCache:
+    """LRU có TTL trong tiến trình, an toàn khi nhiều luồng cùng dùng."""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if self.ttl and expires_at < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedCache:
+    """
+    Cache dùng chung qua một client kiểu Redis: chỉ cần get(key) và set(key, value, ex=ttl).
+    Lỗi kết nối không làm hỏng truy vấn, chỉ được tính là miss.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_TTL_SECONDS, prefix="recommender:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def _error(self, action, e):
+        with self.lock:
+            self.errors += 1
+        print(f"[result_cache] Lỗi {action} cache dùng chung: {e}", file=sys.stderr)
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self.prefix + key)
+            return decode_value(raw) if raw is not None else None
+        except Exception as e:
+            self._error("đọc", e)
+            return None
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, encode_value(value), ex=int(self.ttl) or None)
+        except Exception as e:
+            self._error("ghi", e)
+
+
+def encode_value(value):
+    """(chỉ số dòng, điểm) -> bytes .npz."""
+    rows, scores = value
+    buffer = io.BytesIO()
+    np.savez(buffer, rows=np.asarray(rows), scores=np.asarray(scores))
+    return buffer.getvalue()
+
+
+def decode_value(raw):
+    """Ngược lại của encode_value; không bao giờ unpickle (allow_pickle=False)."""
+    with np.load(io.BytesIO(raw), allow_pickle=False) as data:
+        return data["rows"], data["scores"]
+
+
+class ResultCache:
+    """Cache hai tầng: LocalCache phía trước, SharedCache (nếu có) phía sau."""
+
+    def __init__(self, local=None, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        # Bộ đếm được nhiều luồng chấm điểm cập nhật cùng lúc
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.local is not None or self.shared is not None
+
+    def get(self, key):
+        value = self.local.get(key) if self.local is not None else None
+        shared_hit = False
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                shared_hit = True
+                if self.local is not None:
+                    self.local.set(key, value)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.shared_hits += shared_hit
+        return value
+
+    def set(self, key, value):
+        if self.local is not None:
+            self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def invalidate(self):
+        """
+        Gọi khi mô hình mới được cài đặt. Khóa đã chứa phiên bản mô hình nên các mục cũ
+        trong cache dùng chung tự hết hạn theo TTL; ở đây chỉ giải phóng cache trong tiến trình.
+        """
+        if self.local is not None:
+            self.local.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = {"hits": self.hits, "misses": self.misses, "shared_hits": self.shared_hits}
+        if self.local is not None:
+            stats.update({"entries": len(self.local), "evictions": self.local.evictions,
+                          "expirations": self.local.expirations})
+        if self.shared is not None:
+            stats["shared_errors"] = self.shared.errors
+        return stats
+
+
+def _redis_client(url):
+    try:
+        import redis
+    except ImportError:
+        print("[result_cache] RECOMMENDER_CACHE_REDIS_URL được đặt nhưng chưa cài gói redis; "
+              "chỉ dùng cache trong tiến trình.", file=sys.stderr)
+        return None
+    return redis.Redis.from_url(url)
+
+
+def from_env(shared_client=None):
+    """Tạo ResultCache theo biến môi trường. shared_client thay cho client Redis (ví dụ khi kiểm thử)."""
+    size = int(os.getenv("RECOMMENDER_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    ttl = float(os.getenv("RECOMMENDER_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+    local = LocalCache(size, ttl) if size > 0 else None
+    if shared_client is None and os.getenv("RECOMMENDER_CACHE_REDIS_URL"):
+        shared_client = _redis_client(os.getenv("RECOMMENDER_CACHE_REDIS_URL"))
+    shared = SharedCache(shared_client, ttl) if shared_client is not None else None
+    return ResultCache(local, shared)
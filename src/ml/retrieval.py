@@ -0,0 +1,273 @@
+# src/ml/retrieval.py
+"""
+Các backend truy hồi (retrieval) trên ma trận đặc trưng kết hợp của mô hình.
+
+- ExactRetriever: chấm điểm Cosine chính xác mọi dòng (thưa, Q @ Fᵀ theo khối); truy vấn có
+  bộ lọc ("candidates") chỉ chấm điểm các dòng ứng viên của nó.
+- IVFRetriever: truy hồi gần đúng (ANN). Các dòng được chiếu xuống một không gian dày
+  ít chiều (TruncatedSVD hoặc random projection), chia thành n_lists cụm bằng k-means
+  (chỉ mục IVF). Mỗi truy vấn chỉ xét các phim thuộc n_probe cụm gần nhất, giữ tối đa
+  rerank ứng viên theo điểm gần đúng, rồi xếp hạng lại các ứng viên bằng điểm Cosine
+  chính xác trên ma trận thưa gốc. n_probe và rerank là nút vặn giữa recall và độ trễ.
+  Nếu tập ứng viên không đủ K kết quả, truy vấn đó được chấm điểm chính xác.
+
+Mọi backend nhận danh sách kế hoạch truy vấn (dict có "vector", "candidates", "k" và
+tùy chọn "exclude", "embedding") và trả về (chỉ số dòng, điểm) top-K của từng kế hoạch.
+
+Kênh dày (tùy chọn): nếu mô hình có ma trận embedding (N x d, float32, các dòng đã chuẩn
+hóa, xem catalog.stack_vectors) và kế hoạch có "embedding", điểm cuối cùng là
+(1 - dense_weight) * điểm thưa + dense_weight * tích vô hướng embedding. Các embedding
+truy vấn của một khối được nhân với ma trận embedding trong một lần gọi BLAS.
+
+Cấu hình:
+    RECOMMENDER_RETRIEVAL          "exact" (mặc định) hoặc "ivf"
+    RECOMMENDER_ANN_PROJECTION     "svd" (mặc định) hoặc "random"
+    RECOMMENDER_ANN_COMPONENTS     số chiều của không gian chiếu, mặc định 128
+    RECOMMENDER_ANN_LISTS          số cụm IVF, mặc định ~ sqrt(N)
+    RECOMMENDER_ANN_PROBES         số cụm được xét cho mỗi truy vấn, mặc định 8
+    RECOMMENDER_ANN_RERANK         số ứng viên tối đa được xếp hạng lại chính xác, mặc định 1000
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.sparse import vstack
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.random_projection import GaussianRandomProjection
+
+import instrumentation
+import parallel
+import ranking
+
+DEFAULT_COMPONENTS = 128
+DEFAULT_PROBES = 8
+DEFAULT_RERANK = 1000
+
+
+def _normalize_rows(dense):
+    norms = np.linalg.norm(dense, axis=1, keepdims=True)
+    return np.divide(dense, norms, out=np.zeros_like(dense), where=norms > 0)
+
+
+def _normalized_sparse(matrix, norms):
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms, dtype=float), where=norms > 0)
+    return matrix.multiply(scale[:, None]).tocsr()
+
+
+class ExactRetriever:
+    """Chấm điểm chính xác mọi dòng của ma trận đặc trưng."""
+    name = "exact"
+
+    def __init__(self, feature_matrix, row_norms, embeddings=None, dense_weight=0.0, workers=None):
+        self.feature_matrix = feature_matrix
+        self.row_norms = row_norms
+        # Pool luồng chấm điểm theo khối dòng (RECOMMENDER_CPU_WORKERS, xem parallel.py)
+        self.pool = parallel.scoring_pool(workers)
+        self.embeddings = embeddings
+        self.dense_weight = dense_weight if embeddings is not None else 0.0
+
+    def params(self):
+        """Các tham số ảnh hưởng đến kết quả xếp hạng (so sánh được qua JSON)."""
+        return {"name": self.name, "dense_weight": float(self.dense_weight)}
+
+    def blend(self, scores, plans, rows=None):
+        """
+        Trộn điểm thưa (mảng len(plans) x số dòng) với điểm của kênh dày cho các kế hoạch
+        có "embedding". rows: các dòng tương ứng với cột của scores (mặc định: mọi dòng).
+        """
+        if not self.dense_weight:
+            return scores
+        dense_plans = [i for i, plan in enumerate(plans) if plan.get("embedding") is not None]
+        if not dense_plans:
+            return scores
+
+        query_embeddings = np.stack([plans[i]["embedding"] for i in dense_plans])
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+        dense_scores = (embeddings @ query_embeddings.T).T
+        scores[dense_plans] = (1.0 - self.dense_weight) * scores[dense_plans] + self.dense_weight * dense_scores
+        return scores
+
+    def _rerank(self, plan, query_vector, query_norm, rows):
+        """Top-K của một kế hoạch khi chỉ chấm điểm các dòng rows (tăng dần)."""
+        dots = np.asarray((self.feature_matrix[rows] @ query_vector.T).todense(), dtype=float).ravel()
+        denominators = self.row_norms[rows] * query_norm
+        scores = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+        scores = self.blend(scores[None, :], [plan], rows)[0]
+        mask = rows != plan["exclude"] if plan.get("exclude") is not None else None
+        top_positions, top_scores = ranking.top_k(scores, plan["k"], mask=mask)
+        return rows[top_positions], top_scores
+
+    def rank(self, plans):
+        if not plans:
+            return []
+
+        ranked = [None] * len(plans)
+        # Truy vấn có bộ lọc (năm, thời lượng...) chỉ chấm điểm tập ứng viên của nó
+        filtered = [i for i, plan in enumerate(plans) if plan["candidates"] is not None]
+        for i in filtered:
+            plan = plans[i]
+            query_vector = plan["vector"].tocsr()
+            instrumentation.count("rows_scored", len(plan["candidates"]))
+            ranked[i] = self._rerank(plan, query_vector, ranking.row_norms(query_vector)[0], plan["candidates"])
+
+        # Các truy vấn còn lại được chấm điểm với mọi dòng, theo khối
+        unfiltered = [i for i, plan in enumerate(plans) if plan["candidates"] is None]
+        if unfiltered:
+            query_matrix = vstack([plans[i]["vector"] for i in unfiltered])
+            instrumentation.count("rows_scored", len(unfiltered) * self.feature_matrix.shape[0])
+            for start, block in ranking.cosine_score_blocks(query_matrix, self.feature_matrix, self.row_norms,
+                                                            pool=self.pool):
+                block_positions = unfiltered[start:start + block.shape[0]]
+                block = self.blend(block, [plans[i] for i in block_positions])
+                for i, sim_scores in zip(block_positions, block):
+                    ranked[i] = ranking.top_k(sim_scores, plans[i]["k"], exclude=plans[i].get("exclude"))
+        return ranked
+
+
+class IVFRetriever(ExactRetriever):
+    """Truy hồi gần đúng qua chỉ mục IVF trên phép chiếu dày, xếp hạng lại chính xác."""
+    name = "ivf"
+
+    def __init__(self, feature_matrix, row_norms, embeddings=None, dense_weight=0.0, n_components=DEFAULT_COMPONENTS,
+                 n_lists=None, n_probe=DEFAULT_PROBES, rerank=DEFAULT_RERANK, projection="svd", random_state=0,
+                 index=None):
+        """
+        index: các mảng của chỉ mục đã dựng với cùng tham số (index_arrays(), ví dụ tải bằng
+        memory-map từ artifact của kho); khi có, chỉ mục không được dựng lại.
+        """
+        super().__init__(feature_matrix, row_norms, embeddings, dense_weight)
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.projection = projection
+        self.random_state = random_state
+        # Tham số dựng chỉ mục được yêu cầu, lưu cùng index_arrays() (xem build_config)
+        self.config = build_config(n_components, n_lists, projection, random_state)
+        if index is not None:
+            self.components = index["components"]
+            self.projected = index["projected"]
+            self.centroids = index["centroids"]
+            self.list_rows = index["list_rows"]
+            self.list_offsets = index["list_offsets"]
+            return
+
+        started = time.time()
+        n_rows, n_features = feature_matrix.shape
+        normalized = _normalized_sparse(feature_matrix, row_norms)
+
+        n_components = max(1, min(n_components, n_features - 1, n_rows))
+        if projection == "random":
+            projector = GaussianRandomProjection(n_components=n_components, random_state=random_state)
+        else:
+            projector = TruncatedSVD(n_components=n_components, random_state=random_state)
+        # Phép chiếu dày của từng dòng, chỉ dùng để chọn ứng viên
+        self.projected = np.ascontiguousarray(
+            _normalize_rows(projector.fit_transform(normalized)), dtype=np.float32)
+        # Cả hai phép chiếu là nhân với components_ᵀ (transform của sklearn)
+        self.components = np.ascontiguousarray(projector.components_)
+
+        n_lists = n_lists or int(np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=random_state, n_init=3,
+                                 batch_size=max(1024, 4 * n_lists))
+        labels = kmeans.fit_predict(self.projected)
+        self.centroids = np.ascontiguousarray(_normalize_rows(kmeans.cluster_centers_), dtype=np.float32)
+
+        # Danh sách đảo của từng cụm: list_rows[list_offsets[c]:list_offsets[c + 1]] (tăng dần)
+        self.list_rows = np.argsort(labels, kind="stable")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        print(f"[retrieval] Đã dựng chỉ mục IVF: {n_rows} dòng, {n_components} chiều, {n_lists} cụm "
+              f"({time.time() - started:.1f}s)", file=sys.stderr)
+
+    def index_arrays(self):
+        """Các mảng của chỉ mục, để lưu cùng kho và truyền lại qua index."""
+        return {
+            "components": self.components,
+            "projected": self.projected,
+            "centroids": self.centroids,
+            "list_rows": self.list_rows,
+            "list_offsets": self.list_offsets,
+        }
+
+    def params(self):
+        return {
+            **super().params(),
+            "n_components": int(self.projected.shape[1]),
+            "n_lists": int(len(self.centroids)),
+            "n_probe": int(self.n_probe),
+            "rerank": int(self.rerank),
+            "projection": self.projection,
+            "random_state": self.random_state,
+        }
+
+    def probe(self, query_matrix):
+        """Các dòng ứng viên (tăng dần) của từng truy vấn."""
+        query_embeddings = _normalize_rows(np.asarray(
+            _normalized_sparse(query_matrix, ranking.row_norms(query_matrix)) @ self.components.T))
+        query_embeddings = query_embeddings.astype(np.float32)
+        cell_scores = query_embeddings @ self.centroids.T
+        n_probe = min(self.n_probe, self.centroids.shape[0])
+
+        candidates = []
+        for query_embedding, scores in zip(query_embeddings, cell_scores):
+            cells = np.argpartition(-scores, n_probe - 1)[:n_probe]
+            rows = np.concatenate([self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in cells])
+            if rows.size > self.rerank:
+                approx = self.projected[rows] @ query_embedding
+                rows = rows[np.argpartition(-approx, self.rerank - 1)[:self.rerank]]
+            candidates.append(np.sort(rows))
+        return candidates
+
+    def rank(self, plans):
+        if not plans:
+            return []
+
+        query_matrix = vstack([plan["vector"] for plan in plans]).tocsr()
+        query_norms = ranking.row_norms(query_matrix)
+        ranked, fallback = [], []
+        for i, (plan, rows) in enumerate(zip(plans, self.probe(query_matrix))):
+            if plan["candidates"] is not None:
+                rows = np.intersect1d(rows, plan["candidates"], assume_unique=True)
+            instrumentation.count("rows_scored", rows.size)
+            result = self._rerank(plan, query_matrix[i], query_norms[i], rows)
+            if len(result[0]) < plan["k"] and rows.size < self.feature_matrix.shape[0]:
+                fallback.append(i)
+            ranked.append(result)
+
+        # Ứng viên gần đúng không đủ K kết quả: chấm điểm chính xác các truy vấn này
+        instrumentation.count("exact_fallbacks", len(fallback))
+        for i, result in zip(fallback, super().rank([plans[i] for i in fallback])):
+            ranked[i] = result
+        return ranked
+
+
+def build_config(n_components, n_lists, projection, random_state):
+    """Các tham số quyết định chỉ mục IVF (n_probe, rerank chỉ dùng lúc truy vấn)."""
+    return {"n_components": n_components, "n_lists": n_lists, "projection": projection, "random_state": random_state}
+
+
+def from_env(feature_matrix, row_norms, embeddings=None, dense_weight=0.0, saved_index=None):
+    """
+    Tạo backend truy hồi theo RECOMMENDER_RETRIEVAL.
+    saved_index: (config, mảng) của chỉ mục IVF đã lưu cùng kho; được dùng lại nếu config
+    trùng với tham số hiện tại, ngược lại chỉ mục được dựng lại.
+    """
+    mode = os.getenv("RECOMMENDER_RETRIEVAL", "exact")
+    if mode == "ivf":
+        config = build_config(
+            int(os.getenv("RECOMMENDER_ANN_COMPONENTS", DEFAULT_COMPONENTS)),
+            int(os.getenv("RECOMMENDER_ANN_LISTS", 0)) or None,
+            os.getenv("RECOMMENDER_ANN_PROJECTION", "svd"),
+            0,
+        )
+        index = saved_index[1] if saved_index is not None and saved_index[0] == config else None
+        return IVFRetriever(
+            feature_matrix, row_norms, embeddings, dense_weight,
+            n_probe=int(os.getenv("RECOMMENDER_ANN_PROBES", DEFAULT_PROBES)),
+            rerank=int(os.getenv("RECOMMENDER_ANN_RERANK", DEFAULT_RERANK)),
+            index=index, **config,
+        )
+    if mode != "exact":
+        print(f"[retrieval] RECOMMENDER_RETRIEVAL='{mode}' không hợp lệ, dùng 'exact'.", file=sys.stderr)
+    return ExactRetriever(feature_matrix, row_norms, embeddings, dense_weight)
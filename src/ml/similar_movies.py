@@ -0,0 +1,366 @@
+# src/ml/similar_movies.py
+"""
+Bảng "phim tương tự" tính sẵn cho gợi ý theo ID (/movies/recommend/:id).
+
+Kết quả của truy vấn theo ID chỉ đổi khi danh mục đổi, nên một job offline tính trước
+top-K láng giềng của mọi phim và lưu thành bảng gọn:
+
+    <RECOMMENDER_ARTIFACT_DIR>/similar/<version>/
+        ids.npy         (dòng -> ObjectId dạng chuỗi hex)
+        neighbors.npy   (N x K int32: dòng của các láng giềng, giảm dần theo điểm; -1 = ô trống)
+        scores.npy      (N x K float32)
+        meta.json       (K, phiên bản kho đặc trưng đã dùng để tính...)
+
+- compute(): chấm điểm theo khối RECOMMENDER_SIMILAR_BLOCK_ROWS phim bằng chính backend
+  truy hồi và vector truy vấn theo ID của kho (cùng kết quả với chấm điểm trực tiếp); các
+  mảng kết quả được ghi thẳng vào file .npy đã memory-map nên bộ nhớ chỉ phụ thuộc kích
+  thước khối, không phụ thuộc số phim.
+- Tùy chọn ghi thêm vào một collection phụ (RECOMMENDER_SIMILAR_COLLECTION) bằng
+  bulk_write, mỗi phim một document {_id, similar: [{movie_id, score}], store_version},
+  cho các dịch vụ khác đọc trực tiếp từ MongoDB.
+- Lúc phục vụ, movie_recommender.py tra bảng của kho đang phục vụ bằng lookup(): O(1) theo
+  dòng, không chấm điểm. Bảng chỉ được dùng nếu được tính trên đúng phiên bản kho (và cùng
+  trọng số của chế độ "by_id"); các trường hợp khác (phim mới, cần nhiều hơn K kết quả,
+  láng giềng đã bị xóa...) được chấm điểm trực tiếp như trước.
+- Khi incremental_indexer.py cập nhật kho, update() chỉ tính lại các phim mới/đã sửa, các
+  phim có láng giềng đã sửa hoặc bị xóa, và các phim mà một phim mới/đã sửa nay lọt vào
+  top-K (một phép nhân thưa của các phim đó với danh mục, theo khối). Với
+  RECOMMENDER_RETRIEVAL=ivf, các dòng được chép sang giữ kết quả gần đúng của chỉ mục cũ.
+
+    python3 src/ml/build_index.py similar --k 50 --collection movie_similar
+
+Cấu hình:
+    RECOMMENDER_SIMILAR_K            số láng giềng lưu cho mỗi phim, mặc định 50
+    RECOMMENDER_SIMILAR_BLOCK_ROWS   số phim được chấm điểm trong một khối, mặc định 1024
+    RECOMMENDER_SIMILAR_COLLECTION   collection phụ nhận kết quả bằng bulk_write (mặc định không ghi)
+    RECOMMENDER_SIMILAR_TABLE        "0" = không dùng bảng khi phục vụ
+"""
+import os
+import sys
+import json
+import time
+
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne
+
+import feature_engine
+import model_store
+import mongo_client
+import ranking
+
+# Tên thư mục artifact của bảng trong model_store
+ARTIFACT_NAME = 'similar'
+
+DEFAULT_K = 50
+DEFAULT_BLOCK_ROWS = 1024
+WRITE_BATCH_SIZE = 1000
+
+
+def enabled():
+    return os.getenv("RECOMMENDER_SIMILAR_TABLE", "1") != "0"
+
+
+def default_k():
+    return int(os.getenv("RECOMMENDER_SIMILAR_K", DEFAULT_K))
+
+
+def block_rows():
+    return max(1, int(os.getenv("RECOMMENDER_SIMILAR_BLOCK_ROWS", DEFAULT_BLOCK_ROWS)))
+
+
+def side_collection():
+    return os.getenv("RECOMMENDER_SIMILAR_COLLECTION") or None
+
+
+class SimilarTable:
+    """
+    Top-K láng giềng của từng phim. neighbors/scores có thể là mảng memory-map chỉ đọc.
+    attach() nối bảng với một kho đặc trưng: dòng của kho <-> dòng của bảng.
+    """
+
+    def __init__(self, ids, neighbors, scores, meta):
+        self.ids = ids
+        self.neighbors = neighbors
+        self.scores = scores
+        self.meta = meta
+        self.k = neighbors.shape[1]
+        self.store_rows = None
+        self.table_rows = None
+
+    def attach(self, store):
+        self.store_rows = store["indices"].rows(self.ids)
+        self.table_rows = np.full(len(store["table"]), -1, dtype=np.int64)
+        present = np.flatnonzero(self.store_rows >= 0)
+        self.table_rows[self.store_rows[present]] = present
+        return self
+
+    def lookup(self, row, n):
+        """
+        (dòng trong kho, điểm) của tối đa n láng giềng của phim ở dòng row, hoặc None nếu bảng
+        không trả lời được (phim chưa có trong bảng, cần nhiều hơn K láng giềng, láng giềng
+        không còn trong kho).
+        """
+        table_row = self.table_rows[row] if row < len(self.table_rows) else -1
+        if table_row < 0:
+            return None
+        neighbors = self.neighbors[table_row]
+        count = int(np.count_nonzero(neighbors >= 0))
+        n = max(n, 0)
+        # Danh sách đầy K ô có thể còn láng giềng chưa lưu; danh sách ngắn hơn là đầy đủ
+        if n > count and count == self.k:
+            return None
+        rows = self.store_rows[neighbors[:min(n, count)]]
+        if (rows < 0).any():
+            return None
+        return rows, np.asarray(self.scores[table_row][:len(rows)], dtype=np.float64)
+
+
+# --- TÍNH BẢNG ---
+
+def by_id_plan(store, row, k):
+    """Kế hoạch chấm điểm của truy vấn theo ID, như movie_recommender.plan_query."""
+    plan = {"vector": feature_engine.by_id_vector(store, row), "candidates": None, "exclude": row, "k": k}
+    if store["embeddings"] is not None and store["embeddings"][row].any():
+        plan["embedding"] = store["embeddings"][row]
+    return plan
+
+
+def compute(store, k, rows=None, out=None):
+    """
+    Top-k láng giềng của các dòng rows (mặc định mọi dòng) của kho, chấm điểm theo khối
+    block_rows() phim. out: (neighbors, scores) kích thước len(rows) x k để ghi kết quả vào
+    (ví dụ mảng memory-map); mặc định tạo mảng mới. Trả về (neighbors, scores).
+    """
+    rows = np.arange(len(store["table"])) if rows is None else np.asarray(rows, dtype=np.int64)
+    if out is None:
+        out = (np.full((len(rows), k), -1, dtype=np.int32), np.zeros((len(rows), k), dtype=np.float32))
+    neighbors, scores = out
+
+    size = block_rows()
+    started, reported = time.time(), 0
+    for start in range(0, len(rows), size):
+        plans = [by_id_plan(store, row, k) for row in rows[start:start + size]]
+        for position, (top_indices, top_scores) in enumerate(store["retriever"].rank(plans), start):
+            neighbors[position, :len(top_indices)] = top_indices
+            neighbors[position, len(top_indices):] = -1
+            scores[position, :len(top_indices)] = top_scores
+            scores[position, len(top_indices):] = 0
+        done = min(start + size, len(rows))
+        if done * 10 // len(rows) > reported or done == len(rows):
+            reported = done * 10 // len(rows)
+            print(f"[similar_movies] {done}/{len(rows)} phim ({time.time() - started:.1f}s)", file=sys.stderr)
+    return neighbors, scores
+
+
+def table_meta(store, k):
+    return {
+        "k": k,
+        "store_version": store["version"],
+        "by_id_weights": store["mode_field_weights"]["by_id"],
+        # Backend truy hồi và các tham số của nó (gồm dense_weight, cấu hình IVF)
+        "retrieval": store["retriever"].params(),
+    }
+
+
+def scoring_mismatch(meta, store):
+    """
+    Các tham số chấm điểm của bảng (meta) khác với kho store: danh sách tên tham số, rỗng
+    nếu bảng cho đúng kết quả của chấm điểm trực tiếp trên kho.
+    """
+    expected = table_meta(store, meta.get("k"))
+    return [key for key in ("store_version", "by_id_weights", "retrieval") if meta.get(key) != expected[key]]
+
+
+def build_table(store, k=None):
+    """Bảng đầy đủ của kho, trong bộ nhớ (dùng khi build lại kho trong tiến trình)."""
+    k = k or default_k()
+    ids = np.array([str(movie_id) for movie_id in store["table"]['id']], dtype="U24")
+    neighbors, scores = compute(store, k)
+    return SimilarTable(ids, neighbors, scores, table_meta(store, k)).attach(store)
+
+
+def save_table(store, k=None, collection=None):
+    """
+    Tính bảng của kho rồi lưu thành một phiên bản artifact mới; các mảng được ghi thẳng vào
+    file nên bộ nhớ không tăng theo số phim. collection: tên collection phụ nhận kết quả
+    (mặc định RECOMMENDER_SIMILAR_COLLECTION). Trả về tên phiên bản.
+    """
+    k = k or default_k()
+    n_rows = len(store["table"])
+    version, version_dir = model_store.create_version(ARTIFACT_NAME)
+
+    ids = np.array([str(movie_id) for movie_id in store["table"]['id']], dtype="U24")
+    np.save(os.path.join(version_dir, "ids.npy"), ids)
+    neighbors = np.lib.format.open_memmap(os.path.join(version_dir, "neighbors.npy"), mode="w+",
+                                          dtype=np.int32, shape=(n_rows, k))
+    scores = np.lib.format.open_memmap(os.path.join(version_dir, "scores.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n_rows, k))
+    compute(store, k, out=(neighbors, scores))
+    neighbors.flush()
+    scores.flush()
+
+    meta = table_meta(store, k)
+    collection = collection or side_collection()
+    if collection:
+        table = SimilarTable(ids, neighbors, scores, meta)
+        written = write_collection(table, collection, replace_all=True)
+        meta["collection"] = {"name": collection, "documents": written}
+
+    meta.update({"version": version, "rows": n_rows, "built_at": time.time()})
+    model_store.publish_version(ARTIFACT_NAME, version, meta)
+    print(f"[similar_movies] Đã lưu bảng {n_rows} x {k} phiên bản {version} tại {version_dir}", file=sys.stderr)
+    return version
+
+
+def load_table(store):
+    """
+    Bảng của phiên bản artifact hiện tại nếu nó được tính trên đúng phiên bản kho, trọng số
+    by_id, backend truy hồi và tham số chấm điểm của kho store, đã gắn với kho; ngược lại
+    None (gợi ý theo ID được chấm điểm trực tiếp cho đến khi build_index.py tính lại bảng).
+    """
+    version_dir = model_store.version_path(ARTIFACT_NAME)
+    if version_dir is None:
+        return None
+    table = load_version(version_dir)
+    mismatch = scoring_mismatch(table.meta, store)
+    if mismatch:
+        print(f"[similar_movies] Bảng {table.meta.get('version')} khác kho hiện tại ({store['version']}) ở "
+              f"{', '.join(mismatch)}; gợi ý theo ID sẽ được chấm điểm trực tiếp.", file=sys.stderr)
+        return None
+    return table.attach(store)
+
+
+def load_version(version_dir):
+    with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return SimilarTable(
+        np.load(os.path.join(version_dir, "ids.npy"), mmap_mode="r"),
+        np.load(os.path.join(version_dir, "neighbors.npy"), mmap_mode="r"),
+        np.load(os.path.join(version_dir, "scores.npy"), mmap_mode="r"),
+        meta,
+    )
+
+
+def for_store(store):
+    """
+    Bảng của kho: bảng đã gắn vào kho (build lại, cập nhật tăng dần), hoặc artifact tính
+    trên đúng phiên bản kho. Được nạp một lần cho mỗi kho; None nếu không có hoặc tắt.
+    """
+    if "similar" not in store:
+        store["similar"] = load_table(store) if enabled() else None
+    return store["similar"]
+
+
+# --- CẬP NHẬT TĂNG DẦN ---
+
+def update(table, store, changed_ids=(), removed_ids=()):
+    """
+    Bảng mới khớp với dòng của store (kho sau một lần cập nhật tăng dần từ kho của table).
+    Chỉ các phim mới/đã sửa và các phim có láng giềng đã sửa/bị xóa được tính lại, các dòng
+    khác được chép sang. Trả về (bảng mới, các dòng đã tính lại).
+    """
+    k = table.k
+    ids = np.array([str(movie_id) for movie_id in store["table"]['id']], dtype="U24")
+    dirty = {str(movie_id) for movie_id in changed_ids} | {str(movie_id) for movie_id in removed_ids}
+
+    old_index = {str(movie_id): row for row, movie_id in enumerate(table.ids)}
+    # Dòng cũ của từng dòng mới (-1: phim mới hoặc đã sửa) và dòng mới của từng dòng cũ
+    source = np.array([-1 if movie_id in dirty else old_index.get(movie_id, -1) for movie_id in ids], dtype=np.int64)
+    old_to_new = np.full(len(table.ids), -1, dtype=np.int64)
+    old_to_new[source[source >= 0]] = np.flatnonzero(source >= 0)
+
+    neighbors = np.full((len(ids), k), -1, dtype=np.int32)
+    scores = np.zeros((len(ids), k), dtype=np.float32)
+    kept = np.flatnonzero(source >= 0)
+    if len(kept):
+        old_neighbors = np.asarray(table.neighbors[source[kept]], dtype=np.int64)
+        mapped = np.where(old_neighbors >= 0, old_to_new[np.maximum(old_neighbors, 0)], -1)
+        broken = ((old_neighbors >= 0) & (mapped < 0)).any(axis=1)
+        neighbors[kept] = mapped
+        scores[kept] = table.scores[source[kept]]
+        recompute = np.union1d(np.flatnonzero(source < 0), kept[broken])
+    else:
+        recompute = np.arange(len(ids))
+
+    # Các phim mà một phim mới/đã sửa nay lọt vào top-K của chúng
+    changed_rows = np.flatnonzero(source < 0)
+    recompute = np.union1d(recompute, _entering_rows(store, neighbors, scores, changed_rows))
+
+    if len(recompute):
+        neighbors[recompute], scores[recompute] = compute(store, k, rows=recompute)
+    meta = {**table.meta, **table_meta(store, k), "incremental": True}
+    return SimilarTable(ids, neighbors, scores, meta).attach(store), recompute
+
+
+def _entering_rows(store, neighbors, scores, changed_rows):
+    """
+    Các dòng có điểm với một phim trong changed_rows (ở vai trò láng giềng) cao hơn điểm
+    thấp nhất trong danh sách của chúng (danh sách chưa đầy: mọi điểm > 0). Điểm được tính
+    chính xác theo khối block_rows() dòng truy vấn, như ExactRetriever.
+    """
+    if not len(changed_rows):
+        return np.empty(0, dtype=np.int64)
+    feature_matrix = store["feature_matrix"]
+    targets = feature_matrix[changed_rows]
+    target_norms = store["row_norms"][changed_rows]
+    embeddings = store["embeddings"]
+    dense_weight = feature_engine.DENSE_WEIGHT if embeddings is not None else 0.0
+    threshold = np.where(neighbors[:, -1] >= 0, scores[:, -1], 0.0)
+
+    entering = []
+    size = block_rows()
+    for start in range(0, feature_matrix.shape[0], size):
+        stop = min(start + size, feature_matrix.shape[0])
+        queries = feature_engine.weigh_query(store, feature_matrix[start:stop], "by_id")
+        dots = ranking.sparse_dots(targets, queries).T
+        denominators = np.outer(ranking.row_norms(queries), target_norms)
+        block = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+        if dense_weight:
+            # Chỉ các phim có embedding mới dùng kênh dày khi làm truy vấn (xem by_id_plan)
+            with_embedding = np.flatnonzero(np.asarray(embeddings[start:stop]).any(axis=1))
+            dense = np.asarray(embeddings[start:stop][with_embedding]) @ np.asarray(embeddings[changed_rows]).T
+            block[with_embedding] = (1.0 - dense_weight) * block[with_embedding] + dense_weight * dense
+        # Một phim không là láng giềng của chính nó
+        own = (changed_rows >= start) & (changed_rows < stop)
+        block[changed_rows[own] - start, np.flatnonzero(own)] = 0
+        hit = (block > threshold[start:stop, None]) & (block > 0)
+        entering.append(start + np.flatnonzero(hit.any(axis=1)))
+    return np.concatenate(entering)
+
+
+# --- GHI VÀO COLLECTION PHỤ ---
+
+def write_collection(table, collection_name, rows=None, removed_ids=(), replace_all=False, mongodb_uri=None):
+    """
+    Ghi các dòng rows (mặc định mọi dòng) của bảng vào collection phụ bằng bulk_write theo lô
+    WRITE_BATCH_SIZE document, xóa document của removed_ids. replace_all: xóa thêm các
+    document không thuộc lần ghi này (phim không còn trong danh mục). Trả về số document đã ghi.
+    """
+    mongodb_uri = mongodb_uri or os.getenv("MONGODB_URI")
+    collection = mongo_client.get_client(mongodb_uri)[mongo_client.database_name(mongodb_uri)][collection_name]
+    store_version = table.meta.get("store_version")
+    rows = range(len(table.ids)) if rows is None else rows
+
+    operations, written = [], 0
+    for row in rows:
+        neighbors = table.neighbors[row]
+        valid = neighbors >= 0
+        operations.append(ReplaceOne({'_id': ObjectId(str(table.ids[row]))}, {
+            'similar': [{'movie_id': ObjectId(str(table.ids[neighbor])), 'score': float(score)}
+                        for neighbor, score in zip(neighbors[valid], table.scores[row][valid])],
+            'store_version': store_version,
+        }, upsert=True))
+        if len(operations) >= WRITE_BATCH_SIZE:
+            collection.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    if removed_ids:
+        collection.delete_many({'_id': {'$in': list(removed_ids)}})
+    if replace_all:
+        collection.delete_many({'store_version': {'$ne': store_version}})
+    return written
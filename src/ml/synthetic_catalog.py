@@ -0,0 +1,143 @@
+# src/ml/synthetic_catalog.py
+"""
+Sinh danh mục phim giả lập có cùng cấu trúc với collection 'embedded_movies'.
+
+Dùng cho benchmark.py và để thử các mô hình khi không có dữ liệu sample_mflix thật.
+Phân bố được chọn gần với dữ liệu thật: vài thể loại phổ biến, diễn viên/đạo diễn/biên
+kịch có độ phổ biến lệch mạnh (phần lớn chỉ xuất hiện ở một phim), văn bản plot/fullplot
+lấy từ một từ vựng có tần suất lệch. Cùng seed luôn cho cùng danh mục (trừ _id).
+
+    python3 src/ml/synthetic_catalog.py --rows 100000                    # ghi vào MONGODB_URI
+    python3 src/ml/synthetic_catalog.py --rows 10000 --embedding-dim 1536
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from bson.objectid import ObjectId
+
+GENRES = ['Drama', 'Comedy', 'Romance', 'Crime', 'Thriller', 'Action', 'Adventure', 'Documentary',
+          'Horror', 'Mystery', 'Biography', 'Family', 'Fantasy', 'Sci-Fi', 'History', 'Animation',
+          'Music', 'War', 'Sport', 'Musical', 'Short', 'Western', 'Film-Noir', 'News']
+LANGUAGES = ['English', 'French', 'Spanish', 'German', 'Italian', 'Japanese', 'Russian', 'Hindi',
+             'Mandarin', 'Korean', 'Swedish', 'Portuguese', 'Cantonese', 'Arabic', 'Vietnamese']
+COUNTRIES = ['USA', 'UK', 'France', 'Germany', 'Canada', 'Italy', 'Japan', 'India', 'Spain',
+             'Australia', 'Hong Kong', 'South Korea', 'Sweden', 'Russia', 'China', 'Vietnam']
+FIRST_NAMES = ['James', 'Mary', 'John', 'Linh', 'Robert', 'Anna', 'Michael', 'Yuki', 'David', 'Maria',
+               'William', 'Sofia', 'Richard', 'Hana', 'Thomas', 'Elena', 'Charles', 'Mai', 'Daniel', 'Laura']
+
+DEFAULT_BATCH_SIZE = 10000
+VOCABULARY_SIZE = 20000
+PLOT_WORDS = 25
+FULLPLOT_WORDS = 120
+
+
+def _skewed(rng, pool_size, size, power):
+    """Chỉ số trong [0, pool_size), chỉ số nhỏ phổ biến hơn (power càng lớn càng lệch)."""
+    return np.minimum((pool_size * rng.random(size) ** power).astype(np.int64), pool_size - 1)
+
+
+def _person(i):
+    return f"{FIRST_NAMES[i % len(FIRST_NAMES)]} Person{i}"
+
+
+def _labels(rng, names, pool_size, counts, power):
+    """Mỗi phim một danh sách nhãn không trùng, số nhãn theo counts."""
+    drawn = _skewed(rng, pool_size, int(counts.sum()), power)
+    lists, start = [], 0
+    for count in counts:
+        lists.append([names(i) for i in dict.fromkeys(drawn[start:start + count].tolist())])
+        start += count
+    return lists
+
+
+def _texts(rng, n, words_per_text):
+    words = _skewed(rng, VOCABULARY_SIZE, (n, words_per_text), 2.0)
+    return [" ".join(f"w{word}" for word in row) for row in words.tolist()]
+
+
+def generate_batches(n_rows, seed=0, batch_size=DEFAULT_BATCH_SIZE, embedding_dim=0):
+    """Sinh n_rows document theo từng lô (list document)."""
+    rng = np.random.default_rng(seed)
+    # Số người trong danh mục tăng theo số phim, như dữ liệu thật
+    people = max(100, int(n_rows * 1.5))
+    for start in range(0, n_rows, batch_size):
+        n = min(batch_size, n_rows - start)
+        genres = _labels(rng, GENRES.__getitem__, len(GENRES), rng.integers(1, 4, n), 1.5)
+        cast = _labels(rng, _person, people, rng.integers(0, 8, n), 3.0)
+        directors = _labels(rng, _person, people, rng.integers(1, 3, n), 3.0)
+        writers = _labels(rng, _person, people, rng.integers(0, 4, n), 3.0)
+        languages = _labels(rng, LANGUAGES.__getitem__, len(LANGUAGES), rng.integers(1, 3, n), 3.0)
+        countries = _labels(rng, COUNTRIES.__getitem__, len(COUNTRIES), rng.integers(1, 3, n), 3.0)
+        plots = _texts(rng, n, PLOT_WORDS)
+        fullplots = _texts(rng, n, FULLPLOT_WORDS)
+        years = rng.integers(1915, 2024, n)
+        runtimes = rng.integers(60, 200, n)
+        ratings = np.round(rng.normal(6.5, 1.2, n).clip(1, 10), 1)
+        embeddings = rng.standard_normal((n, embedding_dim), dtype=np.float32) if embedding_dim else None
+
+        batch = []
+        for i in range(n):
+            doc = {
+                '_id': ObjectId(),
+                'title': f"Synthetic Movie {start + i}",
+                'genres': genres[i],
+                'plot': plots[i],
+                'fullplot': fullplots[i],
+                'cast': cast[i],
+                'directors': directors[i],
+                'writers': writers[i],
+                'languages': languages[i],
+                'countries': countries[i],
+                'awards': {'wins': int(i % 5), 'nominations': int(i % 7), 'text': ''},
+                'poster': f"https://example.com/posters/{start + i}.jpg",
+                'released': f"{int(years[i])}-01-01T00:00:00Z",
+                'lastupdated': "2015-08-26 00:00:00.000000000",
+                'year': int(years[i]),
+                'imdb': {'rating': float(ratings[i]), 'votes': int(i % 10000), 'id': start + i},
+                'type': 'movie',
+                'runtime': int(runtimes[i]),
+            }
+            if embeddings is not None:
+                doc['plot_embedding'] = embeddings[i].tolist()
+            batch.append(doc)
+        yield batch
+
+
+def generate_movies(n_rows, seed=0, embedding_dim=0):
+    """Sinh n_rows document (iterator)."""
+    for batch in generate_batches(n_rows, seed, embedding_dim=embedding_dim):
+        yield from batch
+
+
+def load_into(collection, n_rows, seed=0, batch_size=DEFAULT_BATCH_SIZE, embedding_dim=0):
+    """Ghi n_rows phim giả lập vào collection (pymongo hoặc mongomock) theo lô insert_many."""
+    for batch in generate_batches(n_rows, seed, batch_size, embedding_dim):
+        collection.insert_many(batch, ordered=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic embedded_movies catalog to MongoDB.")
+    parser.add_argument('--rows', type=int, default=10000, help="Number of movies to generate.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embedding-dim', type=int, default=0, help="Also write plot_embedding vectors of this size.")
+    parser.add_argument('--collection', default='embedded_movies')
+    parser.add_argument('--drop', action='store_true', help="Drop the collection first.")
+    args = parser.parse_args()
+
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        sys.exit("Biến môi trường MONGODB_URI không được thiết lập.")
+
+    from pymongo import MongoClient
+    client = MongoClient(mongodb_uri)
+    try:
+        collection = client[mongodb_uri.split('/')[-1].split('?')[0]][args.collection]
+        if args.drop:
+            collection.drop()
+        load_into(collection, args.rows, args.seed, embedding_dim=args.embedding_dim)
+        print(json.dumps({"collection": args.collection, "rows": args.rows}))
+    finally:
+        client.close()
@@ -1,6 +1,6 @@
 // src/routes/movieRoutes.ts
 import { Router, Request, Response } from "express";
-import { getMovies, getMovieRecommendations, searchMovieRecommendations } from "../controllers/movieController";
+import { getMovies, getMovieRecommendations, searchMovieRecommendations, getBatchRecommendations } from "../controllers/movieController";
 import { getPreferenceRecommendations } from "../controllers/prefernceMovieController";
 
 const router = Router();
@@ -75,7 +75,19 @@ router.get("/movies", getMovies as (req: Request, res: Response) => Promise<void
  * schema:
  * type: integer
  * default: 10
- * description: Số lượng phim gợi ý muốn nhận.
+ * description: Số lượng phim gợi ý muốn nhận (giới hạn trong 1-100).
+ * - in: query
+ * name: compact
+ * schema:
+ * type: boolean
+ * default: false
+ * description: Bỏ các trường nặng (plot, fullplot) khỏi kết quả.
+ * - in: query
+ * name: timings
+ * schema:
+ * type: boolean
+ * default: false
+ * description: Thêm khối "timings" (thời gian từng giai đoạn xử lý trong Python) vào phản hồi.
  * responses:
  * 200:
  * description: Danh sách các phim được gợi ý.
@@ -106,6 +118,48 @@ router.get("/movies", getMovies as (req: Request, res: Response) => Promise<void
  */
 router.get("/movies/recommend/:id", getMovieRecommendations as (req: Request, res: Response) => Promise<void>);
 
+/**
+ * @swagger
+ * /movies/recommend/batch:
+ * post:
+ * summary: Gợi ý phim cho nhiều truy vấn trong một yêu cầu.
+ * description: Mỗi truy vấn là { movie_id }, { search_keywords }, { user_preferences } hoặc { type: "preference", genres, cast, ... }. Các truy vấn được chấm điểm cùng lúc; kết quả trả về theo đúng thứ tự.
+ * requestBody:
+ * required: true
+ * content:
+ * application/json:
+ * schema:
+ * type: object
+ * properties:
+ * queries:
+ * type: array
+ * maxItems: 100
+ * items:
+ * type: object
+ * example:
+ * queries:
+ * - movie_id: "573a1391f29313caabcd8828"
+ * num_recommendations: 5
+ * - search_keywords: "Tom Hanks comedy"
+ * - type: "preference"
+ * genres: "Drama,Romance"
+ * parameters:
+ * - in: query
+ * name: stream
+ * schema:
+ * type: boolean
+ * default: false
+ * description: Trả từng kết quả ngay khi tính xong, mỗi dòng một JSON { index, result } (application/x-ndjson).
+ * responses:
+ * 200:
+ * description: "{ results: [...] }, mỗi phần tử giống phản hồi của route đơn lẻ tương ứng."
+ * 400:
+ * description: Thiếu 'queries' hoặc quá nhiều truy vấn.
+ * 500:
+ * description: Lỗi máy chủ nội bộ hoặc lỗi khi chạy script Python.
+ */
+router.post('/movies/recommend/batch', getBatchRecommendations as (req: Request, res: Response) => Promise<void>);
+
 router.get('/movies/search', searchMovieRecommendations as (req: Request, res: Response) => Promise<void>);
 
 router.get('/movies/preference-recommendations', getPreferenceRecommendations as (req: Request, res: Response) => Promise<void>);
@@ -11,6 +11,7 @@ import http from 'http';
 import connectDB from './config/db'; 
 import swaggerUi from 'swagger-ui-express'; 
 import swaggerSpec from './swagger'; 
+import { startPythonServer, stopPythonServer } from './services/pythonService';
 
 const app = express();
 const server = http.createServer(app);
@@ -41,6 +42,9 @@ connectDB() // Gọi hàm kết nối DB
         app.use('/api', movieRoutes); 
 
 
+        // --- Khởi động tiến trình Python thường trú để mô hình được xây dựng trước ---
+        startPythonServer();
+
         server.listen(PORT, () => {
             console.log(`Server is running on port ${PORT}`);
             console.log(`API Docs available at http://localhost:${PORT}/api-docs`);
@@ -50,4 +54,12 @@ connectDB() // Gọi hàm kết nối DB
         // Lỗi kết nối DB đã được xử lý trong connectDB
         console.error('Server failed to start due to MongoDB connection error.', err);
         process.exit(1);
-    });
\ No newline at end of file
+    });
+
+// Dừng tiến trình Python thường trú khi server tắt
+for (const signal of ['SIGINT', 'SIGTERM'] as const) {
+    process.on(signal, () => {
+        stopPythonServer();
+        process.exit(0);
+    });
+}
@@ -1,50 +1,406 @@
 // src/services/pythonService.ts
 
-import { spawn } from 'child_process';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
 import path from 'path';
 
+const pythonCommand = process.platform === 'win32' ? 'python' : 'python3';
+
+// Thời gian tối đa chờ một phản hồi từ tiến trình Python thường trú (ms)
+const PYTHON_REQUEST_TIMEOUT_MS = parseInt(process.env.PYTHON_REQUEST_TIMEOUT_MS as string) || 120000;
+// Thời gian chờ tối đa giữa hai lần khởi động lại tiến trình Python (ms)
+const MAX_RESTART_DELAY_MS = 30000;
+// Kích thước tối đa của một khung nhận từ Python (byte)
+const PYTHON_MAX_FRAME_BYTES = parseInt(process.env.PYTHON_MAX_FRAME_BYTES as string) || 64 * 1024 * 1024;
+// Số khung tối đa chờ ghi vào stdin của Python khi pipe đang đầy
+const PYTHON_MAX_QUEUED_FRAMES = parseInt(process.env.PYTHON_MAX_QUEUED_FRAMES as string) || 1000;
+
 /**
- * Hàm trợ giúp để chạy script Python và trả về kết quả.
- * @param scriptName Tên của file script Python (ví dụ: 'movie_recommender.py').
- * @param inputData Dữ liệu đầu vào sẽ được gửi tới script Python dưới dạng JSON.
- * @returns Promise chứa kết quả từ script Python hoặc lỗi.
+ * Xác định thư mục chứa các script Python dựa trên môi trường.
  */
-export async function runPythonScript(scriptName: string, inputData: any): Promise<any> {
-    const pythonScriptFileName = scriptName;
-    let pythonScriptDirPath: string;
-
-    // Xác định đường dẫn thư mục của script Python dựa trên môi trường
+function getPythonScriptDirPath(): string {
     // __dirname ở đây là đường dẫn đến thư mục 'services'
     if (process.env.NODE_ENV === 'production') {
         // Trong môi trường production, project_root/dist/services -> project_root/dist/ml
-        pythonScriptDirPath = path.join(__dirname, '..', '..', 'dist', 'ml');
+        return path.join(__dirname, '..', '..', 'dist', 'ml');
+    }
+    // Trong môi trường development, project_root/src/services -> project_root/src/ml
+    return path.join(__dirname, '..', 'ml');
+}
+
+function getPythonEnv(): NodeJS.ProcessEnv {
+    return {
+        ...process.env,
+        // Đảm bảo MONGODB_URI được truyền vào tiến trình Python
+        MONGODB_URI: process.env.MONGODB_URI,
+        DB_NAME: process.env.DB_NAME // Truyền thêm DB_NAME nếu cần
+    };
+}
+
+
+// --- CHẾ ĐỘ THƯỜNG TRÚ (recommender_server.py) ---
+// Một tiến trình Python duy nhất giữ mô hình trong bộ nhớ và trả lời nhiều yêu cầu qua
+// các khung nhị phân trên stdin/stdout (xem src/ml/ipc.py):
+//   4 byte độ dài nội dung (big-endian) + 1 byte mã hóa (0 = JSON, 1 = msgpack) + nội dung.
+// Mỗi yêu cầu mang một "id" để ghép với phản hồi, nên nhiều yêu cầu chạy xen kẽ được và
+// phản hồi về không theo thứ tự gửi.
+
+const FRAME_HEADER_BYTES = 5;
+const CODEC_JSON = 0;
+const CODEC_MSGPACK = 1;
+
+// msgpack là tùy chọn: cài gói @msgpack/msgpack và đặt PYTHON_IPC_CODEC=msgpack
+let msgpack: { encode(value: any): Uint8Array; decode(data: Uint8Array): any } | null = null;
+if (process.env.PYTHON_IPC_CODEC === 'msgpack') {
+    try {
+        msgpack = require('@msgpack/msgpack');
+    } catch {
+        console.error('[PythonService] PYTHON_IPC_CODEC=msgpack nhưng chưa cài @msgpack/msgpack; dùng JSON.');
+    }
+}
+
+export interface PythonCallOptions {
+    // Hủy yêu cầu (ví dụ khi client HTTP ngắt kết nối); Python bỏ qua yêu cầu nếu chưa xử lý
+    signal?: AbortSignal;
+    // Ghi đè PYTHON_REQUEST_TIMEOUT_MS cho riêng yêu cầu này
+    timeoutMs?: number;
+}
+
+interface PendingRequest {
+    resolve: (value: any) => void;
+    reject: (reason: any) => void;
+    timer: NodeJS.Timeout;
+    onPartial?: (partial: any) => void;
+    cleanup: () => void;
+}
+
+interface QueuedFrame {
+    id: number | null;
+    frame: Buffer;
+}
+
+let serverProcess: ChildProcessWithoutNullStreams | null = null;
+let serverCodecs: string[] = ['json'];
+let nextRequestId = 1;
+const pendingRequests = new Map<number, PendingRequest>();
+let restartAttempts = 0;
+let restartTimer: NodeJS.Timeout | null = null;
+let stopping = false;
+
+// Khung chờ ghi khi stdin của Python đang đầy (write() trả về false)
+let writeQueue: QueuedFrame[] = [];
+let waitingForDrain = false;
+
+/**
+ * Chế độ thường trú được bật mặc định; đặt PYTHON_SERVER_MODE=off để quay về
+ * cách cũ (mỗi yêu cầu một tiến trình Python).
+ */
+export function isPythonServerEnabled(): boolean {
+    return process.env.PYTHON_SERVER_MODE !== 'off';
+}
+
+function encodeFrame(message: any): Buffer {
+    const useMsgpack = msgpack !== null && serverCodecs.includes('msgpack');
+    const body = useMsgpack ? Buffer.from(msgpack!.encode(message)) : Buffer.from(JSON.stringify(message), 'utf8');
+    const header = Buffer.alloc(FRAME_HEADER_BYTES);
+    header.writeUInt32BE(body.length, 0);
+    header.writeUInt8(useMsgpack ? CODEC_MSGPACK : CODEC_JSON, 4);
+    return Buffer.concat([header, body]);
+}
+
+function decodeFrame(codec: number, body: Buffer): any {
+    if (codec === CODEC_JSON) return JSON.parse(body.toString('utf8'));
+    if (codec === CODEC_MSGPACK && msgpack) return msgpack.decode(body);
+    throw new Error(`Mã hóa không được hỗ trợ: ${codec}`);
+}
+
+/**
+ * Tách các khung từ luồng stdout của Python. Các đoạn dữ liệu chỉ được ghép lại khi đã
+ * đủ một khung, nên phản hồi lớn không bị sao chép lại ở mỗi đoạn nhận được.
+ */
+function createFrameReader(onFrame: (codec: number, body: Buffer) => void, onError: (error: Error) => void) {
+    let chunks: Buffer[] = [];
+    let buffered = 0;
+    let needed = FRAME_HEADER_BYTES;
+
+    return (chunk: Buffer) => {
+        chunks.push(chunk);
+        buffered += chunk.length;
+        while (buffered >= needed) {
+            const data = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, buffered);
+            const size = data.readUInt32BE(0);
+            if (size > PYTHON_MAX_FRAME_BYTES) {
+                onError(new Error(`Khung ${size} byte vượt quá giới hạn ${PYTHON_MAX_FRAME_BYTES} byte.`));
+                chunks = [];
+                buffered = 0;
+                return;
+            }
+            if (buffered < FRAME_HEADER_BYTES + size) {
+                chunks = [data];
+                needed = FRAME_HEADER_BYTES + size;
+                break;
+            }
+            const rest = data.subarray(FRAME_HEADER_BYTES + size);
+            chunks = rest.length ? [rest] : [];
+            buffered = rest.length;
+            needed = FRAME_HEADER_BYTES;
+            onFrame(data[4], data.subarray(FRAME_HEADER_BYTES, FRAME_HEADER_BYTES + size));
+        }
+    };
+}
+
+function flushWriteQueue() {
+    waitingForDrain = false;
+    const child = serverProcess;
+    if (!child) return;
+    while (writeQueue.length) {
+        const { frame } = writeQueue.shift()!;
+        if (!child.stdin.write(frame)) {
+            waitingForDrain = true;
+            child.stdin.once('drain', flushWriteQueue);
+            return;
+        }
+    }
+}
+
+/**
+ * Ghi một khung vào stdin của Python. Khi pipe đầy (Python đang bận và ngừng đọc), khung
+ * được xếp hàng tới sự kiện 'drain' thay vì dồn vào bộ đệm của stream.
+ */
+function writeFrame(child: ChildProcessWithoutNullStreams, id: number | null, frame: Buffer) {
+    if (waitingForDrain) {
+        writeQueue.push({ id, frame });
+        return;
+    }
+    if (!child.stdin.write(frame)) {
+        waitingForDrain = true;
+        child.stdin.once('drain', flushWriteQueue);
+    }
+}
+
+function cancelOnServer(id: number) {
+    // Yêu cầu còn trong hàng đợi ghi thì chỉ cần bỏ khỏi hàng đợi
+    const queued = writeQueue.findIndex((entry) => entry.id === id);
+    if (queued !== -1) {
+        writeQueue.splice(queued, 1);
+        return;
+    }
+    const child = serverProcess;
+    if (child) writeFrame(child, null, encodeFrame({ op: 'cancel', target: id }));
+}
+
+function rejectAllPending(reason: any) {
+    for (const [id, pending] of pendingRequests) {
+        pending.cleanup();
+        pending.reject(reason);
+        pendingRequests.delete(id);
+    }
+}
+
+function handleServerMessage(message: any) {
+    if (message.event === 'ready') {
+        restartAttempts = 0;
+        serverCodecs = Array.isArray(message.codecs) ? message.codecs : ['json'];
+        console.log(`[PythonService] Python recommender server đã sẵn sàng (mã hóa: ${serverCodecs.join(', ')}).`);
+        return;
+    }
+
+    const pending = pendingRequests.get(message.id);
+    if (!pending) return;
+
+    if (message.partial !== undefined) {
+        pending.onPartial?.(message.partial);
+        return;
+    }
+
+    pendingRequests.delete(message.id);
+    pending.cleanup();
+
+    if (message.error !== undefined) {
+        pending.reject({
+            message: "Lỗi khi chạy script Python.",
+            error: message.error
+        });
     } else {
-        // Trong môi trường development, project_root/src/services -> project_root/src/ml
-        pythonScriptDirPath = path.join(__dirname, '..', 'ml');
+        pending.resolve(message.result);
+    }
+}
+
+function scheduleRestart() {
+    if (stopping || restartTimer) return;
+    const delay = Math.min(1000 * 2 ** restartAttempts, MAX_RESTART_DELAY_MS);
+    restartAttempts++;
+    console.error(`[PythonService] Khởi động lại Python server sau ${delay}ms...`);
+    restartTimer = setTimeout(() => {
+        restartTimer = null;
+        startPythonServer();
+    }, delay);
+}
+
+/**
+ * Khởi động tiến trình Python thường trú (nếu chưa chạy). Tiến trình sẽ được tự động
+ * khởi động lại khi bị dừng bất ngờ.
+ */
+export function startPythonServer(): void {
+    if (serverProcess || !isPythonServerEnabled()) return;
+    stopping = false;
+
+    const serverScriptPath = path.join(getPythonScriptDirPath(), 'recommender_server.py');
+    console.log(`[PythonService] Khởi động Python recommender server: ${serverScriptPath}`);
+
+    const child = spawn(pythonCommand, [serverScriptPath], {
+        env: { ...getPythonEnv(), RECOMMENDER_IPC: 'framed' }
+    });
+    serverProcess = child;
+    serverCodecs = ['json'];
+    writeQueue = [];
+    waitingForDrain = false;
+
+    const readFrames = createFrameReader((codec, body) => {
+        let message: any;
+        try {
+            message = decodeFrame(codec, body);
+        } catch (parseError: any) {
+            console.error(`[PythonService] Khung không hợp lệ từ Python server: ${parseError.message}`);
+            return;
+        }
+        handleServerMessage(message);
+    }, (error) => {
+        // Không còn biết ranh giới khung kế tiếp, nên khởi động lại tiến trình
+        console.error(`[PythonService] ${error.message}`);
+        child.kill();
+    });
+    child.stdout.on('data', readFrames);
+
+    child.stderr.on('data', (data) => {
+        console.error(`[PythonService] Python Stderr: ${data.toString()}`);
+    });
+    child.stdin.on('error', (err) => {
+        console.error("[PythonService] Lỗi khi ghi vào stdin của Python server:", err.message);
+    });
+
+    const handleExit = (reason: string) => {
+        if (serverProcess !== child) return;
+        serverProcess = null;
+        writeQueue = [];
+        waitingForDrain = false;
+        console.error(`[PythonService] Python server đã dừng (${reason}).`);
+        rejectAllPending({
+            message: "Tiến trình Python đã dừng trước khi trả kết quả.",
+            error: reason
+        });
+        scheduleRestart();
+    };
+
+    child.on('exit', (code, signal) => handleExit(`code ${code}, signal ${signal}`));
+    child.on('error', (err) => {
+        console.error("[PythonService] Failed to start Python process:", err);
+        handleExit(err.message);
+    });
+}
+
+/**
+ * Dừng tiến trình Python thường trú và không khởi động lại nữa.
+ */
+export function stopPythonServer(): void {
+    stopping = true;
+    if (restartTimer) {
+        clearTimeout(restartTimer);
+        restartTimer = null;
+    }
+    if (serverProcess) {
+        const child = serverProcess;
+        serverProcess = null;
+        writeQueue = [];
+        waitingForDrain = false;
+        rejectAllPending({ message: "Python server đang dừng.", error: "stopped" });
+        child.kill();
+    }
+}
+
+function sendToPythonServer(
+    scriptName: string,
+    inputData: any,
+    options: PythonCallOptions,
+    onPartial?: (partial: any) => void
+): Promise<any> {
+    startPythonServer();
+    const child = serverProcess;
+    if (!child) {
+        return Promise.reject({
+            message: "Python server chưa sẵn sàng.",
+            error: "Tiến trình Python đang được khởi động lại."
+        });
+    }
+    if (writeQueue.length >= PYTHON_MAX_QUEUED_FRAMES) {
+        return Promise.reject({
+            message: "Python server đang quá tải.",
+            error: `Đã có ${writeQueue.length} yêu cầu chờ gửi tới Python.`
+        });
     }
+    if (options.signal?.aborted) {
+        return Promise.reject({ message: "Yêu cầu đã bị hủy.", error: "cancelled" });
+    }
+
+    const id = nextRequestId++;
+    const timeoutMs = options.timeoutMs ?? PYTHON_REQUEST_TIMEOUT_MS;
+    return new Promise((resolve, reject) => {
+        const abandon = (reason: any) => {
+            if (!pendingRequests.has(id)) return;
+            pendingRequests.get(id)!.cleanup();
+            pendingRequests.delete(id);
+            cancelOnServer(id);
+            reject(reason);
+        };
+        const onAbort = () => abandon({ message: "Yêu cầu đã bị hủy.", error: "cancelled" });
+
+        const timer = setTimeout(() => abandon({
+            message: "Hết thời gian chờ phản hồi từ Python.",
+            error: `Timeout sau ${timeoutMs}ms`
+        }), timeoutMs);
+        options.signal?.addEventListener('abort', onAbort, { once: true });
 
-    const pythonScriptPath = path.join(pythonScriptDirPath, pythonScriptFileName);
-    const inputJsonString = JSON.stringify(inputData);
-    const pythonCommand = process.platform === 'win32' ? 'python' : 'python3';
+        pendingRequests.set(id, {
+            resolve,
+            reject,
+            timer,
+            onPartial,
+            cleanup: () => {
+                clearTimeout(timer);
+                options.signal?.removeEventListener('abort', onAbort);
+            }
+        });
+        // timeout_ms: Python bỏ qua yêu cầu nếu tới hạn mà chưa kịp xử lý
+        const message: any = { id, script: scriptName, input: inputData, timeout_ms: timeoutMs };
+        if (onPartial) message.stream = true;
+        writeFrame(child, id, encodeFrame(message));
+    });
+}
+
+// --- CHẾ ĐỘ MỖI YÊU CẦU MỘT TIẾN TRÌNH (PYTHON_SERVER_MODE=off) ---
+
+function runPythonProcess(scriptName: string, inputData: any, options: PythonCallOptions): Promise<any> {
+    const pythonScriptPath = path.join(getPythonScriptDirPath(), scriptName);
 
     return new Promise((resolve, reject) => {
-        let pythonProcessOutput = '';
+        const outputChunks: Buffer[] = [];
         let pythonProcessError = '';
 
         console.log(`[PythonService] Đang thực hiện lệnh chạy Python script từ: ${pythonScriptPath}`);
         console.log(`[PythonService] Lệnh Python: ${pythonCommand}`);
 
-        const python = spawn(pythonCommand, [pythonScriptPath, inputJsonString], {
-            env: {
-                ...process.env,
-                // Đảm bảo MONGODB_URI được truyền vào tiến trình Python
-                MONGODB_URI: process.env.MONGODB_URI,
-                DB_NAME: process.env.DB_NAME // Truyền thêm DB_NAME nếu cần
-            }
+        // "-": script đọc JSON đầu vào từ stdin, không bị giới hạn độ dài dòng lệnh (ARG_MAX)
+        const python = spawn(pythonCommand, [pythonScriptPath, '-'], {
+            env: getPythonEnv(),
+            signal: options.signal,
+            timeout: options.timeoutMs
         });
+        python.stdin.on('error', (err) => {
+            console.error("[PythonService] Lỗi khi ghi đầu vào cho Python:", err.message);
+        });
+        python.stdin.end(JSON.stringify(inputData));
 
-        python.stdout.on('data', (data) => {
-            pythonProcessOutput += data.toString();
+        python.stdout.on('data', (data: Buffer) => {
+            outputChunks.push(data);
         });
 
         python.stderr.on('data', (data) => {
@@ -62,6 +418,8 @@ export async function runPythonScript(scriptName: string, inputData: any): Promi
                 });
             }
 
+            // Ghép các đoạn một lần ở cuối, để ký tự UTF-8 nằm vắt qua hai đoạn không bị hỏng
+            const pythonProcessOutput = Buffer.concat(outputChunks).toString('utf8');
             try {
                 const result = JSON.parse(pythonProcessOutput);
                 resolve(result);
@@ -76,6 +434,9 @@ export async function runPythonScript(scriptName: string, inputData: any): Promi
         });
 
         python.on('error', (err) => {
+            if (err.name === 'AbortError') {
+                return reject({ message: "Yêu cầu đã bị hủy.", error: "cancelled" });
+            }
             console.error("[PythonService] Failed to start Python process:", err);
             let errorMessage = "Không thể khởi động tiến trình Python. Vui lòng đảm bảo Python đã được cài đặt và nằm trong biến môi trường PATH của hệ thống.";
             if ((err as any).code === 'ENOENT') {
@@ -88,4 +449,43 @@ export async function runPythonScript(scriptName: string, inputData: any): Promi
             });
         });
     });
-}
\ No newline at end of file
+}
+
+/**
+ * Hàm trợ giúp để chạy script Python và trả về kết quả.
+ * Mặc định yêu cầu được gửi tới tiến trình Python thường trú; nếu PYTHON_SERVER_MODE=off
+ * thì mỗi lần gọi sẽ khởi chạy một tiến trình Python mới.
+ * @param scriptName Tên của file script Python (ví dụ: 'movie_recommender.py').
+ * @param inputData Dữ liệu đầu vào sẽ được gửi tới script Python dưới dạng JSON.
+ * @param options Tín hiệu hủy và thời gian chờ riêng cho yêu cầu.
+ * @returns Promise chứa kết quả từ script Python hoặc lỗi.
+ */
+export async function runPythonScript(scriptName: string, inputData: any, options: PythonCallOptions = {}): Promise<any> {
+    if (isPythonServerEnabled()) {
+        return sendToPythonServer(scriptName, inputData, options);
+    }
+    return runPythonProcess(scriptName, inputData, options);
+}
+
+/**
+ * Chạy một lô truy vấn (inputData.queries) và nhận kết quả theo từng phần ngay khi Python
+ * tính xong: onPartial({ offset, results }) với results[i] là kết quả của queries[offset + i].
+ * Ở chế độ mỗi yêu cầu một tiến trình, cả lô được trả về trong một phần duy nhất.
+ * @returns Promise hoàn thành khi mọi phần đã được gửi ({ streamed: số truy vấn }).
+ */
+export async function streamPythonScript(
+    scriptName: string,
+    inputData: any,
+    onPartial: (partial: any) => void,
+    options: PythonCallOptions = {}
+): Promise<any> {
+    if (isPythonServerEnabled()) {
+        return sendToPythonServer(scriptName, inputData, options, onPartial);
+    }
+    const result = await runPythonProcess(scriptName, inputData, options);
+    if (result.error) {
+        throw { message: "Lỗi khi chạy script Python.", error: result.error };
+    }
+    onPartial({ offset: 0, ...result });
+    return { streamed: result.results?.length ?? 0 };
+}
@@ -0,0 +1,33 @@
+# tests/ml/conftest.py
+"""
+Các script trong src/ml import lẫn nhau theo tên module phẳng (như khi Node chạy
+python3 src/ml/<script>.py), nên thư mục đó được đưa vào sys.path cho các bài kiểm thử.
+Dữ liệu là danh mục giả lập (synthetic_catalog.py), không cần MongoDB.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "ml"))
+
+import feature_engine  # noqa: E402
+import model_store  # noqa: E402
+import synthetic_catalog  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def artifact_dir(tmp_path, monkeypatch):
+    """Mỗi bài kiểm thử ghi artifact vào một thư mục tạm riêng."""
+    monkeypatch.setattr(model_store, "ARTIFACT_ROOT", str(tmp_path / "artifacts"))
+    return tmp_path / "artifacts"
+
+
+@pytest.fixture
+def catalog_table():
+    return feature_engine.prepare_table(synthetic_catalog.generate_movies(300, seed=1))
+
+
+@pytest.fixture
+def store(catalog_table):
+    return feature_engine.build_store(catalog_table, workers=1)
@@ -0,0 +1,69 @@
+# tests/ml/test_batch_queries.py
+import json
+
+import pytest
+
+import feature_engine
+import movie_recommender
+import payload_store
+import preference_recommender
+
+
+@pytest.fixture
+def served_store(store, monkeypatch):
+    monkeypatch.setenv("MONGODB_URI", "mongodb://localhost/test")
+    monkeypatch.setattr(feature_engine, "_store", store)
+    monkeypatch.setattr(movie_recommender, "_model", None)
+    monkeypatch.setattr(preference_recommender, "current_model", None)
+    return store
+
+
+def test_movie_batch_reports_bad_queries_per_position(served_store):
+    results = movie_recommender.get_batch_recommendations([
+        {"search_keywords": "love war", "num_recommendations": "5"},
+        {"search_keywords": "love war", "num_recommendations": 5},
+        {"user_preferences": {"genres": "Drama"}},
+        {"user_preferences": {"genres": ["Drama"], "min_year": "1990"}},
+        {"search_keywords": ["love"]},
+        "not a query",
+        {"user_preferences": {"genres": ["Drama"], "min_year": 1990}, "num_recommendations": None},
+    ])["results"]
+    assert "'num_recommendations'" in results[0]["error"]
+    assert len(results[1]["recommendations"]) > 0
+    assert "'user_preferences.genres'" in results[2]["error"]
+    assert "'user_preferences.min_year'" in results[3]["error"]
+    assert "'search_keywords'" in results[4]["error"]
+    assert "error" in results[5]
+    assert "recommendations" in results[6] or "message" in results[6]
+
+
+def test_preference_batch_accepts_lists_and_isolates_errors(served_store):
+    results = preference_recommender.get_batch_preference_recommendations([
+        {"genres": "Drama,Comedy", "num_recommendations": 5},
+        {"genres": ["Drama", "Comedy"], "num_recommendations": 5},
+        {"genres": "Drama", "num_recommendations": "5"},
+        {"genres": [1, 2]},
+        {"genres": "Drama", "min_year": "2000"},
+    ])["results"]
+    assert results[0] == results[1]
+    assert len(results[0]["recommendations"]) > 0
+    assert "'num_recommendations'" in results[2]["error"]
+    assert "'genres'" in results[3]["error"]
+    assert "'min_year'" in results[4]["error"]
+
+
+@pytest.mark.parametrize("count", [0, -5])
+def test_non_positive_counts_are_errors(served_store, count):
+    movie = movie_recommender.get_batch_recommendations([
+        {"search_keywords": "love war", "num_recommendations": count},
+        {"search_keywords": "love war", "num_recommendations": 1},
+    ])["results"]
+    assert "'num_recommendations'" in movie[0]["error"]
+    assert len(json.loads(payload_store.dumps(movie[1]))["recommendations"]) == 1
+
+    preference = preference_recommender.get_batch_preference_recommendations([
+        {"genres": "Drama", "num_recommendations": count},
+    ])["results"]
+    assert "'num_recommendations'" in preference[0]["error"]
+    assert "'num_recommendations'" in movie_recommender.handle_request(
+        {"search_keywords": "love war", "num_recommendations": count})["error"]
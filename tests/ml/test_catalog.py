@@ -0,0 +1,112 @@
+# tests/ml/test_catalog.py
+import math
+
+import numpy as np
+import pytest
+from bson import BSON, ObjectId
+from sklearn.preprocessing import MultiLabelBinarizer
+
+import catalog
+import feature_engine
+import synthetic_catalog
+
+
+class FakeCursor(list):
+    def batch_size(self, size):
+        self.size = size
+        return self
+
+
+class FakeCollection:
+    """Collection giả: find() / find_raw_batches() trên một danh sách document."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        return FakeCursor(self.documents)
+
+    def find_raw_batches(self, query, projection, batch_size):
+        for start in range(0, len(self.documents), batch_size):
+            yield b"".join(BSON.encode(doc) for doc in self.documents[start:start + batch_size])
+
+
+DOCS = [
+    {"_id": ObjectId(), "title": "A", "genres": ["Drama"], "plot": "p", "year": 1999, "runtime": "120"},
+    {"_id": ObjectId(), "title": "B", "genres": None, "plot": None, "year": "n/a", "runtime": True},
+    {"_id": ObjectId(), "title": "C", "plot": "q", "year": 2004.0},
+]
+FIELDS = ["_id", "title", "genres", "plot", "year", "runtime"]
+NORMALIZERS = {"genres": catalog.as_list, "plot": catalog.as_text}
+
+
+def test_builder_normalizes_values_into_columns():
+    table = catalog.table_from_documents(DOCS, FIELDS, NORMALIZERS, ["year", "runtime"])
+    assert len(table) == 3 and table["id"] == [doc["_id"] for doc in DOCS]
+    assert table["genres"] == [["Drama"], [], []]
+    assert table["plot"] == ["p", "", "q"]
+    assert table["year"].dtype == np.float64
+    np.testing.assert_array_equal(table["runtime"], [120.0, np.nan, np.nan])
+    assert table.row(1)["year"] is None and table.row(2)["year"] == 2004
+    assert isinstance(table.row(2)["year"], int)
+
+
+def test_take_and_concat_keep_columns_aligned():
+    table = catalog.table_from_documents(DOCS, FIELDS, NORMALIZERS, ["year", "runtime"])
+    picked = table.take([2, 0])
+    assert picked["title"] == ["C", "A"]
+    np.testing.assert_array_equal(picked["year"], [2004.0, 1999.0])
+    joined = picked.concat(table.take([1]))
+    assert joined["title"] == ["C", "A", "B"] and len(joined["year"]) == 3
+    assert math.isnan(joined["year"][2])
+
+
+@pytest.mark.parametrize("raw_batches", [False, True])
+def test_load_table_reads_batches_like_documents(raw_batches):
+    docs = list(synthetic_catalog.generate_movies(25, seed=3))
+    loaded = catalog.load_table(FakeCollection(docs), feature_engine.PROJECTION, feature_engine.FIELD_NORMALIZERS,
+                                feature_engine.NUMERIC_FIELDS, batch_size=7, raw_batches=raw_batches)
+    expected = feature_engine.prepare_table(docs)
+    assert len(loaded) == 25
+    for row in (0, 6, 7, 24):
+        assert loaded.row(row) == expected.row(row)
+
+
+def test_vector_columns_are_normalized_float32():
+    docs = [{"_id": 1, "v": [3.0, 4.0]}, {"_id": 2, "v": None}, {"_id": 3, "v": [1.0, 2.0, 3.0]}]
+    vectors = catalog.table_from_documents(docs, ["_id", "v"], vector_fields=["v"])["v"]
+    assert vectors.dtype == np.float32 and vectors.shape == (3, 2)
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0, 0], [0, 0]])
+
+
+def test_id_index_maps_ids_to_rows():
+    ids = [ObjectId() for _ in range(50)]
+    ids.append(ids[10])
+    index = catalog.IdIndex(catalog.id_strings(ids))
+    for row in (0, 10, 49):
+        assert index[ids[row]] == index.get(str(ids[row])) == row
+    # Id trùng nhau: dòng đầu tiên
+    assert index[ids[50]] == 10
+    missing = ObjectId()
+    assert missing not in index and index.get(missing) is None
+    with pytest.raises(KeyError):
+        index[missing]
+    assert index.rows([str(ids[3]), str(missing), str(ids[0])]).tolist() == [3, -1, 0]
+    assert catalog.IdIndex(catalog.id_strings([])).rows([str(missing)]).tolist() == [-1]
+
+    # Thứ tự lưu sẵn (artifact) cho cùng kết quả
+    saved = catalog.IdIndex(catalog.id_strings(ids), index.order)
+    assert saved.rows([str(movie_id) for movie_id in ids]).tolist() == list(range(50)) + [10]
+
+
+def test_encode_labels_matches_multilabel_binarizer():
+    label_lists = [["b", "a"], [], ["c", "b", "b"], ["a"]]
+    mlb, matrix = catalog.encode_labels(label_lists)
+    expected = MultiLabelBinarizer().fit(label_lists)
+    assert list(mlb.classes_) == list(expected.classes_)
+    np.testing.assert_array_equal(matrix.toarray(), expected.transform(label_lists))
+
+    # min_count: bỏ nhãn có ở ít hơn min_count dòng ("c" lặp trong một dòng vẫn là một dòng)
+    mlb, matrix = catalog.encode_labels([["a", "c", "c"], ["a", "b"], ["b"]], min_count=2)
+    assert list(mlb.classes_) == ["a", "b"]
+    np.testing.assert_array_equal(matrix.toarray(), [[1, 0], [1, 1], [0, 1]])
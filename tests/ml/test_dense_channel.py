@@ -0,0 +1,65 @@
+# tests/ml/test_dense_channel.py
+import numpy as np
+import pytest
+
+import catalog
+import movie_recommender
+import ranking
+import retrieval
+import similar_movies
+import synthetic_catalog
+
+
+@pytest.fixture
+def embeddings(store):
+    docs = synthetic_catalog.generate_movies(len(store["table"]), seed=1, embedding_dim=16)
+    vectors = [catalog.as_vector(doc["plot_embedding"]) for doc in docs]
+    vectors[7] = None
+    return catalog.stack_vectors(vectors)
+
+
+def sparse_scores(store, row):
+    vector = store["feature_matrix"][row]
+    dots = (store["feature_matrix"] @ vector.T).toarray().ravel()
+    return dots / (store["row_norms"] * store["row_norms"][row])
+
+
+@pytest.mark.parametrize("weight", [0.0, 0.3, 1.0])
+def test_final_score_blends_sparse_and_dense_scores(store, embeddings, weight):
+    retriever = retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"], embeddings, weight)
+    plan = similar_movies.by_id_plan(store, 5, 10)
+    plan["embedding"] = embeddings[5]
+    rows, scores = retriever.rank([plan])[0]
+
+    blended = (1 - weight) * sparse_scores(store, 5) + weight * (embeddings @ embeddings[5])
+    expected_rows, expected_scores = ranking.top_k(blended, 10, exclude=5)
+    np.testing.assert_array_equal(rows, expected_rows)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_plans_without_embedding_keep_sparse_scores(store, embeddings):
+    retriever = retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"], embeddings, 0.5)
+    plain = similar_movies.by_id_plan(store, 5, 10)
+    rows, scores = retriever.rank([plain])[0]
+    expected_rows, expected_scores = ranking.top_k(sparse_scores(store, 5), 10, exclude=5)
+    np.testing.assert_array_equal(rows, expected_rows)
+    np.testing.assert_allclose(scores, expected_scores)
+    # Không có ma trận embedding: trọng số bị bỏ qua
+    assert retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"], None, 0.5).dense_weight == 0.0
+
+
+def test_query_embedding_is_checked_and_normalized(store, embeddings):
+    model = movie_recommender.model_from_store(store)
+    model["embeddings"] = embeddings
+    query = {"search_keywords": "love war", "plot_embedding": [3.0, 4.0] + [0.0] * 14}
+    plan, response = movie_recommender.plan_query(model, query)
+    assert response is None
+    np.testing.assert_allclose(plan["embedding"][:2], [0.6, 0.8])
+    assert "dense_weight" in plan["cache_query"]
+
+    _, response = movie_recommender.plan_query(model, {**query, "plot_embedding": [1.0, 2.0]})
+    assert "'plot_embedding'" in response["error"]
+
+    # Phim không có embedding (dòng 0): truy vấn theo ID chỉ dùng điểm thưa
+    plan, _ = movie_recommender.plan_query(model, {"movie_id": str(store["table"]["id"][7])})
+    assert plan.get("embedding") is None
@@ -0,0 +1,50 @@
+# tests/ml/test_entity_index.py
+import numpy as np
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from entity_index import EntityIndex, tokenize
+
+
+def encoder(*labels):
+    return MultiLabelBinarizer(classes=sorted(labels)).fit([])
+
+
+FIELDS = ["genres", "cast"]
+ENCODERS = {
+    "genres": encoder("Drama", "Science Fiction", "Film-Noir"),
+    "cast": encoder("Tom Hanks", "Tom Hanks Jr.", "Hanks", "Meg Ryan"),
+}
+
+
+def labels(index, text):
+    return sorted((field, ENCODERS[field].classes_[col]) for field, col in index.match(text))
+
+
+def test_matches_multi_word_names_anywhere_in_the_query():
+    index = EntityIndex(ENCODERS, FIELDS)
+    assert index.max_ngram == 3
+    assert labels(index, "a science fiction movie with TOM HANKS, and meg ryan") == [
+        ("cast", "Hanks"), ("cast", "Meg Ryan"), ("cast", "Tom Hanks"), ("genres", "Science Fiction"),
+    ]
+    assert labels(index, "tom hanks jr.") == [("cast", "Hanks"), ("cast", "Tom Hanks"), ("cast", "Tom Hanks Jr.")]
+
+
+def test_partial_names_and_split_tokens_do_not_match():
+    index = EntityIndex(ENCODERS, FIELDS)
+    assert labels(index, "science and fiction") == []
+    assert labels(index, "tom") == []
+    assert labels(index, "film noir") == []
+    assert labels(index, "film-noir drama") == [("genres", "Drama"), ("genres", "Film-Noir")]
+    assert tokenize('"Meg Ryan"!') == ["meg", "ryan"]
+
+
+def test_query_vector_places_entities_before_text_columns():
+    index = EntityIndex(ENCODERS, FIELDS)
+    text_vector = np.array([[0.0, 0.5]])
+    vector = index.query_vector("meg ryan drama", text_vector, 9)
+    genres_width = len(ENCODERS["genres"].classes_)
+    meg_ryan = genres_width + list(ENCODERS["cast"].classes_).index("Meg Ryan")
+    drama = list(ENCODERS["genres"].classes_).index("Drama")
+    assert vector.shape == (1, 9)
+    assert sorted(vector.indices.tolist()) == sorted([drama, meg_ryan, 8])
+    assert vector[0, 8] == 0.5
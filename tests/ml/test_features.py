@@ -0,0 +1,59 @@
+# tests/ml/test_features.py
+from collections import Counter
+
+import numpy as np
+
+import feature_engine
+import features
+
+
+def block(store, field):
+    start = store["offsets"][field]
+    width = len(store["mlbs"][field].classes_)
+    return store["feature_matrix"][:, start:start + width]
+
+
+def test_parse_field_weights_and_min_label_count(monkeypatch):
+    assert features.parse_field_weights(" genres=2, cast=0.5,,plot=1") == {"genres": 2.0, "cast": 0.5, "plot": 1.0}
+    assert features.parse_field_weights(None) == {}
+
+    monkeypatch.setenv("RECOMMENDER_MIN_LABEL_COUNT", "3")
+    assert features.min_label_count("cast", compact_mode=True) == 3
+    assert features.min_label_count("genres", compact_mode=True) == 1
+    assert features.min_label_count("cast", compact_mode=False) == 1
+
+
+def test_compact_store_is_float32_and_prunes_rare_people(catalog_table):
+    full = feature_engine.build_store(catalog_table, workers=1, compact_mode=False)
+    compact = feature_engine.build_store(catalog_table, workers=1, compact_mode=True)
+
+    matrix = compact["feature_matrix"]
+    assert matrix.dtype == np.float32 and matrix.indices.dtype == np.int32 and matrix.indptr.dtype == np.int32
+    assert compact["memory"]["total_bytes"] < full["memory"]["total_bytes"]
+
+    for field in features.PRUNED_FIELDS:
+        counts = Counter(label for labels in catalog_table[field] for label in set(labels))
+        assert set(compact["mlbs"][field].classes_) == {label for label, count in counts.items() if count >= 2}
+        assert set(full["mlbs"][field].classes_) == set(counts)
+    # Các trường khác giữ mọi nhãn
+    assert list(compact["mlbs"]["genres"].classes_) == list(full["mlbs"]["genres"].classes_)
+    np.testing.assert_allclose(block(compact, "genres").toarray(), block(full, "genres").toarray())
+
+
+def test_field_weights_scale_blocks_and_query_vectors(catalog_table):
+    plain = feature_engine.build_store(catalog_table, workers=1, field_weights={})
+    weighted = feature_engine.build_store(catalog_table, workers=1, field_weights={"genres": 2.0, "cast": 0.5})
+    assert plain["column_weights"] is None
+
+    np.testing.assert_allclose(block(weighted, "genres").toarray(), 2 * block(plain, "genres").toarray())
+    np.testing.assert_allclose(block(weighted, "cast").toarray(), 0.5 * block(plain, "cast").toarray())
+    np.testing.assert_allclose(block(weighted, "directors").toarray(), block(plain, "directors").toarray())
+
+    # Vector sở thích được nhân cùng trọng số; vector theo ID đã có sẵn trong ma trận
+    genre = plain["mlbs"]["genres"].classes_[0]
+    query = weighted["offsets"]["genres"]
+    assert feature_engine.preference_vector(weighted, {"genres": [genre]})[0, query] == 2.0
+    assert feature_engine.preference_vector(plain, {"genres": [genre]})[0, query] == 1.0
+    np.testing.assert_allclose(feature_engine.by_id_vector(weighted, 3).toarray(),
+                               weighted["feature_matrix"][3].toarray())
+
@@ -0,0 +1,79 @@
+# tests/ml/test_incremental_indexer.py
+import numpy as np
+
+import feature_engine
+import incremental_indexer
+import movie_recommender
+import payload_store
+import preference_recommender
+import synthetic_catalog
+
+
+def render_all_rows(payloads, n):
+    rows = list(range(n))
+    return payloads.render(rows, [0.5] * n) + payloads.render(rows, [0.5] * n, compact=True)
+
+
+def test_incremental_update_reencodes_only_changed_payloads(monkeypatch):
+    docs = list(synthetic_catalog.generate_movies(300, seed=1))
+    monkeypatch.setattr(feature_engine, "_store", None)
+    monkeypatch.setattr(movie_recommender, "_model", None)
+    monkeypatch.setattr(preference_recommender, "current_model", None)
+    monkeypatch.setattr(payload_store, "payload_source", lambda: "memory")
+    movie_recommender.install_model(movie_recommender.build_model(feature_engine.prepare_table(docs), workers=1))
+    preference_recommender.get_current_model()
+
+    encoded = []
+    for module, name in ((movie_recommender, "movie_payload"), (preference_recommender, "preference_payload")):
+        payload_fn = getattr(module, name)
+        monkeypatch.setattr(module, name, lambda movie, fn=payload_fn: encoded.append(str(movie["id"])) or fn(movie))
+
+    edited = dict(docs[5], title="Edited title")
+    added = dict(next(iter(synthetic_catalog.generate_movies(1, seed=99))), title="Brand new")
+    incremental_indexer.IncrementalIndexer("mongodb://localhost/test").apply([edited, added], [docs[7]['_id']])
+
+    store = feature_engine.current_store()
+    assert sorted(encoded) == sorted([str(edited['_id']), str(added['_id'])] * 2)
+    assert movie_recommender._model["store"] is store
+    assert preference_recommender.current_model["store"] is store
+
+    # Kết quả giống hệt khi dựng lại toàn bộ
+    n = len(store["table"])
+    full_movie = payload_store.PayloadStore(store["table"], movie_recommender.movie_payload)
+    full_preference = payload_store.PayloadStore(store["table"], preference_recommender.preference_payload)
+    assert render_all_rows(movie_recommender._model["payloads"], n) == render_all_rows(full_movie, n)
+    assert render_all_rows(preference_recommender.current_model["payloads"], n) == render_all_rows(full_preference, n)
+
+
+def test_compact_refresh_applies_min_label_count_like_a_full_rebuild(monkeypatch):
+    monkeypatch.setenv("RECOMMENDER_MIN_LABEL_COUNT", "2")
+    docs = list(synthetic_catalog.generate_movies(300, seed=1))
+    fields = feature_engine.LIST_FIELDS
+
+    # "Solo Actor" chỉ có ở một phim: không thành cột. "Rare Actor" đã có ở một phim không
+    # thay đổi (bị bỏ lúc build) và được thêm vào một phim khác: đủ ngưỡng, phim cũ được mã hóa lại.
+    holder = dict(docs[3], cast=docs[3]["cast"] + ["Rare Actor"])
+    docs[3] = holder
+    table = feature_engine.prepare_table(docs)
+    store = feature_engine.build_store(table, workers=1, compact_mode=True)
+    encoders = dict(store["mlbs"], plot=store["tfidf_plot"])
+    assert "Rare Actor" not in store["mlbs"]["cast"].classes_
+
+    changed = [dict(docs[5], cast=docs[5]["cast"] + ["Rare Actor", "Solo Actor"])]
+    new_table, new_matrix, new_encoders, reencoded_ids = incremental_indexer.apply_changes(
+        table, store["feature_matrix"], encoders, fields, feature_engine.prepare_table(changed),
+        feature_engine.plot_text, field_weights=store["field_weights"])
+
+    cast = list(new_encoders["cast"].classes_)
+    assert "Rare Actor" in cast and "Solo Actor" not in cast
+    assert reencoded_ids == [holder["_id"]]
+    assert new_matrix.dtype == np.float32
+
+    # Từng dòng khớp với mã hóa của một lần build lại toàn bộ (cùng từ vựng TF-IDF)
+    rebuilt = feature_engine.build_store(new_table, workers=1, compact_mode=True)
+    for row in (3, len(new_table) - 1):
+        for field in ("cast", "directors", "writers"):
+            offset = sum(len(new_encoders[f].classes_) for f in fields[:fields.index(field)])
+            width = len(new_encoders[field].classes_)
+            labels = {new_encoders[field].classes_[col] for col in new_matrix[row, offset:offset + width].indices}
+            assert labels == set(new_table[field][row]) & set(rebuilt["mlbs"][field].classes_)
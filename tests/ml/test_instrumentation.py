@@ -0,0 +1,40 @@
+# tests/ml/test_instrumentation.py
+import socket
+import urllib.request
+
+import instrumentation
+
+
+class RecordingServer:
+    def __init__(self, address, handler):
+        self.server_address = address
+
+    def serve_forever(self):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_metrics_server_binds_loopback_by_default(monkeypatch):
+    monkeypatch.delenv("RECOMMENDER_METRICS_HOST", raising=False)
+    monkeypatch.setattr(instrumentation, "ThreadingHTTPServer", RecordingServer)
+    assert instrumentation.start_metrics_server(9464).server_address == ("127.0.0.1", 9464)
+
+    monkeypatch.setenv("RECOMMENDER_METRICS_HOST", "0.0.0.0")
+    assert instrumentation.start_metrics_server(9464).server_address == ("0.0.0.0", 9464)
+    assert instrumentation.start_metrics_server(0) is None
+
+
+def test_metrics_endpoint_answers_on_loopback(monkeypatch):
+    monkeypatch.delenv("RECOMMENDER_METRICS_HOST", raising=False)
+    server = instrumentation.start_metrics_server(free_port())
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5) as response:
+            assert response.status == 200
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,48 @@
+# tests/ml/test_ipc.py
+import io
+
+import pytest
+
+import ipc
+import recommender_server
+
+
+class TrickleStream(io.BytesIO):
+    """Stream trả về tối đa 3 byte mỗi lần đọc, như một pipe bị chia nhỏ."""
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else 3)
+
+
+def test_frames_round_trip_over_short_reads():
+    stream = TrickleStream(ipc.encode({"id": 1, "input": {"q": "phim hay"}}) + ipc.encode({"id": 2}))
+    codec, body = ipc.read_frame(stream)
+    assert ipc.decode(body, codec) == {"id": 1, "input": {"q": "phim hay"}}
+    codec, body = ipc.read_frame(stream)
+    assert (codec, ipc.decode(body, codec)) == (ipc.CODEC_JSON, {"id": 2})
+    assert ipc.read_frame(stream) is None
+
+
+def test_oversized_frame_is_skipped(monkeypatch):
+    monkeypatch.setenv("RECOMMENDER_MAX_FRAME_BYTES", "64")
+    stream = io.BytesIO(ipc.encode({"data": "x" * 200}) + ipc.encode({"id": 3}))
+    with pytest.raises(ipc.FrameError):
+        ipc.read_frame(stream)
+    # Stream vẫn đứng ở đầu khung kế tiếp
+    codec, body = ipc.read_frame(stream)
+    assert ipc.decode(body, codec) == {"id": 3}
+
+
+@pytest.mark.parametrize("cut", [2, ipc.HEADER.size + 4])
+def test_truncated_frame_raises(cut):
+    frame = ipc.encode({"id": 4, "input": {"movie_id": "abc"}})
+    with pytest.raises(ipc.FrameError):
+        ipc.read_frame(io.BytesIO(frame[:cut]))
+
+
+def test_server_reader_reports_bad_frames_and_stops_at_end(monkeypatch):
+    monkeypatch.setenv("RECOMMENDER_MAX_FRAME_BYTES", "64")
+    stream = io.BytesIO(ipc.encode({"data": "x" * 200}) + ipc.encode({"id": 5}) + ipc.encode({"id": 6})[:3])
+    assert list(recommender_server.read_frames(stream)) == [
+        (None, ipc.CODEC_JSON), ({"id": 5}, ipc.CODEC_JSON), (None, ipc.CODEC_JSON),
+    ]
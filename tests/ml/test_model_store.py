@@ -0,0 +1,104 @@
+# tests/ml/test_model_store.py
+import json
+import os
+
+import numpy as np
+import pytest
+
+import feature_engine
+import model_store
+import movie_recommender
+import preference_recommender
+import retrieval
+
+
+def save_with_payloads(store):
+    payloads = {
+        script.ARTIFACT_NAME: script.build_payloads(store) for script in (movie_recommender, preference_recommender)
+    }
+    feature_engine.save_store(store, payloads)
+    return payloads
+
+
+def answers(model, queries):
+    plans = [movie_recommender.plan_query(model, query)[0] for query in queries]
+    return movie_recommender.run_plans(model, plans)
+
+
+QUERIES = [
+    {"search_keywords": "love war", "num_recommendations": 5},
+    {"user_preferences": {"genres": ["Drama"], "min_year": 1990, "max_year": 2005}},
+]
+
+
+def test_saved_store_loads_without_rebuilding(store, artifact_dir, monkeypatch):
+    payloads = save_with_payloads(store)
+    version_dir = os.path.join(artifact_dir, feature_engine.ARTIFACT_NAME, store["version"])
+    assert not os.path.exists(os.path.join(version_dir, "records.pkl"))
+
+    # Tải kho không được tuần tự hóa lại kết quả hay sắp xếp lại các cột
+    def fail(*args, **kwargs):
+        raise AssertionError("rebuilt on load")
+    monkeypatch.setattr(movie_recommender, "movie_payload", fail)
+    monkeypatch.setattr(preference_recommender, "preference_payload", fail)
+    monkeypatch.setattr(np, "argsort", fail)
+    loaded = feature_engine.load_saved_store()
+    model = movie_recommender.model_from_store(loaded)
+    monkeypatch.undo()
+
+    assert isinstance(loaded["table"]["genres"][0], list)
+    for row in (0, 17, len(store["table"]) - 1):
+        assert loaded["table"].row(row) == store["table"].row(row)
+        movie_id = store["table"]["id"][row]
+        assert loaded["indices"][movie_id] == store["indices"][movie_id] == row
+    assert "000000000000000000000000" not in loaded["indices"]
+    np.testing.assert_array_equal(loaded["columns"]["year"].range_rows(1990, 2000, keep_missing=True),
+                                  store["columns"]["year"].range_rows(1990, 2000, keep_missing=True))
+
+    rows = list(range(len(store["table"])))
+    scores = [0.5] * len(rows)
+    assert model["payloads"].render(rows, scores) == payloads["movie"].render(rows, scores)
+    assert model["payloads"].render(rows, scores, compact=True) == payloads["movie"].render(rows, scores, compact=True)
+    assert answers(model, QUERIES) == answers(movie_recommender.model_from_store(store), QUERIES)
+
+
+@pytest.fixture
+def ivf_env(monkeypatch):
+    monkeypatch.setenv("RECOMMENDER_RETRIEVAL", "ivf")
+    monkeypatch.setenv("RECOMMENDER_ANN_LISTS", "8")
+    monkeypatch.setenv("RECOMMENDER_ANN_COMPONENTS", "16")
+
+
+def test_ivf_index_is_saved_with_the_store(store, ivf_env, monkeypatch):
+    store["retriever"] = retrieval.from_env(store["feature_matrix"], store["row_norms"])
+    save_with_payloads(store)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("IVF index rebuilt on load")
+    with monkeypatch.context() as patch:
+        patch.setattr(retrieval, "MiniBatchKMeans", fail)
+        loaded = feature_engine.load_saved_store()
+    assert isinstance(loaded["retriever"], retrieval.IVFRetriever)
+    assert loaded["retriever"].params() == store["retriever"].params()
+    assert answers(movie_recommender.model_from_store(loaded), QUERIES) == \
+        answers(movie_recommender.model_from_store(store), QUERIES)
+
+    # Tham số dựng chỉ mục khác: chỉ mục được dựng lại
+    monkeypatch.setenv("RECOMMENDER_ANN_LISTS", "4")
+    assert len(feature_engine.load_saved_store()["retriever"].centroids) == 4
+
+
+def test_version_without_column_layout_is_not_loaded(store, artifact_dir):
+    feature_engine.save_store(store)
+    version_dir = os.path.join(artifact_dir, feature_engine.ARTIFACT_NAME, store["version"])
+    meta_path = os.path.join(version_dir, "meta.json")
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    del meta["columns"]
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    with open(os.path.join(version_dir, "records.pkl"), "wb") as f:
+        f.write(b"not a pickle")
+
+    assert model_store.load_artifacts(feature_engine.ARTIFACT_NAME) is None
+    assert feature_engine.load_saved_store() is None
@@ -0,0 +1,115 @@
+# tests/ml/test_mongo_client.py
+import json
+import sys
+
+import pytest
+from bson import ObjectId
+
+import feature_engine
+import mongo_client
+import movie_recommender
+import payload_store
+import synthetic_catalog
+
+
+class FakeCursor(list):
+    def max_time_ms(self, ms):
+        self.max_time = ms
+        return self
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+
+    def find(self, query, projection):
+        self.queries.append((query, projection))
+        wanted = set(query["_id"]["$in"])
+        # $in không giữ thứ tự của danh sách id
+        return FakeCursor(reversed([
+            {field: doc[field] for field in ["_id", *projection] if field in doc}
+            for doc in self.documents if doc["_id"] in wanted
+        ]))
+
+
+class FakeClient:
+    created = []
+
+    def __init__(self, uri, maxPoolSize):
+        self.uri = uri
+        self.max_pool_size = maxPoolSize
+        self.collection = None
+        self.closed = False
+        FakeClient.created.append(self)
+
+    def __getitem__(self, name):
+        return {"embedded_movies": self.collection}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_clients(monkeypatch):
+    FakeClient.created = []
+    monkeypatch.setattr(mongo_client, "MongoClient", FakeClient)
+    monkeypatch.setattr(mongo_client, "_clients", {})
+    monkeypatch.delenv("RECOMMENDER_MONGO_ASYNC", raising=False)
+    monkeypatch.setenv("MONGODB_URI", "mongodb://localhost/movies?retryWrites=true")
+    return FakeClient
+
+
+def test_one_pooled_client_per_uri(fake_clients, monkeypatch):
+    monkeypatch.setenv("RECOMMENDER_MONGO_POOL_SIZE", "7")
+    client = mongo_client.get_client()
+    assert mongo_client.get_client("mongodb://localhost/movies?retryWrites=true") is client
+    assert client.max_pool_size == 7
+    other = mongo_client.get_client("mongodb://other/db")
+    assert other is not client and len(fake_clients.created) == 2
+    assert mongo_client.database_name("mongodb://localhost/movies?retryWrites=true") == "movies"
+
+    mongo_client.close_all()
+    assert client.closed and other.closed and mongo_client._clients == {}
+
+
+def test_find_by_ids_uses_one_in_query(fake_clients):
+    docs = [{"_id": ObjectId(), "title": f"T{i}", "plot": "p"} for i in range(5)]
+    mongo_client.get_client().collection = collection = FakeCollection(docs)
+
+    assert mongo_client.find_by_ids([], {"title": 1}) == {}
+    assert collection.queries == []
+
+    wanted = [docs[3]["_id"], docs[0]["_id"], ObjectId()]
+    found = mongo_client.find_by_ids(iter(wanted), {"_id": 1, "title": 1})
+    assert collection.queries == [({"_id": {"$in": wanted}}, {"_id": 1, "title": 1})]
+    assert found == {docs[3]["_id"]: {"_id": docs[3]["_id"], "title": "T3"},
+                     docs[0]["_id"]: {"_id": docs[0]["_id"], "title": "T0"}}
+
+
+def test_async_setting_without_motor_falls_back_to_pymongo(fake_clients, monkeypatch, capsys):
+    monkeypatch.setenv("RECOMMENDER_MONGO_ASYNC", "1")
+    monkeypatch.setattr(mongo_client, "_motor_missing", False)
+    monkeypatch.setitem(sys.modules, "motor", None)
+    docs = [{"_id": ObjectId(), "title": "A"}]
+    mongo_client.get_client().collection = FakeCollection(docs)
+    expected = {docs[0]["_id"]: {"_id": docs[0]["_id"], "title": "A"}}
+    assert mongo_client.find_by_ids([docs[0]["_id"]], {"title": 1}) == expected
+    assert mongo_client.find_by_ids([docs[0]["_id"]], {"title": 1}) == expected
+    # Chỉ báo một lần
+    assert capsys.readouterr().err.count("chưa cài gói motor") == 1
+
+
+def test_payloads_fetched_by_id_follow_ranking_order(fake_clients):
+    docs = list(synthetic_catalog.generate_movies(20, seed=4))
+    mongo_client.get_client().collection = collection = FakeCollection(docs)
+    table = feature_engine.prepare_table(docs)
+    payloads = payload_store.MongoPayloadStore(table["id"], movie_recommender.movie_payload,
+                                               feature_engine.prepare_table, feature_engine.PROJECTION)
+
+    rows = [9, 2, 15, 4]
+    rendered = payloads.render_all([(rows, [0.9, 0.7, 0.5, 0.3], False), ([2], [0.1], True)])
+    assert [movie["id"] for movie in json.loads(rendered[0])] == [str(table["id"][i]) for i in rows]
+    assert [movie["similarity"] for movie in json.loads(rendered[0])] == [0.9, 0.7, 0.5, 0.3]
+    # Một truy vấn cho cả lô
+    assert len(collection.queries) == 1
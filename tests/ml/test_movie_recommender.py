@@ -0,0 +1,33 @@
+# tests/ml/test_movie_recommender.py
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+import movie_recommender
+
+
+def n_by_n_recommendations(feature_matrix, row, n):
+    """Cách tính trước đây: ma trận Cosine N x N, sắp xếp cả dòng của phim rồi bỏ chính nó."""
+    similarity = cosine_similarity(feature_matrix)
+    ranked = sorted(enumerate(similarity[row]), key=lambda item: item[1], reverse=True)
+    return [(i, score) for i, score in ranked if i != row][:n]
+
+
+def test_by_id_scores_one_row_like_the_n_by_n_matrix(store):
+    model = movie_recommender.model_from_store(store)
+    for row in (0, 41, len(store["table"]) - 1):
+        plan, response = movie_recommender.plan_query(
+            model, {"movie_id": str(store["table"]["id"][row]), "num_recommendations": 10})
+        assert response is None and plan["exclude"] == row
+        assert plan["vector"].shape == (1, store["feature_matrix"].shape[1])
+
+        plan["k"] = 10
+        rows, scores = store["retriever"].rank([plan])[0]
+        expected = [(i, score) for i, score in n_by_n_recommendations(store["feature_matrix"], row, 10) if score > 0]
+        assert rows.tolist() == [i for i, _ in expected]
+        np.testing.assert_allclose(scores, [score for _, score in expected], rtol=1e-9)
+
+
+def test_unknown_and_malformed_ids_are_errors(store):
+    model = movie_recommender.model_from_store(store)
+    assert "error" in movie_recommender.plan_query(model, {"movie_id": "not-an-id"})[1]
+    assert "error" in movie_recommender.plan_query(model, {"movie_id": "000000000000000000000000"})[1]
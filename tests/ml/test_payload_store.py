@@ -0,0 +1,86 @@
+# tests/ml/test_payload_store.py
+import json
+
+import numpy as np
+
+import catalog
+import feature_engine
+import mongo_client
+import movie_recommender
+import payload_store
+import synthetic_catalog
+
+
+def legacy_result(movie, score, compact=False):
+    """Một kết quả như cách dựng trước đây: dict mới cho mỗi phim, similarity sau title."""
+    payload = movie_recommender.movie_payload(movie)
+    result = {"id": payload.pop("id"), "title": payload.pop("title"), "similarity": round(float(score), 4)}
+    result.update({key: value for key, value in payload.items()
+                   if not (compact and key in payload_store.HEAVY_FIELDS)})
+    return result
+
+
+def test_render_splices_similarity_into_prebuilt_fragments(catalog_table):
+    payloads = payload_store.PayloadStore(catalog_table, movie_recommender.movie_payload)
+    rows, scores = [4, 0, 17], [0.912345, 0.5, 0.0000001]
+
+    for compact in (False, True):
+        rendered = payloads.render(rows, scores, compact=compact)
+        assert isinstance(rendered, payload_store.RawJSON)
+        expected = [legacy_result(catalog_table.row(i), score, compact) for i, score in zip(rows, scores)]
+        # Cùng nội dung và cùng thứ tự trường
+        assert json.dumps(json.loads(rendered)) == json.dumps(expected)
+    assert "plot" not in json.loads(payloads.render(rows, scores, compact=True))[0]
+    assert payloads.render([], []) == "[]"
+
+
+def test_dumps_inserts_raw_json_verbatim():
+    response = {"results": [{"recommendations": payload_store.RawJSON('[{"id": "a"}]')}, {"message": "x"}]}
+    text = payload_store.dumps(response)
+    assert json.loads(text) == {"results": [{"recommendations": [{"id": "a"}]}, {"message": "x"}]}
+    assert payload_store.loads(response) == json.loads(text)
+
+
+def test_fragments_round_trip_through_arrays(catalog_table):
+    payloads = payload_store.PayloadStore(catalog_table, movie_recommender.movie_payload)
+    restored = payload_store.PayloadStore.from_arrays(payloads.arrays())
+    rows = list(range(len(catalog_table)))
+    scores = np.linspace(1, 0, len(rows))
+    assert restored.render(rows, scores) == payloads.render(rows, scores)
+    assert restored.render(rows, scores, compact=True) == payloads.render(rows, scores, compact=True)
+
+
+def test_mongo_payload_store_renders_the_same_json(monkeypatch):
+    docs = list(synthetic_catalog.generate_movies(30, seed=2))
+    table = feature_engine.prepare_table(docs)
+    by_id = {doc["_id"]: doc for doc in docs}
+    requests = []
+
+    def find_by_ids(ids, projection, mongodb_uri=None):
+        requests.append(list(ids))
+        return {movie_id: {field: by_id[movie_id][field] for field in projection if field in by_id[movie_id]}
+                for movie_id in ids if movie_id != docs[3]["_id"]}
+
+    monkeypatch.setattr(mongo_client, "find_by_ids", find_by_ids)
+    memory = payload_store.PayloadStore(table, movie_recommender.movie_payload)
+    mongo = payload_store.MongoPayloadStore(table["id"], movie_recommender.movie_payload,
+                                            feature_engine.prepare_table, feature_engine.PROJECTION)
+
+    items = [([1, 2, 5], [0.9, 0.8, 0.7], False), ([5, 7], [0.6, 0.5], True)]
+    assert mongo.render_all(items) == memory.render_all(items)
+    # Một truy vấn $in cho cả lô, mỗi id một lần
+    assert requests == [[table["id"][i] for i in (1, 2, 5, 7)]]
+    # Phim đã bị xóa khỏi collection bị bỏ khỏi kết quả
+    assert [movie["id"] for movie in json.loads(mongo.render([3, 1], [0.9, 0.8]))] == [str(table["id"][1])]
+
+
+def test_build_store_follows_payload_source(catalog_table, monkeypatch):
+    args = (catalog_table, movie_recommender.movie_payload, feature_engine.prepare_table, feature_engine.PROJECTION)
+    assert isinstance(payload_store.build_store(*args), payload_store.PayloadStore)
+    monkeypatch.setenv("RECOMMENDER_PAYLOAD_SOURCE", "mongo")
+    assert isinstance(payload_store.build_store(*args), payload_store.MongoPayloadStore)
+    monkeypatch.delenv("RECOMMENDER_PAYLOAD_SOURCE")
+    # Bảng thiếu các trường chỉ dùng cho kết quả: lấy kết quả từ MongoDB
+    slim = catalog.MovieTable({name: column for name, column in catalog_table.columns.items() if name != "title"},
+                              catalog_table.numeric_fields)
+    assert isinstance(payload_store.build_store(slim, *args[1:]), payload_store.MongoPayloadStore)
@@ -0,0 +1,61 @@
+# tests/ml/test_ranking.py
+import numpy as np
+
+import ranking
+
+
+def test_top_k_orders_ties_by_index():
+    scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5])
+    rows, top = ranking.top_k(scores, 4)
+    assert rows.tolist() == [1, 3, 0, 2]
+    assert top.tolist() == [0.9, 0.9, 0.5, 0.5]
+
+
+def test_top_k_cuts_ties_at_the_kth_score():
+    scores = np.full(10, 0.3)
+    rows, _ = ranking.top_k(scores, 3)
+    assert rows.tolist() == [0, 1, 2]
+
+
+def test_top_k_exclude_and_mask():
+    scores = np.array([0.8, 0.7, 0.6, 0.5, 0.4])
+    assert ranking.top_k(scores, 2, exclude=0)[0].tolist() == [1, 2]
+    assert ranking.top_k(scores, 2, exclude=[0, 2])[0].tolist() == [1, 3]
+    mask = np.array([True, False, True, False, True])
+    assert ranking.top_k(scores, 5, exclude=0, mask=mask)[0].tolist() == [2, 4]
+    # exclude không thay đổi mảng điểm của người gọi
+    assert scores[0] == 0.8
+
+
+def test_top_k_with_k_larger_than_candidates():
+    scores = np.array([0.0, 0.2, -0.1, 0.4])
+    rows, top = ranking.top_k(scores, 10)
+    assert rows.tolist() == [3, 1]
+    assert top.tolist() == [0.4, 0.2]
+    rows, top = ranking.top_k(scores, 0)
+    assert rows.size == 0 and top.size == 0
+    assert ranking.top_k(np.zeros(0), 5)[0].size == 0
+
+
+def test_sorted_column_range_skips_missing_values():
+    column = ranking.SortedColumn([2001, np.nan, 1995, 2010, np.nan, 2001])
+    assert column.range_rows(2000, 2005).tolist() == [0, 5]
+    assert column.range_rows(None, 2000).tolist() == [2]
+    assert column.range_rows(2001, None).tolist() == [0, 3, 5]
+    assert column.range_rows().tolist() == [0, 2, 3, 5]
+    assert column.range_rows(2020, 2030).size == 0
+
+
+def test_sorted_column_keep_missing():
+    column = ranking.SortedColumn([2001, np.nan, 1995, 2010, np.nan])
+    assert column.range_rows(2000, 2005, keep_missing=True).tolist() == [0, 1, 4]
+    assert column.range_rows(2020, None, keep_missing=True).tolist() == [1, 4]
+    empty = ranking.SortedColumn([np.nan, np.nan])
+    assert empty.range_rows(1990, 2000).size == 0
+    assert empty.range_rows(1990, 2000, keep_missing=True).tolist() == [0, 1]
+
+
+def test_sorted_column_with_saved_order():
+    values = [3.0, np.nan, 1.0, 2.0]
+    column = ranking.SortedColumn(values, ranking.SortedColumn(values).order)
+    assert column.range_rows(1.5, 3.0, keep_missing=True).tolist() == [0, 1, 3]
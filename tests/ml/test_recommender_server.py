@@ -0,0 +1,148 @@
+# tests/ml/test_recommender_server.py
+import io
+import json
+import threading
+
+import feature_engine
+import movie_recommender
+import recommender_server
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def send(self, message, codec=None):
+        with self.lock:
+            self.messages.append(message)
+
+    def by_id(self):
+        return {message.get("id"): message for message in self.messages}
+
+
+def test_cancel_is_read_while_workers_are_busy(monkeypatch):
+    reader_done = threading.Event()
+    handled = []
+
+    def slow(input_data):
+        handled.append(input_data["n"])
+        if input_data["n"] == 1:
+            # Chỉ xong khi luồng đọc đã đọc hết, kể cả lệnh hủy phía sau
+            return {"reader_done": reader_done.wait(timeout=5)}
+        return {"n": input_data["n"]}
+
+    monkeypatch.setitem(recommender_server.HANDLERS, "slow.py", slow)
+
+    def requests():
+        yield {"id": 1, "script": "slow.py", "input": {"n": 1}}, None
+        yield {"id": 2, "script": "slow.py", "input": {"n": 2}}, None
+        yield {"id": 3, "script": "slow.py", "input": {"n": 3}}, None
+        yield {"op": "cancel", "target": 2}, None
+        reader_done.set()
+
+    writer = CollectingWriter()
+    recommender_server.serve(requests(), writer, workers=1, max_inflight=1)
+
+    responses = writer.by_id()
+    assert responses[1]["result"] == {"reader_done": True}
+    assert responses[2]["cancelled"] is True
+    assert responses[3]["result"] == {"n": 3}
+    assert handled == [1, 3]
+
+
+def test_expired_requests_are_skipped_when_dequeued(monkeypatch):
+    release = threading.Event()
+    handled = []
+
+    def handler(input_data):
+        handled.append(input_data["n"])
+        if input_data["n"] == 1:
+            release.wait(timeout=5)
+        return {}
+
+    monkeypatch.setitem(recommender_server.HANDLERS, "h.py", handler)
+
+    def requests():
+        yield {"id": 1, "script": "h.py", "input": {"n": 1}}, None
+        yield {"id": 2, "script": "h.py", "input": {"n": 2}, "timeout_ms": 1}, None
+        threading.Timer(0.05, release.set).start()
+
+    writer = CollectingWriter()
+    recommender_server.serve(requests(), writer, workers=1, max_inflight=1)
+
+    assert writer.by_id()[2]["cancelled"] is True
+    assert handled == [1]
+
+
+def test_full_queue_refuses_new_requests(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setitem(recommender_server.HANDLERS, "h.py", lambda input_data: {"ok": release.wait(timeout=5)})
+
+    def requests():
+        for request_id in range(1, 5):
+            yield {"id": request_id, "script": "h.py", "input": {}}, None
+        release.set()
+
+    writer = CollectingWriter()
+    recommender_server.serve(requests(), writer, workers=1, max_inflight=1, max_queued=1)
+
+    responses = writer.by_id()
+    busy = [request_id for request_id, message in responses.items() if message.get("busy")]
+    assert len(responses) == 4
+    assert busy and all("error" in responses[request_id] for request_id in busy)
+    assert any(message.get("result") == {"ok": True} for message in responses.values())
+
+
+def test_malformed_control_fields_are_rejected_without_stopping_the_reader(monkeypatch):
+    monkeypatch.setitem(recommender_server.HANDLERS, "h.py", lambda input_data: {"n": input_data["n"]})
+
+    def requests():
+        yield {"id": 1, "op": "ping", "timeout_ms": "abc"}, None
+        yield {"id": [1], "op": "ping"}, None
+        yield {"id": 2, "op": "ping", "timeout_ms": float("nan")}, None
+        yield {"id": 3, "script": "h.py", "input": {"n": 3}, "timeout_ms": -5}, None
+        yield {"id": 4, "op": "cancel", "target": {"id": 1}}, None
+        yield {"id": True, "op": "ping"}, None
+        yield {"id": 5, "script": "h.py", "input": {"n": 5}, "timeout_ms": 1000}, None
+        yield {"id": "6", "op": "ping"}, None
+
+    writer = CollectingWriter()
+    recommender_server.serve(requests(), writer, workers=1)
+
+    responses = writer.by_id()
+    assert all("error" in responses[request_id] for request_id in (1, 2, 3, 4))
+    assert "timeout_ms" in responses[1]["error"] and "target" in responses[4]["error"]
+    # id không hợp lệ thì phản hồi lỗi mang id None
+    assert [message for message in writer.messages if message["id"] is None and "'id'" in message["error"]]
+    assert responses[5]["result"] == {"n": 5}
+    assert responses["6"]["result"] == {"status": "ok"}
+    assert len(writer.messages) == 8
+
+
+def test_json_lines_protocol_answers_each_request_by_id(store, monkeypatch):
+    monkeypatch.setenv("MONGODB_URI", "mongodb://localhost/test")
+    monkeypatch.setattr(feature_engine, "_store", store)
+    monkeypatch.setattr(movie_recommender, "_model", None)
+    movie_id = str(store["table"]["id"][0])
+    stdin = io.StringIO("\n".join([
+        json.dumps({"id": 1, "op": "ping"}),
+        "",
+        "{not json",
+        json.dumps({"id": 2, "script": "movie_recommender.py", "input": {"movie_id": movie_id, "num_recommendations": 3}}),
+        json.dumps({"id": 3, "script": "other.py", "input": {}}),
+        json.dumps({"id": 4, "script": "movie_recommender.py", "input": {"movie_id": "not-an-id"}}),
+    ]) + "\n")
+    stdout = io.StringIO()
+
+    recommender_server.serve(recommender_server.read_lines(stdin), recommender_server.ResponseWriter(stdout))
+
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    responses = {message["id"]: message for message in lines}
+    assert len(lines) == 5
+    assert responses[1]["result"] == {"status": "ok"}
+    assert responses[None]["error"]
+    recommendations = responses[2]["result"]["recommendations"]
+    assert len(recommendations) == 3 and movie_id not in [movie["id"] for movie in recommendations]
+    assert "other.py" in responses[3]["error"]
+    assert "error" in responses[4]["result"]
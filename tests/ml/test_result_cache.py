@@ -0,0 +1,145 @@
+# tests/ml/test_result_cache.py
+import pickle
+import threading
+
+import numpy as np
+import pytest
+
+import feature_engine
+import movie_recommender
+import result_cache
+
+
+class FakeRedis:
+    """Client giả lập tại chỗ thay cho Redis: chỉ cần get và set(ex=)."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def ranked(*rows):
+    return np.array(rows, dtype=np.intp), np.linspace(1.0, 0.5, len(rows))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_local_cache_expires_after_ttl(clock):
+    cache = result_cache.LocalCache(max_entries=4, ttl=10)
+    cache.set("a", ranked(1, 2))
+    clock[0] += 9
+    assert cache.get("a") is not None
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = result_cache.LocalCache(max_entries=2, ttl=60)
+    cache.set("a", ranked(1))
+    cache.set("b", ranked(2))
+    cache.get("a")
+    cache.set("c", ranked(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+
+
+def test_shared_cache_round_trips_arrays():
+    client = FakeRedis()
+    shared = result_cache.SharedCache(client, ttl=60)
+    rows, scores = ranked(4, 7, 9)
+    shared.set("k", (rows, scores))
+    got_rows, got_scores = shared.get("k")
+    np.testing.assert_array_equal(got_rows, rows)
+    np.testing.assert_array_equal(got_scores, scores)
+
+
+class Exploit:
+    def __reduce__(self):
+        return (exec, ("raise SystemExit('unpickled')",))
+
+
+def test_shared_cache_never_unpickles():
+    client = FakeRedis()
+    shared = result_cache.SharedCache(client, ttl=60)
+    client.data["recommender:k"] = pickle.dumps(Exploit())
+    assert shared.get("k") is None
+    assert shared.errors == 1
+
+
+def test_key_depends_on_model_version():
+    query = {"search_keywords": "space war"}
+    assert result_cache.make_key("movie", "v1", query) == result_cache.make_key("movie", "v1", dict(query))
+    assert result_cache.make_key("movie", "v1", query) != result_cache.make_key("movie", "v2", query)
+
+
+def test_counters_are_exact_under_concurrency():
+    cache = result_cache.ResultCache(result_cache.LocalCache(16, 60), result_cache.SharedCache(FakeRedis(), 60))
+    cache.set("hit", ranked(1))
+
+    def worker():
+        for _ in range(500):
+            cache.get("hit")
+            cache.get("miss")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats["hits"] == 4000
+    assert stats["misses"] == 4000
+
+
+@pytest.fixture
+def movie_cache(monkeypatch):
+    client = FakeRedis()
+    cache = result_cache.ResultCache(result_cache.LocalCache(16, 60), result_cache.SharedCache(client, 60))
+    monkeypatch.setattr(movie_recommender, "_cache", cache)
+    monkeypatch.setattr(movie_recommender, "_model", None)
+    monkeypatch.setattr(feature_engine, "_store", None)
+    return cache, client
+
+
+def answer(model, query):
+    plan, _ = movie_recommender.plan_query(model, query)
+    return movie_recommender.run_plans(model, [plan])[0]
+
+
+def test_install_model_invalidates_and_versions_keys(movie_cache, catalog_table):
+    cache, client = movie_cache
+    query = {"search_keywords": "love war", "num_recommendations": 5}
+
+    first = movie_recommender.build_model(catalog_table, workers=1)
+    movie_recommender.install_model(first)
+    expected = answer(first, query)
+    assert answer(first, query) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(client.data) == 1
+
+    # Mô hình mới: cache trong tiến trình được xóa, khóa cũ trong cache dùng chung không được dùng lại
+    second = movie_recommender.build_model(catalog_table, workers=1)
+    second["version"] = first["version"] + "-next"
+    movie_recommender.install_model(second)
+    assert len(cache.local) == 0
+    assert answer(second, query) == expected
+    assert (cache.hits, cache.misses, cache.shared_hits) == (1, 2, 0)
+    assert len(client.data) == 2
+
+    # Tiến trình khác (cache trong tiến trình trống) dùng được mục của cache dùng chung
+    cache.local.clear()
+    assert answer(second, query) == expected
+    assert (cache.hits, cache.shared_hits) == (2, 1)
@@ -0,0 +1,58 @@
+# tests/ml/test_retrieval.py
+import numpy as np
+
+import retrieval
+import similar_movies
+
+
+def by_id_plans(store, k=10, step=5):
+    return [similar_movies.by_id_plan(store, row, k) for row in range(0, len(store["table"]), step)]
+
+
+def recall(exact, approximate):
+    return np.mean([len(set(e[0]) & set(a[0])) / max(1, len(e[0])) for e, a in zip(exact, approximate)])
+
+
+def ivf(store, **params):
+    params = {"n_components": 32, "n_lists": 16, "rerank": 200, **params}
+    return retrieval.IVFRetriever(store["feature_matrix"], store["row_norms"], **params)
+
+
+def test_ivf_recall_against_exact_grows_with_probes(store):
+    plans = by_id_plans(store)
+    exact = retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"]).rank(plans)
+    recalls = [recall(exact, ivf(store, n_probe=n_probe).rank(plans)) for n_probe in (2, 4, 8)]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] >= 0.85
+
+
+def test_ivf_probing_every_list_matches_exact(store):
+    plans = by_id_plans(store)
+    exact = retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"]).rank(plans)
+    full = ivf(store, n_probe=16, rerank=len(store["table"])).rank(plans)
+    for (exact_rows, exact_scores), (rows, scores) in zip(exact, full):
+        np.testing.assert_array_equal(rows, exact_rows)
+        np.testing.assert_allclose(scores, exact_scores)
+
+
+def test_ivf_falls_back_to_exact_when_candidates_are_short(store):
+    retriever = ivf(store, n_probe=1, rerank=20)
+    exact = retrieval.ExactRetriever(store["feature_matrix"], store["row_norms"])
+    plan = similar_movies.by_id_plan(store, 3, 10)
+    plan["candidates"] = np.arange(0, len(store["table"]), 7)
+    rows, scores = retriever.rank([dict(plan)])[0]
+    exact_rows, exact_scores = exact.rank([dict(plan)])[0]
+    assert len(rows) == 10
+    np.testing.assert_array_equal(rows, exact_rows)
+    np.testing.assert_allclose(scores, exact_scores)
+    assert set(rows.tolist()) <= set(plan["candidates"].tolist())
+
+
+def test_saved_index_arrays_rebuild_the_same_retriever(store):
+    plans = by_id_plans(store, step=17)
+    built = ivf(store, n_probe=4)
+    loaded = ivf(store, n_probe=4, index=built.index_arrays())
+    assert loaded.params() == built.params()
+    for (rows, scores), (loaded_rows, loaded_scores) in zip(built.rank(plans), loaded.rank(plans)):
+        np.testing.assert_array_equal(loaded_rows, rows)
+        np.testing.assert_allclose(loaded_scores, scores)
@@ -0,0 +1,69 @@
+# tests/ml/test_shared_store.py
+import numpy as np
+import pytest
+
+import feature_engine
+import movie_recommender
+import payload_store
+import preference_recommender
+
+
+@pytest.fixture
+def served_store(store, monkeypatch):
+    monkeypatch.setenv("MONGODB_URI", "mongodb://localhost/test")
+    monkeypatch.setattr(feature_engine, "_store", store)
+    monkeypatch.setattr(movie_recommender, "_model", None)
+    monkeypatch.setattr(preference_recommender, "current_model", None)
+    return store
+
+
+def preference_results(queries):
+    results = preference_recommender.get_batch_preference_recommendations(queries)
+    return payload_store.loads(results)["results"]
+
+
+def test_both_recommenders_serve_the_same_store(served_store):
+    movie_model = movie_recommender.get_model("mongodb://localhost/test")
+    preference_model = preference_recommender.get_current_model()
+    assert movie_model["store"] is served_store and preference_model["store"] is served_store
+    # Ma trận, bộ mã hóa và chỉ mục không bị sao chép cho từng script
+    for key in ("feature_matrix", "mlbs", "retriever", "table"):
+        assert movie_model[key] is served_store[key] and preference_model[key] is served_store[key]
+    # Mô hình được cache cho tới khi kho đổi
+    assert movie_recommender.get_model("mongodb://localhost/test") is movie_model
+    assert preference_recommender.get_current_model() is preference_model
+
+
+def test_installing_a_store_switches_both_recommenders(served_store, catalog_table):
+    old_movie = movie_recommender.get_model("mongodb://localhost/test")
+    old_preference = preference_recommender.get_current_model()
+
+    rebuilt = feature_engine.build_store(catalog_table, workers=1)
+    feature_engine.install_store(rebuilt)
+    assert movie_recommender.get_model("mongodb://localhost/test")["store"] is rebuilt
+    assert preference_recommender.get_current_model()["store"] is rebuilt
+    assert old_movie["store"] is served_store and old_preference["store"] is served_store
+
+
+def test_preference_labels_match_without_spaces(served_store):
+    person = served_store["table"]["cast"][0][0]
+    assert " " in person
+    spaced, joined, unknown = preference_results([
+        {"cast": [person], "num_recommendations": 5},
+        {"cast": person.replace(" ", ""), "num_recommendations": 5},
+        {"cast": ["Nobody Here"], "num_recommendations": 5},
+    ])
+    assert spaced == joined and spaced["recommendations"]
+    assert person.replace(" ", "") in spaced["recommendations"][0]["cast"]
+    assert "recommendations" not in unknown
+
+
+def test_mode_weights_apply_only_to_their_mode(catalog_table):
+    store = feature_engine.build_store(catalog_table, workers=1, field_weights={})
+    store = feature_engine.prepare_store(store, {"by_id": {"genres": 3.0}})
+    start = store["offsets"]["genres"]
+    genres = slice(start, start + len(store["mlbs"]["genres"].classes_))
+    row = store["feature_matrix"][4].toarray()
+    np.testing.assert_allclose(feature_engine.by_id_vector(store, 4).toarray()[:, genres], 3 * row[:, genres])
+    genre = store["mlbs"]["genres"].classes_[0]
+    assert feature_engine.preference_vector(store, {"genres": [genre]})[0, start] == 1.0
@@ -0,0 +1,75 @@
+# tests/ml/test_similar_movies.py
+import numpy as np
+
+import feature_engine
+import incremental_indexer
+import retrieval
+import similar_movies
+import synthetic_catalog
+
+
+def live(store, row, n):
+    """Top-n láng giềng chấm điểm trực tiếp, như khi không có bảng."""
+    return store["retriever"].rank([similar_movies.by_id_plan(store, row, n)])[0]
+
+
+def assert_matches_live(table, store, n):
+    for row in range(len(store["table"])):
+        found = table.lookup(row, n)
+        assert found is not None, row
+        rows, scores = live(store, row, n)
+        np.testing.assert_array_equal(found[0], rows)
+        np.testing.assert_allclose(found[1], scores, rtol=1e-5, atol=1e-6)
+
+
+def test_lookup_matches_live_scoring(store):
+    table = similar_movies.build_table(store, k=8)
+    assert_matches_live(table, store, 8)
+    assert_matches_live(table, store, 3)
+    # Cần nhiều hơn K láng giềng: bảng không trả lời
+    assert table.lookup(0, 9) is None
+    assert table.lookup(len(store["table"]), 3) is None
+
+
+def test_update_matches_live_scoring_after_changes(monkeypatch):
+    docs = list(synthetic_catalog.generate_movies(300, seed=1))
+    monkeypatch.setattr(feature_engine, "_store", None)
+    store = feature_engine.build_store(feature_engine.prepare_table(docs), workers=1)
+    store["similar"] = similar_movies.build_table(store, k=8)
+    feature_engine.install_store(store)
+
+    # Phim đã sửa mang nhãn của một phim khác nên trở thành láng giềng mới của nhiều phim
+    edited = dict(docs[5], genres=docs[9]["genres"], cast=docs[9]["cast"], directors=docs[9]["directors"])
+    added = dict(docs[12], _id=next(iter(synthetic_catalog.generate_movies(1, seed=99)))["_id"])
+    incremental_indexer.IncrementalIndexer("mongodb://localhost/test").apply([edited, added], [docs[7]["_id"]])
+
+    updated = feature_engine.current_store()
+    assert updated is not store and len(updated["table"]) == len(store["table"])
+    assert_matches_live(updated["similar"], updated, 8)
+
+
+def test_load_table_checks_scoring_parameters(store, monkeypatch):
+    similar_movies.save_table(store, k=5)
+    assert similar_movies.load_table(store) is not None
+
+    # Cùng phiên bản kho nhưng khác backend truy hồi hoặc tham số của nó: không dùng bảng
+    monkeypatch.setenv("RECOMMENDER_RETRIEVAL", "ivf")
+    monkeypatch.setenv("RECOMMENDER_ANN_LISTS", "8")
+    store["retriever"] = retrieval.from_env(store["feature_matrix"], store["row_norms"])
+    assert similar_movies.load_table(store) is None
+    similar_movies.save_table(store, k=5)
+    assert similar_movies.load_table(store) is not None
+
+    monkeypatch.setenv("RECOMMENDER_ANN_LISTS", "12")
+    store["retriever"] = retrieval.from_env(store["feature_matrix"], store["row_norms"])
+    assert similar_movies.load_table(store) is None
+
+    monkeypatch.setenv("RECOMMENDER_RETRIEVAL", "exact")
+    store["retriever"] = retrieval.from_env(store["feature_matrix"], store["row_norms"])
+    similar_movies.save_table(store, k=5)
+    store["retriever"].dense_weight = 0.5
+    assert similar_movies.load_table(store) is None
+    store["retriever"].dense_weight = 0.0
+
+    store["mode_field_weights"]["by_id"] = {**store["mode_field_weights"]["by_id"], "cast": 2.0}
+    assert similar_movies.load_table(store) is None